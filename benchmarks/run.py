@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+"""
+Offline benchmarks of conda-shell, against synthetic environment stores and a
+fake conda backend (see `synthetic`). Run from the repository root:
+
+    python benchmarks/run.py -o results.json
+    python benchmarks/run.py --compare results.json
+
+Each benchmark is timed several times; the JSON results hold the individual
+timings and their minimum/median/mean, along with the parameters and the
+machine they were measured on.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+BENCH_DPATH = os.path.dirname(os.path.abspath(__file__))
+REPO_DPATH = os.path.dirname(BENCH_DPATH)
+sys.path[:0] = [REPO_DPATH, BENCH_DPATH]
+
+import synthetic  # noqa: E402
+from conda_shell.profiling import clock  # noqa: E402
+from conda_shell.utils import CACHE_DNAME  # noqa: E402
+
+
+RESULTS_VERSION = 1
+DEFAULT_SIZES = (10, 100, 1000)
+# Variables which would point conda-shell away from the synthetic stores
+CLEARED_VARS = ('CONDA_SHELL_ENV_NAME', 'CONDA_SHELL_LOCAL_STORE',
+                'CONDA_ENVS_PATH', 'CONDA_SHELL_SHARED_STORE',
+                'CONDA_SHELL_SNAPSHOT_DIR', 'CONDA_SHELL_SNAPSHOT_MIRROR',
+                'CONDA_SHELL_GC_MAX_BYTES', 'CONDA_SHELL_GC_MAX_ENVS',
+                'CONDA_SHELL_PROFILE', 'CONDA_SHELL_ENV_PREFIX')
+
+
+def measure(fn, repeat, setup=None):
+    """Call fn repeat times (after setup, which isn't timed) and return the
+    timings in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = clock()
+        fn()
+        timings.append(clock() - start)
+    return timings
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    middle = len(ordered) // 2
+    median = (ordered[middle] if len(ordered) % 2 else
+              (ordered[middle - 1] + ordered[middle]) / 2)
+    return {
+        'min': ordered[0],
+        'median': median,
+        'mean': sum(ordered) / len(ordered),
+        'timings': timings,
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """Discard what conda-shell prints to stderr for the duration of the
+    context.
+    """
+    old_stderr = sys.stderr
+    with open(os.devnull, 'w') as devnull:
+        sys.stderr = devnull
+        try:
+            yield
+        finally:
+            sys.stderr = old_stderr
+
+
+class Bench(object):
+    """A fake conda installation in a temporary directory, whose `envs`
+    directory is a synthetic store of n_envs environments.
+    """
+
+    def __init__(self, n_envs, n_history_lines):
+        self.conda_dpath = tempfile.mkdtemp(prefix='conda-shell-bench-')
+        self.store_dpath = os.path.join(self.conda_dpath, 'envs')
+        self.env_specs = synthetic.make_store(
+            self.store_dpath, n_envs, n_history_lines=n_history_lines
+        )
+        synthetic.install_fake_conda(self.conda_dpath)
+
+    def close(self):
+        shutil.rmtree(self.conda_dpath)
+
+    def clear_cache(self):
+        """Remove conda-shell's index and history cache."""
+        cache_dpath = os.path.join(self.store_dpath, CACHE_DNAME)
+        if os.path.isdir(cache_dpath):
+            shutil.rmtree(cache_dpath)
+
+    def touch_store(self):
+        """Make the index stale, while keeping the history cache."""
+        os.utime(self.store_dpath, None)
+
+    def cli(self):
+        return synthetic.FakeCondaCLI()
+
+
+def bench_lookup(results, sizes, n_history_lines, repeat):
+    """Latency of finding an environment to reuse, with no index or history
+    cache (cold), a stale index (stale), and an up-to-date index (warm).
+    """
+    from conda_shell import main
+    for n_envs in sizes:
+        bench = Bench(n_envs, n_history_lines)
+        try:
+            cli = bench.cli()
+            # The oldest environment is scanned last
+            hit = main.parse_cmds(['conda-shell'] + bench.env_specs[0], cli)
+            miss = main.parse_cmds(['conda-shell', 'missing=1.0'], cli)
+
+            def find(cmds):
+                return lambda: main.find_env(cmds, cli)
+            for name, setup in (('cold', bench.clear_cache),
+                                ('stale', bench.touch_store),
+                                ('warm', None)):
+                main.find_env(hit, cli)
+                results['lookup/{}/n={}'.format(name, n_envs)] = measure(
+                    find(hit), repeat, setup=setup
+                )
+            results['lookup/miss/n={}'.format(n_envs)] = measure(
+                find(miss), repeat
+            )
+        finally:
+            bench.close()
+
+
+def bench_startup(results, sizes, n_history_lines, repeat):
+    """Wall time of a whole conda-shell process which reuses an environment
+    and runs `true` in it, with (warm) and without (cold) conda-shell's
+    caches. `python` is the interpreter's own startup time, for reference.
+    """
+    env_vars = os.environ.copy()
+    for key in CLEARED_VARS:
+        env_vars.pop(key, None)
+    env_vars['PYTHONPATH'] = os.pathsep.join(
+        [REPO_DPATH, BENCH_DPATH, env_vars.get('PYTHONPATH', '')]
+    ).rstrip(os.pathsep)
+    results['startup/python'] = measure(
+        lambda: subprocess.check_call([sys.executable, '-c', 'pass']), repeat
+    )
+    for n_envs in sizes:
+        bench = Bench(n_envs, n_history_lines)
+        try:
+            env_vars['CONDA_SHELL_BENCH'] = bench.conda_dpath
+            argv = ([sys.executable, os.path.join(BENCH_DPATH,
+                                                  'synthetic.py')] +
+                    bench.env_specs[0] + ['--run', 'true'])
+
+            def run():
+                with open(os.devnull, 'w') as devnull:
+                    subprocess.check_call(argv, env=env_vars, stderr=devnull)
+            for name, setup in (('cold', bench.clear_cache),
+                                ('warm', None)):
+                run()
+                results['startup/{}/n={}'.format(name, n_envs)] = measure(
+                    run, repeat, setup=setup
+                )
+        finally:
+            bench.close()
+
+
+def bench_shebang(results, sizes, n_history_lines, repeat):
+    """Parsing the shebang lines of scripts with 1 and 5 `#!conda-shell`
+    lines, followed by 10000 lines of code.
+    """
+    from conda_shell import main
+    bench = Bench(0, n_history_lines)
+    try:
+        cli = bench.cli()
+        for n_lines in (1, 5):
+            script_fpath = os.path.join(bench.conda_dpath,
+                                        'script{}.py'.format(n_lines))
+            with open(script_fpath, 'w') as fp:
+                fp.write('#!/usr/bin/env conda-shell\n')
+                fp.write('#!conda-shell -i python python=3.6\n')
+                for idx in range(1, n_lines):
+                    fp.write('#!conda-shell pkg{:03d}=1.0\n'.format(idx))
+                fp.write('print("hello")\n' * 10000)
+            results['shebang/lines={}'.format(n_lines)] = measure(
+                lambda: main.parse_script_cmds(script_fpath, cli), repeat
+            )
+    finally:
+        bench.close()
+
+
+def bench_create(results, sizes, n_history_lines, repeat):
+    """conda-shell's own work when creating an environment (the fake conda
+    backend doesn't solve unless $CONDA_SHELL_BENCH_SOLVE_TIME is set), in
+    stores of various sizes.
+    """
+    from conda_shell import main
+    for n_envs in sizes:
+        bench = Bench(n_envs, n_history_lines)
+        try:
+            cli = bench.cli()
+            main.find_env(main.parse_cmds(['conda-shell', 'python=3.6'], cli),
+                          cli)
+
+            def create():
+                cmds = main.parse_cmds(['conda-shell', 'python=3.6'], cli)
+                with quiet():
+                    main.create_env(cmds, cli)
+            results['create/n={}'.format(n_envs)] = measure(create, repeat)
+        finally:
+            bench.close()
+
+
+BENCHMARKS = {
+    'lookup': bench_lookup,
+    'startup': bench_startup,
+    'shebang': bench_shebang,
+    'create': bench_create,
+}
+
+
+def get_git_revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DPATH,
+                stderr=devnull, universal_newlines=True
+            ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    """Print the median timings of results, next to those of baseline (if
+    given).
+    """
+    if baseline is None:
+        print('{:<28} {:>12} {:>12}'.format('benchmark', 'min', 'median'))
+        for name, result in sorted(results['results'].items()):
+            print('{:<28} {:>12.6f} {:>12.6f}'.format(name, result['min'],
+                                                      result['median']))
+        return
+
+    print('{:<28} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline',
+                                              'current', 'ratio'))
+    for name, result in sorted(results['results'].items()):
+        base = baseline['results'].get(name, {}).get('median')
+        print('{:<28} {:>12} {:>12.6f} {:>8}'.format(
+            name,
+            '-' if base is None else '{:.6f}'.format(base),
+            result['median'],
+            '-' if not base else '{:.2f}x'.format(result['median'] / base),
+        ))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog='benchmarks/run.py',
+        description='Run conda-shell benchmarks against synthetic'
+                    ' environment stores, without conda or network access.'
+    )
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help='Benchmarks to run (default: all of {})'.format(
+                            ', '.join(sorted(BENCHMARKS))
+                        ))
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='Write the results to FILE as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare the results with those in FILE')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Comma-separated numbers of environments in the'
+                             ' synthetic stores (default: %(default)s)')
+    parser.add_argument('--history-lines', type=int, default=50,
+                        help='Length of each environment history (default:'
+                             ' %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=10,
+                        help='Number of timings of each benchmark (default:'
+                             ' %(default)s)')
+    parser.add_argument('--quick', action='store_true',
+                        help='Only check that the benchmarks run (tiny'
+                             ' stores, two timings each)')
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark "{}"'.format(name))
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    if args.quick:
+        sizes, args.repeat = [min(sizes)], 2
+
+    for key in CLEARED_VARS:
+        os.environ.pop(key, None)
+    timings = {}
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        print('Running {} benchmarks...'.format(name), file=sys.stderr)
+        BENCHMARKS[name](timings, sizes, args.history_lines, args.repeat)
+
+    results = {
+        'version': RESULTS_VERSION,
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_revision': get_git_revision(),
+            'host': socket.gethostname(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'sizes': sizes,
+            'history_lines': args.history_lines,
+            'repeat': args.repeat,
+            'solve_time': synthetic.FakeCondaCLI.solve_time,
+        },
+        'results': dict((name, summarize(value))
+                        for name, value in timings.items()),
+    }
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+    print_results(results, baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,178 @@
+"""
+Synthetic environment stores and a fake conda backend, so that conda-shell can
+be benchmarked offline without conda.
+
+Environments look like the ones conda-shell creates: a `conda-meta/history`
+with `conda create`/`conda install` transactions, and one `conda-meta/*.json`
+record per installed package.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import sys
+import json
+import time
+import types
+import random
+import hashlib
+
+from conda_shell import light_cli
+from conda_shell.light_cli import LightShellCLI
+
+
+ENV_PREFIX = 'shell_'
+CHANNEL = 'https://repo.anaconda.com/pkgs/main'
+SUBDIR = 'linux-64'
+N_PACKAGES = 300
+DATE = '2018-01-01 12:00:00'
+
+
+def package_specs(rng, n_specs):
+    """Return n_specs distinct `name=version` specs drawn from the synthetic
+    package universe.
+    """
+    return ['pkg{:03d}=1.{}'.format(idx, idx % 7)
+            for idx in sorted(rng.sample(range(N_PACKAGES), n_specs))]
+
+
+def _record(spec, idx):
+    name, version = spec.split('=')
+    build = 'py36_{}'.format(idx % 3)
+    fname = '{}-{}-{}.tar.bz2'.format(name, version, build)
+    return {
+        'name': name,
+        'version': version,
+        'build': build,
+        'build_number': idx % 3,
+        'channel': CHANNEL,
+        'subdir': SUBDIR,
+        'fn': fname,
+        'url': '{}/{}/{}'.format(CHANNEL, SUBDIR, fname),
+        'md5': hashlib.md5(fname.encode('utf-8')).hexdigest(),
+        'depends': ['python >=3.6,<3.7.0a0'],
+        'files': ['lib/python3.6/site-packages/{}/__init__.py'.format(name),
+                  'lib/python3.6/site-packages/{}/core.py'.format(name)],
+    }
+
+
+def _transaction(cmd, specs):
+    lines = ['==> {} <=='.format(DATE), '# cmd: ' + cmd]
+    for idx, spec in enumerate(specs):
+        record = _record(spec, idx)
+        lines.append('+defaults::{}-{}-{}'.format(
+            record['name'], record['version'], record['build']
+        ))
+    return lines
+
+
+def write_env(env_dpath, create_specs, install_specs=(),
+              n_history_lines=None):
+    """Write a synthetic environment to env_dpath, as if it was created with
+    create_specs and then installed into with each list of install_specs.
+    The history is padded with comment lines to n_history_lines, if given.
+    """
+    env_name = os.path.basename(env_dpath)
+    meta_dpath = os.path.join(env_dpath, 'conda-meta')
+    os.makedirs(meta_dpath)
+    os.makedirs(os.path.join(env_dpath, 'bin'))
+
+    lines = _transaction('conda create -n {} {} --yes'.format(
+        env_name, ' '.join(create_specs)
+    ), create_specs)
+    all_specs = list(create_specs)
+    for specs in install_specs:
+        lines.extend(_transaction('conda install -n {} {} --yes'.format(
+            env_name, ' '.join(specs)
+        ), specs))
+        all_specs.extend(specs)
+    if n_history_lines is not None:
+        lines.extend('# update specs: {}'.format(idx)
+                     for idx in range(n_history_lines - len(lines)))
+    with open(os.path.join(meta_dpath, 'history'), 'w') as fp:
+        fp.write('\n'.join(lines) + '\n')
+
+    for idx, spec in enumerate(all_specs):
+        record = _record(spec, idx)
+        with open(os.path.join(meta_dpath, record['fn'][:-len('.tar.bz2')] +
+                               '.json'), 'w') as fp:
+            json.dump(record, fp)
+
+
+def make_store(store_dpath, n_envs, n_history_lines=50, n_specs=5, seed=0):
+    """Populate store_dpath with n_envs synthetic conda-shell environments,
+    whose histories are n_history_lines long, and return the list of package
+    specs of each environment (in creation order, oldest first). Every third
+    environment was also installed into after its creation.
+    """
+    rng = random.Random(seed)
+    env_specs = []
+    if not os.path.isdir(store_dpath):
+        os.makedirs(store_dpath)
+    for env_idx in range(n_envs):
+        specs = package_specs(rng, n_specs)
+        create_specs, install_specs = specs, []
+        if env_idx % 3 == 2:
+            create_specs, install_specs = specs[:-2], [specs[-2:]]
+        env_dpath = os.path.join(store_dpath,
+                                 '{}{:032x}'.format(ENV_PREFIX, env_idx))
+        write_env(env_dpath, create_specs, install_specs,
+                  n_history_lines=n_history_lines)
+        # Oldest first, so that the most recent environment is scanned first
+        mtime = time.time() - (n_envs - env_idx)
+        os.utime(env_dpath, (mtime, mtime))
+        env_specs.append(specs)
+    return env_specs
+
+
+class FakeCondaCLI(LightShellCLI):
+    """Stand-in for `conda_cli.CondaShellCLI`, which parses arguments like
+    `light_cli.LightShellCLI` and "creates" environments by writing synthetic
+    ones (after sleeping for solve_time seconds, to mimic conda's solver).
+    """
+
+    solve_time = float(os.environ.get('CONDA_SHELL_BENCH_SOLVE_TIME', 0))
+
+    def conda_create(self, args):
+        """Write the environment requested by args (a parsed `conda create`).
+        """
+        time.sleep(self.solve_time)
+        env_dpath = os.path.join(getattr(args, 'store', None) or
+                                 self.prefix_dpath, args.name)
+        write_env(env_dpath, args.packages or [])
+
+    def conda_install(self, args):
+        """Append the packages requested by args (a parsed `conda install`)
+        to the environment's history.
+        """
+        time.sleep(self.solve_time)
+        env_dpath = os.path.join(getattr(args, 'store', None) or
+                                 self.prefix_dpath, args.name)
+        with open(os.path.join(env_dpath, 'conda-meta', 'history'),
+                  'a') as fp:
+            fp.write('\n'.join(_transaction(
+                'conda install -n {} {} --yes'.format(
+                    args.name, ' '.join(args.packages or [])
+                ), args.packages or []
+            )) + '\n')
+
+
+def install_fake_conda(conda_dpath):
+    """Make conda-shell treat conda_dpath as the conda installation (its
+    `envs` directory is the local store) and create environments with
+    `FakeCondaCLI` instead of conda.
+    """
+    light_cli.get_conda_install_dpath = lambda: conda_dpath
+    # Registering a stand-in module (rather than patching the real one) keeps
+    # conda-shell's fast path from paying for importing conda_cli
+    fake_cli_mod = types.ModuleType(str('conda_shell.conda_cli'))
+    fake_cli_mod.CondaShellCLI = FakeCondaCLI
+    sys.modules['conda_shell.conda_cli'] = fake_cli_mod
+
+
+if __name__ == '__main__':
+    # Run conda-shell against the fake conda installation $CONDA_SHELL_BENCH
+    install_fake_conda(os.environ['CONDA_SHELL_BENCH'])
+    from conda_shell import main
+    sys.exit(main.main(['conda-shell'] + sys.argv[1:], exec_run=True))
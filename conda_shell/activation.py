@@ -0,0 +1,162 @@
+"""
+Full activation of conda environments. Packages may install scripts in
+`etc/conda/activate.d` which `conda activate` sources (e.g. to set compiler
+or CUDA variables). Running them on every invocation is slow, so the changes
+they make to the environment variables are computed once per environment and
+cached next to its `conda-meta` directory.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import sys
+import json
+import subprocess
+
+from .utils import load_json, atomic_write_json
+
+
+ACTIVATION_FNAME = '.conda-shell-activation.json'
+ACTIVATION_VERSION = 2
+# Variables which the shell running the scripts (or the Python interpreter
+# dumping them) changes by itself
+IGNORED_VARS = ('_', 'SHLVL', 'PWD', 'OLDPWD', 'CONDA_SHELL_PYTHON',
+                'PYTHONCOERCECLOCALE')
+
+# Dump the environment variables of the shell as JSON
+DUMP_SCRIPT = '''
+exec "$CONDA_SHELL_PYTHON" -c \
+    'import os, sys, json; sys.stdout.write(json.dumps(dict(os.environ)))'
+'''
+# Source the activation scripts (their output goes to stderr), then dump the
+# resulting environment variables
+ACTIVATE_SCRIPT = '''
+for script in "$CONDA_PREFIX"/etc/conda/activate.d/*.sh; do
+    if [ -f "$script" ]; then
+        . "$script" 1>&2
+    fi
+done
+''' + DUMP_SCRIPT
+
+
+def _get_activate_dpath(env_dpath):
+    return os.path.join(env_dpath, 'etc', 'conda', 'activate.d')
+
+
+def get_fingerprint(env_dpath):
+    """Return a value which changes whenever the environment at env_dpath
+    is modified by conda (its history is appended to) or its activation
+    scripts change.
+    """
+    fingerprint = [env_dpath]
+    for dpath in (os.path.join(env_dpath, 'conda-meta', 'history'),
+                  _get_activate_dpath(env_dpath)):
+        try:
+            fingerprint.append(os.path.getmtime(dpath))
+        except OSError:
+            fingerprint.append(None)
+    return fingerprint
+
+
+def _split_wrapped(value, old_value):
+    """Return the [before, after] strings around old_value in value, if
+    old_value is kept there as a whole path list (i.e. next to path separators
+    or at either end), or None.
+    """
+    start = value.find(old_value)
+    while start != -1:
+        before = value[:start]
+        after = value[start + len(old_value):]
+        if ((not before or before.endswith(os.pathsep)) and
+                (not after or after.startswith(os.pathsep))):
+            return [before, after]
+        start = value.find(old_value, start + 1)
+    return None
+
+
+def _dump_env_vars(script, script_env):
+    return json.loads(subprocess.check_output(
+        ['/bin/sh', '-c', script], env=script_env, universal_newlines=True
+    ))
+
+
+def compute_delta(env_dpath, env_vars):
+    """Return the changes that the activation scripts of the environment at
+    env_dpath make to env_vars (which should already have the environment's
+    CONDA_PREFIX), as a dict with:
+
+        - `set`: variables which are set to a fixed value
+        - `wrap`: variables whose previous value is kept at the start, in the
+          middle or at the end of the new one (i.e. PATH-like variables), as
+          [before, after] strings
+        - `unset`: variables which are removed
+
+    The variables after sourcing the scripts are compared to those of the same
+    shell without sourcing them, so that the variables which the shell itself
+    drops or changes (e.g. exported Bash functions) aren't part of the delta.
+    """
+    delta = {'set': {}, 'wrap': {}, 'unset': []}
+    activate_dpath = _get_activate_dpath(env_dpath)
+    if not (os.path.isdir(activate_dpath) and
+            any(fname.endswith('.sh')
+                for fname in os.listdir(activate_dpath))):
+        return delta
+
+    script_env = dict(env_vars)
+    script_env['CONDA_SHELL_PYTHON'] = sys.executable
+    # Keep Python 3.7+ from setting LC_CTYPE in a C locale
+    script_env['PYTHONCOERCECLOCALE'] = '0'
+    old_vars = _dump_env_vars(DUMP_SCRIPT, script_env)
+    new_vars = _dump_env_vars(ACTIVATE_SCRIPT, script_env)
+    for key, value in new_vars.items():
+        if key in IGNORED_VARS or old_vars.get(key) == value:
+            continue
+        old_value = old_vars.get(key)
+        wrapped = _split_wrapped(value, old_value) if old_value else None
+        if wrapped is not None:
+            delta['wrap'][key] = wrapped
+        else:
+            delta['set'][key] = value
+    delta['unset'] = sorted(key for key in old_vars
+                            if key not in new_vars and
+                            key not in IGNORED_VARS)
+    return delta
+
+
+def get_delta(env_dpath, env_vars):
+    """Return the activation delta (see `compute_delta`) of the environment at
+    env_dpath, from its cache file if that is still valid. The cache file is
+    rewritten if necessary (and possible).
+    """
+    cache_fpath = os.path.join(env_dpath, ACTIVATION_FNAME)
+    fingerprint = get_fingerprint(env_dpath)
+    cached = load_json(cache_fpath)
+    if (isinstance(cached, dict) and
+            cached.get('version') == ACTIVATION_VERSION and
+            cached.get('fingerprint') == fingerprint):
+        return cached['delta']
+
+    delta = compute_delta(env_dpath, env_vars)
+    try:
+        atomic_write_json(cache_fpath, {
+            'version': ACTIVATION_VERSION,
+            'fingerprint': fingerprint,
+            'delta': delta,
+        })
+    except (IOError, OSError):
+        # e.g. an environment in a read-only store
+        pass
+    return delta
+
+
+def apply_delta(env_vars, delta):
+    """Apply the activation delta (see `compute_delta`) to env_vars, and
+    return env_vars.
+    """
+    for key in delta['unset']:
+        env_vars.pop(key, None)
+    for key, (before, after) in delta['wrap'].items():
+        env_vars[key] = before + env_vars.get(key, '') + after
+    env_vars.update(delta['set'])
+    return env_vars
@@ -0,0 +1,308 @@
+"""
+Batch runs of conda-shell scripts (`conda-shell batch`). The shebang lines of
+every script are parsed up front, and scripts which request the same
+environment (see `index.cmds_key`) are grouped, so that each distinct
+environment is found, or created, only once. Missing environments are created
+in parallel worker processes, except those which share a package (and so
+would download and extract the same files into conda's package cache); they
+are created one after the other. The scripts then run concurrently, each with
+its own log file.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import os
+import re
+import sys
+import time
+import shlex
+import subprocess
+import collections
+import multiprocessing
+
+from .light_cli import CondaShellArgumentError, UnsupportedArgumentError
+from .index import cmds_key
+from .matching import get_requested_specs
+from .scan import parallel_map
+from .interactive import activate_env
+from .utils import atomic_write_json
+from .main import (parse_cmds, find_env, find_or_create_env, acquire_env,
+                   collect_default_garbage, write_lock)
+
+
+DEFAULT_LOG_DNAME = 'conda-shell-batch'
+SUMMARY_FNAME = 'summary.json'
+
+# State of the environment creation workers (see `create_envs`), inherited
+# when they are forked
+_creation = {}
+
+
+def is_script(fpath):
+    """Return True if fpath is a file whose shebang lines run conda-shell."""
+    try:
+        with io.open(fpath, 'r', errors='replace') as fp:
+            for line in fp:
+                if not line.startswith('#!'):
+                    return False
+                if re.match(r'^#!\s*conda-shell\s+', line):
+                    return True
+    except (IOError, OSError):
+        pass
+    return False
+
+
+def find_scripts(paths):
+    """Return the absolute paths of the scripts given by paths: files are
+    taken as they are, and directories contribute their conda-shell scripts
+    (see `is_script`), in alphabetical order.
+    """
+    script_fpaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            script_fpaths.extend(
+                os.path.abspath(os.path.join(path, fname))
+                for fname in sorted(os.listdir(path))
+                if is_script(os.path.join(path, fname))
+            )
+        else:
+            script_fpaths.append(os.path.abspath(path))
+    return script_fpaths
+
+
+def group_scripts(script_fpaths, cli):
+    """Return a (groups, errors) tuple. groups is an OrderedDict which maps
+    the `cmds_key` of each distinct environment to the list of (script_fpath,
+    cmds) tuples of the scripts which request it; errors maps the paths of
+    scripts whose shebang lines are invalid (including those which conda's
+    own parsers reject, exiting after printing their usage) to the error
+    message. `UnsupportedArgumentError` is propagated.
+    """
+    groups = collections.OrderedDict()
+    errors = {}
+    for script_fpath in script_fpaths:
+        try:
+            cmds = parse_cmds(['conda-shell', script_fpath], cli,
+                              in_shebang=True)
+        except (CondaShellArgumentError, IOError, OSError) as err:
+            errors[script_fpath] = str(err)
+            continue
+        except SystemExit as err:
+            # argparse already printed the reason
+            errors[script_fpath] = (
+                'invalid shebang lines (exit status {})'.format(err.code)
+            )
+            continue
+        groups.setdefault(cmds_key(cmds), []).append((script_fpath, cmds))
+    return groups, errors
+
+
+def _package_names(cmds):
+    names = set()
+    specs = getattr(cmds[0], 'lock_specs', None)
+    if specs is None:
+        specs = get_requested_specs(cmds)[0]
+    for spec in specs:
+        # e.g. "conda-forge::numpy >=1.13", or an explicit package URL
+        spec = spec.split('::')[-1].rsplit('/', 1)[-1]
+        names.add(re.split(r'[\s=<>!~\[]', spec, 1)[0].lower())
+    return names
+
+
+def get_lanes(keyed_cmds):
+    """Return the (key, cmds) tuples of keyed_cmds split into lists (lanes)
+    which can be created in parallel: environments which share a package name
+    are in the same lane.
+    """
+    lanes = []
+    for key, cmds in keyed_cmds:
+        names = _package_names(cmds)
+        overlapping = [lane for lane in lanes if lane[0] & names]
+        merged = (set(names), [])
+        for lane in overlapping:
+            merged[0].update(lane[0])
+            merged[1].extend(lane[1])
+            lanes.remove(lane)
+        merged[1].append((key, cmds))
+        lanes.append(merged)
+    return [lane for _, lane in lanes]
+
+
+def _create_lane(lane_index):
+    results = []
+    for key, cmds in _creation['lanes'][lane_index]:
+        try:
+            env_dpath, _ = find_or_create_env(cmds, _creation['cli'])
+            results.append((key, env_dpath, None))
+        except (Exception, SystemExit) as err:
+            results.append((key, None, str(err) or repr(err)))
+    return results
+
+
+def create_envs(keyed_cmds, cli, n_jobs):
+    """Find or create the environment requested by each (key, cmds) tuple of
+    keyed_cmds, with up to n_jobs worker processes (see `get_lanes`). Return
+    a list of (key, env_dpath, error) tuples, where either env_dpath or the
+    error message is None.
+    """
+    lanes = get_lanes(keyed_cmds)
+    _creation.update(lanes=lanes, cli=cli)
+    try:
+        if n_jobs < 2 or len(lanes) < 2:
+            return [result for lane_index in range(len(lanes))
+                    for result in _create_lane(lane_index)]
+        # conda keeps its configuration in global state, so each environment
+        # is created in a process of its own
+        context = (multiprocessing.get_context('fork')
+                   if hasattr(multiprocessing, 'get_context')
+                   else multiprocessing)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pool = context.Pool(min(n_jobs, len(lanes)))
+        try:
+            return [result
+                    for results in pool.map(_create_lane, range(len(lanes)))
+                    for result in results]
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _creation.clear()
+
+
+def get_log_fpath(log_dpath, script_fpath, used_fnames):
+    """Return a path in log_dpath for the log of script_fpath, which is not
+    among used_fnames (updated).
+    """
+    base_fname = os.path.basename(script_fpath)
+    fname = base_fname + '.log'
+    n_dups = 1
+    while fname in used_fnames:
+        n_dups += 1
+        fname = '{}-{}.log'.format(base_fname, n_dups)
+    used_fnames.add(fname)
+    return os.path.join(log_dpath, fname)
+
+
+def run_script(script_fpath, cmds, env_dpath, log_fpath, cli):
+    """Run the script script_fpath (whose shebang lines were parsed into cmds)
+    in the environment at env_dpath, with its output and errors written to
+    log_fpath. Return its exit status.
+    """
+    env_vars = activate_env(os.environ.copy(), env_dpath)
+    env_vars['CONDA_SHELL_ENV_NAME'] = (
+        os.path.basename(env_dpath)
+        if os.path.dirname(env_dpath) == cli.prefix_dpath else env_dpath
+    )
+    with open(log_fpath, 'w') as log_fp, open(os.devnull, 'r') as devnull:
+        try:
+            return subprocess.call(shlex.split(cmds[0].run), env=env_vars,
+                                   stdin=devnull, stdout=log_fp,
+                                   stderr=subprocess.STDOUT)
+        except OSError as err:
+            log_fp.write('conda-shell: {}\n'.format(err))
+            return 127
+
+
+def run_batch(paths, cli, n_jobs, log_dpath, load_conda_cli):
+    """Run the conda-shell scripts given by paths (see `find_scripts`), n_jobs
+    at a time, and return a list of result dicts (script path, exit status,
+    environment, log file, duration) in the order of the scripts, which is
+    also written to the summary file in log_dpath.
+
+    cli is used to parse the scripts and to find their environments;
+    load_conda_cli returns the CLI which replaces it (once) if conda's own
+    parsers are needed, or if environments need to be created. Scripts whose
+    shebang lines are invalid, or whose environment could not be created,
+    don't run; their exit status is None. A script which paths give several
+    times (e.g. directly and through its directory) runs, and is reported,
+    once.
+    """
+    script_fpaths = list(collections.OrderedDict.fromkeys(
+        find_scripts(paths)
+    ))
+    try:
+        groups, errors = group_scripts(script_fpaths, cli)
+        env_dpaths = dict((key, find_env(scripts[0][1], cli))
+                          for key, scripts in groups.items())
+    except UnsupportedArgumentError:
+        cli = load_conda_cli()
+        groups, errors = group_scripts(script_fpaths, cli)
+        env_dpaths = {}
+
+    missing = [(key, scripts[0][1]) for key, scripts in groups.items()
+               if env_dpaths.get(key) is None]
+    if missing:
+        print('Creating {} of {} environments...'.format(len(missing),
+                                                         len(groups)),
+              file=sys.stderr)
+        if not hasattr(cli, 'conda_create'):
+            cli = load_conda_cli()
+        for key, env_dpath, error in create_envs(missing, cli, n_jobs):
+            env_dpaths[key] = env_dpath
+            if error is not None:
+                for script_fpath, _ in groups[key]:
+                    errors[script_fpath] = error
+
+    env_locks = []
+    jobs = []
+    used_fnames = set()
+    if not os.path.isdir(log_dpath):
+        os.makedirs(log_dpath)
+    try:
+        for key, scripts in groups.items():
+            env_dpath = env_dpaths[key]
+            if env_dpath is None:
+                continue
+            env_lock = acquire_env(env_dpath)
+            if not os.path.isdir(env_dpath):
+                # Garbage collection removed the environment in the meantime
+                if env_lock is not None:
+                    env_lock.release()
+                for script_fpath, _ in scripts:
+                    errors[script_fpath] = 'environment was removed'
+                continue
+            env_locks.append(env_lock)
+            for cmd in scripts[0][1]:
+                if getattr(cmd, 'lock', None):
+                    write_lock(env_dpath, cmd.lock)
+            for script_fpath, cmds in scripts:
+                jobs.append((script_fpath, cmds, env_dpath,
+                             get_log_fpath(log_dpath, script_fpath,
+                                           used_fnames)))
+        if missing:
+            collect_default_garbage(cli.prefix_dpath)
+
+        def run_job(job):
+            script_fpath, cmds, env_dpath, log_fpath = job
+            start_time = time.time()
+            status = run_script(script_fpath, cmds, env_dpath, log_fpath, cli)
+            print('{} {}'.format(
+                'OK' if status == 0 else 'FAILED ({})'.format(status),
+                script_fpath
+            ), file=sys.stderr)
+            return {'script': script_fpath, 'status': status,
+                    'env': env_dpath, 'log': log_fpath,
+                    'seconds': round(time.time() - start_time, 3)}
+        job_results = dict(
+            (result['script'], result)
+            for result in parallel_map(run_job, jobs, max_workers=n_jobs)
+        )
+    finally:
+        for env_lock in env_locks:
+            if env_lock is not None:
+                env_lock.release()
+
+    results = []
+    for script_fpath in script_fpaths:
+        if script_fpath in job_results:
+            results.append(job_results[script_fpath])
+        else:
+            print('ERROR {}: {}'.format(script_fpath, errors[script_fpath]),
+                  file=sys.stderr)
+            results.append({'script': script_fpath, 'status': None,
+                            'error': errors[script_fpath]})
+    atomic_write_json(os.path.join(log_dpath, SUMMARY_FNAME), results)
+    return results
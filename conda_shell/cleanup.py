@@ -0,0 +1,154 @@
+"""
+Garbage collection of conda-shell environments: least-recently used
+environments are removed until the environments fit in a disk (or count)
+budget.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import sys
+import stat
+import errno
+import shutil
+
+from .locking import get_lock, clear_building
+from .history import HistoryCache
+from .utils import get_cache_dpath
+
+
+LAST_USE_DNAME = 'last-use'
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size):
+    """Return the number of bytes in size, a string such as "500M" or "20G"
+    (binary units), or a plain number of bytes.
+    """
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in SIZE_SUFFIXES:
+        return int(float(size[:-1]) * SIZE_SUFFIXES[size[-1]])
+    return int(size)
+
+
+def get_default_budget():
+    """Return the (max_bytes, max_envs) budget from $CONDA_SHELL_GC_MAX_BYTES
+    and $CONDA_SHELL_GC_MAX_ENVS. Either may be None (unlimited).
+    """
+    max_bytes = os.environ.get('CONDA_SHELL_GC_MAX_BYTES')
+    max_envs = os.environ.get('CONDA_SHELL_GC_MAX_ENVS')
+    return (parse_size(max_bytes) if max_bytes else None,
+            int(max_envs) if max_envs else None)
+
+
+def get_env_lock(prefix_dpath, env_name, shared=True):
+    """Return the lock which processes using the environment env_name hold
+    (shared), and which garbage collection needs (exclusive) to remove it.
+    """
+    return get_lock(prefix_dpath, 'env-' + env_name, shared=shared)
+
+
+def record_use(prefix_dpath, env_name):
+    """Record that the environment env_name is being used right now."""
+    use_fpath = os.path.join(get_cache_dpath(prefix_dpath, LAST_USE_DNAME),
+                             env_name)
+    with open(use_fpath, 'a'):
+        os.utime(use_fpath, None)
+
+
+def get_last_use(prefix_dpath, env_dpath):
+    """Return the time when the environment at env_dpath was last used (or
+    modified, if conda-shell never recorded a use).
+    """
+    use_fpath = os.path.join(get_cache_dpath(prefix_dpath, LAST_USE_DNAME),
+                             os.path.basename(env_dpath))
+    for fpath in (use_fpath, env_dpath):
+        try:
+            return os.path.getmtime(fpath)
+        except OSError:
+            continue
+    return 0
+
+
+def get_env_bytes(env_dpath):
+    """Return the number of bytes that removing the environment at env_dpath
+    would free. Files which are hard-linked from conda's package cache (or
+    elsewhere) are not counted, since their data stays on disk.
+    """
+    total = 0
+    for root, dirnames, fnames in os.walk(env_dpath):
+        for fname in fnames:
+            try:
+                fstat = os.lstat(os.path.join(root, fname))
+            except OSError:
+                continue
+            if stat.S_ISREG(fstat.st_mode) and fstat.st_nlink == 1:
+                total += fstat.st_size
+    return total
+
+
+def remove_env(prefix_dpath, env_dpath, env_index=None):
+    """Remove the environment at env_dpath, unless it is in use. Return True if
+    it was removed.
+    """
+    env_name = os.path.basename(env_dpath)
+    env_lock = get_env_lock(prefix_dpath, env_name, shared=False)
+    if not env_lock.acquire(blocking=False):
+        return False
+    try:
+        if os.path.isdir(env_dpath):
+            shutil.rmtree(env_dpath)
+        if env_index is not None:
+            env_index.remove(env_name)
+        clear_building(prefix_dpath, env_name)
+        HistoryCache(prefix_dpath).remove(env_dpath)
+        try:
+            os.remove(os.path.join(get_cache_dpath(prefix_dpath,
+                                                   LAST_USE_DNAME), env_name))
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+        # Processes which wait for the lock notice that the environment is
+        # gone once they get it
+        os.remove(env_lock.fpath)
+    finally:
+        env_lock.release()
+    return True
+
+
+def collect_garbage(prefix_dpath, env_dpaths, max_bytes=None, max_envs=None,
+                    stale_env_dpaths=(), env_index=None, dry_run=False):
+    """Remove half-created environments (stale_env_dpaths), then remove the
+    least-recently used of env_dpaths until at most max_envs environments
+    remain and they take up at most max_bytes (see `get_env_bytes`).
+    Environments which are in use are never removed. Return the list of
+    removed environment directories (which would be removed, if dry_run).
+    """
+    removed = []
+    for env_dpath in stale_env_dpaths:
+        if dry_run or remove_env(prefix_dpath, env_dpath, env_index):
+            removed.append(env_dpath)
+
+    lru_dpaths = sorted(env_dpaths,
+                        key=lambda dpath: get_last_use(prefix_dpath, dpath))
+    env_bytes = {}
+    if max_bytes is not None:
+        for env_dpath in lru_dpaths:
+            env_bytes[env_dpath] = get_env_bytes(env_dpath)
+    total_bytes = sum(env_bytes.values())
+    num_envs = len(lru_dpaths)
+
+    for env_dpath in lru_dpaths:
+        if ((max_envs is None or num_envs <= max_envs) and
+                (max_bytes is None or total_bytes <= max_bytes)):
+            break
+        if dry_run or remove_env(prefix_dpath, env_dpath, env_index):
+            removed.append(env_dpath)
+            num_envs -= 1
+            total_bytes -= env_bytes.get(env_dpath, 0)
+        else:
+            print('Skipping shell env "{}", which is in use'.format(
+                os.path.basename(env_dpath)
+            ), file=sys.stderr)
+    return removed
@@ -0,0 +1,121 @@
+"""
+Thin client of the conda-shell daemon (see `daemon`). bin/conda-shell tries
+the daemon first: if one is listening, it resolves the environment and the
+command to run, and the client executes that command itself. Otherwise (or if
+the daemon declines the request), conda-shell runs as usual.
+
+This module only imports the standard library, so that trying the daemon
+costs next to nothing.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import sys
+import json
+import zlib
+import fcntl
+import socket
+
+
+SOCKET_ENV = 'CONDA_SHELL_DAEMON_SOCKET'
+# Disables the client, e.g. for the daemon's own fallbacks
+NO_DAEMON_ENV = 'CONDA_SHELL_NO_DAEMON'
+
+
+def get_socket_fpath():
+    """Return the path of the daemon's Unix socket: $CONDA_SHELL_DAEMON_SOCKET,
+    or a per-user path (in $XDG_RUNTIME_DIR or /tmp) which is specific to the
+    Python installation that conda-shell runs from.
+    """
+    socket_fpath = os.environ.get(SOCKET_ENV)
+    if socket_fpath:
+        return os.path.abspath(os.path.expanduser(socket_fpath))
+    prefix_crc = zlib.crc32(sys.prefix.encode('utf-8')) & 0xffffffff
+    return os.path.join(
+        os.environ.get('XDG_RUNTIME_DIR') or '/tmp',
+        'conda-shell-{}-{:08x}.sock'.format(os.getuid(), prefix_crc)
+    )
+
+
+def recv_all(sock):
+    """Return everything received on sock until the peer shuts down its
+    side of the connection.
+    """
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def send(message, socket_fpath=None):
+    """Send message (a JSON-serializable dict) to the daemon. Return a
+    (reply, sock) tuple, where reply is the daemon's decoded reply and sock
+    the connection, or None if no daemon is listening.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_fpath or get_socket_fpath())
+        sock.sendall(json.dumps(message).encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        return json.loads(recv_all(sock).decode('utf-8')), sock
+    except (socket.error, ValueError):
+        sock.close()
+        return None
+
+
+def request(argv, socket_fpath=None):
+    """Send argv, along with the current working directory and environment
+    variables, to the daemon (see `send`). The daemon keeps the resolved
+    environment in use until the connection is closed.
+    """
+    return send({
+        'command': 'run',
+        'argv': argv,
+        'cwd': os.getcwd(),
+        'env': dict(os.environ),
+    }, socket_fpath=socket_fpath)
+
+
+def _lock_env(lock_fpath):
+    # Shared lock, as held by conda-shell processes using the environment
+    # (see `cleanup.get_env_lock`); the command inherits it
+    lock_fd = os.open(lock_fpath, os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.flock(lock_fd, fcntl.LOCK_SH)
+    if hasattr(os, 'set_inheritable'):
+        os.set_inheritable(lock_fd, True)
+    return lock_fd
+
+
+def run(argv):
+    """Have the daemon resolve argv and, if it did, replace this process with
+    the resulting command. Return (only) if conda-shell should handle argv
+    itself.
+    """
+    if os.environ.get(NO_DAEMON_ENV):
+        return
+    response = request(argv)
+    if response is None:
+        return
+    reply, sock = response
+    try:
+        if reply.get('action') != 'exec':
+            return
+        lock_fd = None
+        if reply['lock_fpath'] is not None:
+            lock_fd = _lock_env(reply['lock_fpath'])
+    finally:
+        sock.close()
+    if not os.path.isdir(reply['env_dpath']):
+        # Removed in the meantime
+        if lock_fd is not None:
+            os.close(lock_fd)
+        return
+    for message in reply.get('messages', []):
+        print(message, file=sys.stderr)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execvpe(reply['argv'][0], reply['argv'], reply['env'])
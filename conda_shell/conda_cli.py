@@ -11,6 +11,8 @@ import importlib
 import argparse
 import copy
 import glob
+import json
+import threading
 
 import six
 if six.PY2:
@@ -18,9 +20,216 @@ if six.PY2:
 else:
     from unittest import mock
 
+from .light_cli import (CondaShellArgumentError,  # noqa
+                        get_conda_install_dpath, get_default_match_mode,
+                        MATCH_MODES, SHELL_ONLY_OPTIONS, SHELL_ONLY_FLAGS)
+from .utils import get_cache_dpath, load_json, atomic_write_json
+from .stores import get_local_store_dpath, get_store_dpaths
+from .explicit import get_explicit_specs, read_explicit_file
+from .solve_cache import SolveCache, repodata_fingerprint
+from .profiling import span, profiled
 
-class CondaShellArgumentError(Exception):
-    pass
+
+CLI_CACHE_FNAME = 'cli-cache.json'
+CLI_CACHE_VERSION = 2
+
+# Most-derived classes come first, since e.g. store_true is a store_const
+_ACTION_KINDS = (
+    (argparse._HelpAction, 'help'),
+    (argparse._VersionAction, 'version'),
+    (argparse._CountAction, 'count'),
+    (argparse._AppendConstAction, 'append_const'),
+    (argparse._AppendAction, 'append'),
+    (argparse._StoreConstAction, 'store_const'),
+    (argparse._StoreAction, 'store'),
+)
+_ACTION_TYPES = {'int': int, 'float': float}
+
+
+def _jsonable(value):
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def describe_parser(parser):
+    """Return a JSON-serializable description of parser, from which
+    `build_parser` can recreate an equivalent parser without importing conda.
+
+    The description is reduced: argument groups are flattened, custom action
+    classes are mapped onto the closest builtin argparse action, only builtin
+    `int`/`float` types are kept, and defaults which can't be serialized
+    become None.
+    """
+    actions = []
+    for action in parser._actions:
+        kind = None
+        for action_cls, action_kind in _ACTION_KINDS:
+            if isinstance(action, action_cls):
+                kind = action_kind
+                break
+        if kind is None:
+            kind = 'store_const' if action.nargs == 0 else 'store'
+        type_name = None
+        for name, action_type in _ACTION_TYPES.items():
+            if action.type is action_type:
+                type_name = name
+        actions.append({
+            'kind': kind,
+            'option_strings': list(action.option_strings),
+            'dest': action.dest,
+            'nargs': action.nargs,
+            'const': action.const if _jsonable(action.const) else None,
+            'default': action.default if _jsonable(action.default) else None,
+            'type': type_name,
+            'choices': (list(action.choices)
+                        if action.choices is not None and
+                        _jsonable(list(action.choices)) else None),
+            'required': action.required,
+            'help': action.help,
+            'metavar': action.metavar if _jsonable(action.metavar) else None,
+            'version': getattr(action, 'version', None),
+        })
+    formatter_class = parser.formatter_class.__name__
+    return {
+        'prog': parser.prog,
+        'usage': parser.usage,
+        'description': parser.description,
+        'epilog': parser.epilog,
+        'formatter_class': (formatter_class
+                            if hasattr(argparse, formatter_class) else None),
+        'actions': actions,
+    }
+
+
+def build_parser(desc):
+    """Return an argparse.ArgumentParser built from the output of
+    `describe_parser`.
+    """
+    formatter_class = getattr(argparse, desc['formatter_class'] or '',
+                              argparse.HelpFormatter)
+    parser = argparse.ArgumentParser(prog=desc['prog'],
+                                     usage=desc['usage'],
+                                     description=desc['description'],
+                                     epilog=desc['epilog'],
+                                     formatter_class=formatter_class,
+                                     add_help=False)
+    for action in desc['actions']:
+        kind = action['kind']
+        kwargs = {'action': kind, 'help': action['help']}
+        if kind == 'version':
+            kwargs['version'] = action['version']
+        elif kind != 'help':
+            kwargs['default'] = action['default']
+        if kind in ('store_const', 'append_const'):
+            kwargs['const'] = action['const']
+        if kind in ('store', 'append'):
+            kwargs['nargs'] = action['nargs']
+            kwargs['metavar'] = action['metavar']
+            kwargs['choices'] = action['choices']
+            kwargs['type'] = _ACTION_TYPES.get(action['type'])
+            if kwargs['nargs'] == argparse.OPTIONAL:
+                kwargs['const'] = action['const']
+        if action['option_strings']:
+            kwargs['dest'] = action['dest']
+            if kind not in ('help', 'version'):
+                kwargs['required'] = action['required']
+            parser.add_argument(*action['option_strings'], **kwargs)
+        else:
+            parser.add_argument(action['dest'], **kwargs)
+    return parser
+
+
+def _get_cli_cache_fpath():
+    prefix_dpath = os.path.join(get_conda_install_dpath(), 'envs')
+    return os.path.join(get_cache_dpath(prefix_dpath), CLI_CACHE_FNAME)
+
+
+def _get_conda_mtime(conda_sp_dpath):
+    return os.stat(os.path.join(conda_sp_dpath, 'conda')).st_mtime
+
+
+def _get_conda_record_version(conda_sp_dpath):
+    """Return the version of conda which the `conda-meta` directory of its
+    installation (the prefix of the site-packages directory conda_sp_dpath)
+    records, without importing conda, or None if there is no record (e.g. a
+    development install).
+    """
+    install_dpath = os.path.dirname(os.path.dirname(os.path.dirname(
+        conda_sp_dpath
+    )))
+    for rec_fpath in glob.glob(os.path.join(install_dpath, 'conda-meta',
+                                            'conda-[0-9]*.json')):
+        record = load_json(rec_fpath)
+        if isinstance(record, dict) and record.get('name') == 'conda':
+            return record.get('version')
+    return None
+
+
+def load_cli_cache():
+    """Return the cached site-packages location and parser descriptions, or
+    None if there is no cache, or if conda's recorded version or the mtime of
+    its package directory changed (e.g. conda was upgraded) since the cache
+    was written.
+    """
+    cli_cache = load_json(_get_cli_cache_fpath())
+    if (not isinstance(cli_cache, dict) or
+            cli_cache.get('version') != CLI_CACHE_VERSION):
+        return None
+    try:
+        conda_mtime = _get_conda_mtime(cli_cache['conda_sp_dpath'])
+    except (OSError, KeyError):
+        return None
+    if (conda_mtime != cli_cache.get('conda_mtime') or
+            _get_conda_record_version(cli_cache['conda_sp_dpath']) !=
+            cli_cache.get('conda_record_version')):
+        return None
+    return cli_cache
+
+
+def save_cli_cache(conda_sp_dpath, conda_version, parser_descs):
+    """Write the site-packages location and parser descriptions to the CLI
+    cache, keyed by conda's recorded version (see
+    `_get_conda_record_version`) and the mtime of its package directory.
+    conda_version (conda's `__version__`) is stored along with them.
+    """
+    atomic_write_json(_get_cli_cache_fpath(), {
+        'version': CLI_CACHE_VERSION,
+        'conda_version': conda_version,
+        'conda_record_version': _get_conda_record_version(conda_sp_dpath),
+        'conda_mtime': _get_conda_mtime(conda_sp_dpath),
+        'conda_sp_dpath': conda_sp_dpath,
+        'parsers': parser_descs,
+    })
+
+
+def history_argv(argv):
+    """Return argv without the conda-shell executable and without the
+    arguments that only conda-shell understands, i.e. the arguments that
+    belong in a conda environment's history.
+    """
+    hist_argv = []
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+        elif arg in SHELL_ONLY_OPTIONS:
+            skip_next = True
+        elif (arg in SHELL_ONLY_FLAGS or
+              arg.split('=', 1)[0] in SHELL_ONLY_OPTIONS):
+            continue
+        elif not arg.endswith('conda-shell'):
+            hist_argv.append(arg)
+    return hist_argv
+
+
+def clear_cli_cache():
+    """Remove the CLI cache, so the next run rediscovers conda."""
+    cli_cache_fpath = _get_cli_cache_fpath()
+    if os.path.exists(cli_cache_fpath):
+        os.remove(cli_cache_fpath)
 
 
 class CondaCLI(object):
@@ -36,24 +245,68 @@ class CondaCLI(object):
 
     def __init__(self):
         """Constructor."""
-        # Extend sys.path so that conda.cli module can be imported, then import
+        self._base_mod = None
+        self._main_mod = None
+        self._main_install_mod = None
+        self._main_create_mod = None
+        self._conda_create_parser, self._conda_install_parser = None, None
+        self._load_lock = threading.Lock()
+        self.conda_version = None
+
+        # Reuse the site-packages location and parser descriptions from a
+        # previous run, if conda hasn't changed since. Otherwise, extend
+        # sys.path so that conda.cli module can be imported, then import
         # conda's CLI modules.
-        self.conda_sp_dpath = self._get_conda_sp_dpath()
-        self.prefix_dpath = os.path.join(
+        cli_cache = load_cli_cache()
+        if cli_cache is not None:
+            self.conda_sp_dpath = cli_cache['conda_sp_dpath']
+            self.conda_version = cli_cache['conda_version']
+            with span('build parsers'):
+                self._create_parser = build_parser(
+                    cli_cache['parsers']['create']
+                )
+                self._install_parser = build_parser(
+                    cli_cache['parsers']['install']
+                )
+        else:
+            self.conda_sp_dpath = self._get_conda_sp_dpath()
+            self._load_conda()
+            self._create_parser = self._conda_create_parser
+            self._install_parser = self._conda_install_parser
+            save_cli_cache(self.conda_sp_dpath, self.conda_version, {
+                'create': describe_parser(self._create_parser),
+                'install': describe_parser(self._install_parser),
+            })
+        self.prefix_dpath = get_local_store_dpath(os.path.join(
             os.path.split(os.path.split(os.path.split(
                 self.conda_sp_dpath
             )[0])[0])[0],
             'envs',
-        )
-        (self._base_mod,
-         self._main_mod,
-         self._main_install_mod,
-         self._main_create_mod) = self._import_conda_modules()
+        ))
+        self.store_dpaths = get_store_dpaths(self.prefix_dpath)
+
+    def _load_conda(self):
+        """Import conda's modules and generate its `create`/`install` parsers,
+        unless that already happened. This is safe to call from several
+        threads (e.g. the workers of `prefetch`): `_main_mod` is only set once
+        everything else is.
+        """
+        if self._main_mod is not None:
+            return
+        with self._load_lock:
+            if self._main_mod is not None:
+                return
+            self._load_conda_modules()
+
+    def _load_conda_modules(self):
+        base_mod, main_mod, main_install_mod, main_create_mod = \
+            self._import_conda_modules()
+        self.conda_version = importlib.import_module('conda').__version__
 
-        self._create_parser, self._install_parser = None, None
-        parser, sub_parsers = self._main_mod.generate_parser()
-        self._main_install_mod.configure_parser(sub_parsers)
-        self._main_create_mod.configure_parser(sub_parsers)
+        with span('generate conda parsers'):
+            parser, sub_parsers = main_mod.generate_parser()
+            main_install_mod.configure_parser(sub_parsers)
+            main_create_mod.configure_parser(sub_parsers)
 
         subparsers_action = None
         for action in parser._subparsers._actions:
@@ -62,27 +315,50 @@ class CondaCLI(object):
                 break
         action_parser_map = subparsers_action._name_parser_map
         if 'install' in action_parser_map:
-            self._install_parser = action_parser_map['install']
+            self._conda_install_parser = action_parser_map['install']
             # These arguments are somehow dropped from the Namespace
-            self._install_parser.add_argument('--no-default-packages',
-                                              default=False)
-            self._install_parser.add_argument('--clone', default=False)
+            self._conda_install_parser.add_argument('--no-default-packages',
+                                                    default=False)
+            self._conda_install_parser.add_argument('--clone', default=False)
         if 'create' in action_parser_map:
-            self._create_parser = action_parser_map['create']
+            self._conda_create_parser = action_parser_map['create']
         # Additional branches may be added here to support more of conda's
         # subparsers
 
+        self._base_mod = base_mod
+        self._main_install_mod = main_install_mod
+        self._main_create_mod = main_create_mod
+        # Last, since it marks conda as loaded
+        self._main_mod = main_mod
+
+    def _to_conda_args(self, args, parser, conda_parser):
+        """Return a Namespace which conda's own `conda_parser` could have
+        produced, given args which were parsed by `parser` (possibly a parser
+        rebuilt from the CLI cache). Arguments which were left at their
+        default values take conda's real defaults (which may be sentinel
+        objects that can't be cached).
+        """
+        if parser is conda_parser:
+            return args
+        defaults = dict((action.dest, action.default)
+                        for action in parser._actions)
+        conda_args = argparse.Namespace()
+        for action in conda_parser._actions:
+            if (action.dest != argparse.SUPPRESS and
+                    action.default != argparse.SUPPRESS):
+                setattr(conda_args, action.dest, action.default)
+        for key, value in vars(args).items():
+            if (key in defaults and hasattr(conda_args, key) and
+                    value == defaults[key]):
+                continue
+            setattr(conda_args, key, value)
+        return conda_args
+
     def _get_conda_sp_dpath(self):
         """Return the site-packages directory where conda resides.
         Errors-out if the user isn't using Python from within conda.
         """
-        if 'conda' not in sys.executable:  # pragma: no cover
-            raise ValueError('Failed to find directory where conda is'
-                             ' installed. conda-shell expects to find conda'
-                             ' installed in a directory with "conda" in the'
-                             ' name.')
-
-        conda_install_dpath = sys.executable.split('conda')[0] + 'conda'
+        conda_install_dpath = get_conda_install_dpath()
         conda_sp_dpath = None
         installed_libs = os.path.join(conda_install_dpath, 'lib')
         for root, dirnames, filenames in os.walk(installed_libs, topdown=True):
@@ -104,6 +380,7 @@ class CondaCLI(object):
                              ' conda is installed.')
         return conda_sp_dpath
 
+    @profiled('import conda')
     def _import_conda_modules(self):
         """Import the necessary conda modules.
         """
@@ -125,6 +402,31 @@ class CondaCLI(object):
 
         return imported_modules
 
+    def match_spec(self, spec):
+        """Return conda's MatchSpec object for the package spec string."""
+        self._load_conda()
+        match_spec_mod = importlib.import_module('conda.models.match_spec')
+        return match_spec_mod.MatchSpec(spec)
+
+    def channel_name(self, channel):
+        """Return conda's canonical name for channel (a name or URL)."""
+        self._load_conda()
+        channel_mod = importlib.import_module('conda.models.channel')
+        return channel_mod.Channel(channel).canonical_name
+
+    def default_channel_names(self):
+        """Return the set of canonical names which packages from conda's
+        default channels (those `defaults` stands for, e.g. `pkgs/main`) may
+        be recorded under.
+        """
+        self._load_conda()
+        channel_mod = importlib.import_module('conda.models.channel')
+        names = set(['defaults'])
+        for channel in self._base_mod.context.context.default_channels:
+            channel = channel_mod.Channel(channel)
+            names.update((channel.canonical_name, channel.name))
+        return names
+
     def parse_create_args(self, argv):
         """Given a list of arguments (likely derived from `sys.argv`), return
         argparse output as if `conda create` were called over the command line.
@@ -143,11 +445,12 @@ class CondaCLI(object):
         known, unknown = self._install_parser.parse_known_args(argv)
         return known
 
-    def conda_create(self, args):
-        """Given a Namespace object from `conda create`'s argument parser,
-        return the output from the `conda create` command (this may be `None`).
+    def _init_context(self, args):
+        """Configure conda's global context for the `conda create`/`conda
+        install` arguments args, and return the prefix of the environment.
         """
-        prefix = os.path.join(self.prefix_dpath, args.name)
+        prefix = os.path.join(getattr(args, 'store', None) or
+                              self.prefix_dpath, args.name)
         # The following is needed to satisfy conda Context object
         self._base_mod.context.get_prefix = lambda *args, **kwargs: prefix
         self._base_mod.context.context.__init__(
@@ -155,40 +458,144 @@ class CondaCLI(object):
             app_name='conda',
             argparse_args=args,
         )
+        return prefix
+
+    def _get_solve_key(self, args):
+        """Return the `SolveCache` key of the `conda create` arguments args
+        (once conda's context is configured for them), or None if their
+        solution isn't cached.
+
+        Solving may refresh conda's repodata cache, which changes the key:
+        solutions are stored under the key computed after solving, which is
+        the one the next lookup computes.
+        """
+        if (not args.packages or getattr(args, 'no_solve_cache', False) or
+                getattr(args, 'clone', None) or getattr(args, 'file', None)):
+            return None
+        context = self._base_mod.context.context
+        return SolveCache.key(
+            args.packages, args.channel,
+            getattr(args, 'override_channels', False), context.subdir,
+            repodata_fingerprint(context.pkgs_dirs)
+        )
+
+    @profiled('conda solve')
+    def solve(self, args):
+        """Given a Namespace object from `conda create`'s argument parser,
+        return the explicit specs (see `explicit.get_explicit_specs`) of the
+        packages which `conda create` would install, without creating the
+        environment. The solution is taken from, or stored in, `SolveCache`,
+        so that `conda_create` replays it later. Raise ValueError if conda
+        can't solve without creating the environment, or if a package has no
+        URL.
+        """
+        self._load_conda()
+        args = self._to_conda_args(args, self._create_parser,
+                                   self._conda_create_parser)
+        prefix = self._init_context(args)
+        context = self._base_mod.context.context
+        solve_cache = SolveCache(self.prefix_dpath)
+        solve_key = self._get_solve_key(args)
+        if solve_key is not None:
+            explicit_fpath = solve_cache.lookup(solve_key)
+            if explicit_fpath is not None:
+                return read_explicit_file(explicit_fpath)
+
+        try:
+            solve_mod = importlib.import_module('conda.core.solve')
+        except ImportError:
+            raise ValueError('conda {} has no standalone solver'.format(
+                self.conda_version
+            ))
+        solver = solve_mod.Solver(prefix, context.channels,
+                                  subdirs=(context.subdir, 'noarch'),
+                                  specs_to_add=args.packages)
+        specs = []
+        for record in solver.solve_final_state():
+            if not record.url:
+                raise ValueError('Package "{}" has no URL'.format(
+                    record.name
+                ))
+            specs.append(record.url + ('#' + record.md5 if record.md5
+                                       else ''))
+        if solve_key is not None:
+            solve_cache.store(self._get_solve_key(args), specs,
+                              platform=context.subdir)
+        return specs
+
+    def get_pkgs_dpath(self):
+        """Return the first writable directory of conda's package cache."""
+        self._load_conda()
+        pkgs_dirs = self._base_mod.context.context.pkgs_dirs
+        for pkgs_dpath in pkgs_dirs:
+            if os.access(pkgs_dpath, os.W_OK):
+                return pkgs_dpath
+        return pkgs_dirs[0]
+
+    @profiled('conda create')
+    def conda_create(self, args):
+        """Given a Namespace object from `conda create`'s argument parser,
+        return the output from the `conda create` command (this may be `None`).
+
+        Solutions are cached by `SolveCache`: when the same packages and
+        channels were solved before (on the same platform, with the same
+        repodata), the environment is created from the cached explicit list of
+        packages instead, unless `args.no_solve_cache` is set.
+        """
+        self._load_conda()
+        args = self._to_conda_args(args, self._create_parser,
+                                   self._conda_create_parser)
+        prefix = self._init_context(args)
+
+        # Replay a previous solution of the same request, if there is one
+        solve_cache, solve_key = None, self._get_solve_key(args)
+        context = self._base_mod.context.context
+        if solve_key is not None:
+            solve_cache = SolveCache(self.prefix_dpath)
+            explicit_fpath = solve_cache.lookup(solve_key)
+            if explicit_fpath is not None:
+                print('Using cached solution "{}"...'.format(explicit_fpath),
+                      file=sys.stderr)
+                args = copy.copy(args)
+                args.packages = []
+                args.file = [explicit_fpath]
+                solve_cache = None
+
         with mock.patch('conda.history.sys') as sys_mock:
             sys_mock.argv = ['conda', 'create', '-n', args.name]
-            skip_next = False
-            for arg in args._argv:
-                if skip_next:
-                    skip_next = False
-                elif arg in ('--run', '-i', '--interpreter'):
-                    skip_next = True
-                elif not arg.endswith('conda-shell'):
-                    sys_mock.argv.append(arg)
+            sys_mock.argv.extend(history_argv(args._argv))
             # print('@@@@@ create sys_mock.argv =', sys_mock.argv)
-            retval = self._main_create_mod.execute(args, self._create_parser)
+            retval = self._main_create_mod.execute(args,
+                                                   self._conda_create_parser)
+
+        if solve_cache is not None and os.path.isdir(prefix):
+            try:
+                specs = get_explicit_specs(prefix)
+            except ValueError:
+                # Packages without URLs can't be replayed
+                pass
+            else:
+                solve_cache.store(self._get_solve_key(args), specs,
+                                  platform=context.subdir)
         return retval
 
+    @profiled('conda install')
     def conda_install(self, args):
         """Given a Namespace object from `conda install`'s argument parser,
         return the output from the `conda install` command (this may be
         `None`).
         """
-        prefix = os.path.join(self.prefix_dpath, args.name)
-        # The following is needed to satisfy conda Context object
-        self._base_mod.context.get_prefix = lambda *args, **kwargs: prefix
-        self._base_mod.context.context.__init__(
-            search_path=(),
-            app_name='conda',
-            argparse_args=args,
-        )
+        self._load_conda()
+        args = self._to_conda_args(args, self._install_parser,
+                                   self._conda_install_parser)
+        self._init_context(args)
         with mock.patch('conda.history.sys') as sys_mock:
             sys_mock.argv = ['conda', 'install', '-n', args.name]
-            for arg in args._argv:
-                if not arg.endswith('conda-shell'):
-                    sys_mock.argv.append(arg)
+            sys_mock.argv.extend(history_argv(args._argv))
             # print('@@@@@ install sys_mock.argv =', sys_mock.argv)
-            retval = self._main_install_mod.execute(args, self._install_parser)
+            retval = self._main_install_mod.execute(
+                args, self._conda_install_parser
+            )
         return retval
 
 
@@ -200,6 +607,16 @@ class CondaShellCLI(CondaCLI):
           conda-shell
         - `-i` / `--interpreter`: For providing an interpreter via a shebang
           line
+        - `--match`: For choosing how existing environments are matched
+        - `--no-solve-cache`: For bypassing the solver-result cache
+        - `--lock` / `--from-lock`: For writing and consuming explicit lists
+          of packages
+        - `--store`: For creating environments in another (e.g. shared)
+          environment store
+        - `--ephemeral`: For creating throwaway environments in memory
+        - `--no-exec`: For running the --run command as a child process
+        - `--profile`: For timing the phases of conda-shell
+        - `--zygote`: For running Python scripts in preforked interpreters
     """
 
     def __init__(self):
@@ -224,6 +641,58 @@ This is a superset of the command-line interface for
                                     'conda environment')
         mux_group.add_argument('-i', '--interpreter', type=str,
                                help='')
+        self._shell_parser.add_argument(
+            '--match', choices=MATCH_MODES, default=get_default_match_mode(),
+            help='How existing environments are matched: "exact" requires'
+                 ' the same package specs, "satisfy" accepts any environment'
+                 ' whose installed packages satisfy them (default: value of'
+                 ' $CONDA_SHELL_MATCH, or "exact")'
+        )
+        self._shell_parser.add_argument(
+            '--no-solve-cache', action='store_true', default=False,
+            help='Always run the solver when creating an environment, rather'
+                 ' than replaying a cached solution of the same request'
+        )
+        self._shell_parser.add_argument(
+            '--lock', type=str, metavar='FILE',
+            help='Write the explicit list of packages in the environment to'
+                 ' FILE, for use with --from-lock'
+        )
+        self._shell_parser.add_argument(
+            '--from-lock', type=str, metavar='FILE',
+            help='Use an environment with exactly the packages listed in the'
+                 ' explicit file FILE (as written by --lock). Relative paths'
+                 ' in shebang lines are relative to the script'
+        )
+        self._shell_parser.add_argument(
+            '--store', type=str, metavar='DIR',
+            help='Create a new environment (if one is needed) in the'
+                 ' environment store DIR, e.g. a shared store listed in'
+                 ' $CONDA_SHELL_SHARED_STORE, instead of the local store'
+        )
+        self._shell_parser.add_argument(
+            '--ephemeral', action='store_true', default=False,
+            help='If no environment can be reused, create one in'
+                 ' $CONDA_SHELL_EPHEMERAL_DIR (default: underneath /dev/shm)'
+                 ' and remove it when the command or shell exits'
+        )
+        self._shell_parser.add_argument(
+            '--no-exec', action='store_true', default=False,
+            help='Run the --run command (or script) as a child process of'
+                 ' conda-shell, rather than replacing conda-shell with it'
+        )
+        self._shell_parser.add_argument(
+            '--profile', type=str, metavar='FILE',
+            help='Time the phases of conda-shell, write them to FILE as a'
+                 ' Chrome trace (see chrome://tracing) and print a summary'
+                 ' (default: value of $CONDA_SHELL_PROFILE)'
+        )
+        self._shell_parser.add_argument(
+            '--zygote', type=str, metavar='MODULES',
+            help='In a shebang line with -i python: run the script in a'
+                 ' preforked Python interpreter of the environment, which has'
+                 ' the comma-separated MODULES imported already'
+        )
 
     def parse_shell_args(self, argv):
         """Given a list of arguments (likely derived from `sys.argv`), return
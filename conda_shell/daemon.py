@@ -0,0 +1,236 @@
+"""
+The conda-shell daemon (`conda-shell daemon`): a long-running server which
+keeps conda-shell's CLI (its parsers, and conda itself once an environment
+has been created) in memory, and resolves the requests of thin clients (see
+`client`) over a Unix socket.
+
+A request carries the client's argv, working directory and environment
+variables. The daemon finds (or creates) the environment, keeps it in use
+until the client has taken over (see `cleanup.get_env_lock`), and replies with
+the command to run and its activated environment variables; the client then
+executes the command itself. Requests which the daemon can't serve exactly as
+conda-shell would (interactive shells, subcommands, other conda-shell
+settings...) are declined, and the client falls back to running conda-shell.
+
+Environments are created one at a time, and concurrent requests for the same
+environment share its creation (see `main.find_or_create_env`).
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import sys
+import json
+import time
+import shlex
+import socket
+import threading
+
+from .client import send, recv_all
+from .main import (SUBCOMMANDS, parse_cmds, find_env, find_or_create_env,
+                   create_env, acquire_env, collect_default_garbage)
+from .interactive import activate_env
+from .ephemeral import exit_on_signals
+
+
+# Variables which don't change how conda-shell resolves a request
+CLIENT_VARS = ('CONDA_SHELL_DAEMON_SOCKET', 'CONDA_SHELL_NO_DAEMON')
+# Arguments which the daemon leaves to conda-shell itself
+DECLINED_ATTRS = ('ephemeral', 'no_exec', 'lock', 'profile', 'zygote')
+ACCEPT_TIMEOUT = 1
+
+
+def get_config_vars(env_vars):
+    """Return the variables of env_vars which configure conda-shell."""
+    return dict((key, value) for key, value in env_vars.items()
+                if (key.startswith('CONDA_SHELL_') or
+                    key == 'CONDA_ENVS_PATH') and key not in CLIENT_VARS)
+
+
+def _decline(reason):
+    return {'action': 'fallback', 'reason': reason}, None
+
+
+class Daemon(object):
+    """Server of conda-shell requests on the Unix socket socket_fpath. It
+    exits after idle_timeout seconds without requests (if given), or when
+    asked to stop.
+    """
+
+    def __init__(self, socket_fpath, cli, idle_timeout=None):
+        """Constructor."""
+        self.socket_fpath = socket_fpath
+        self.cli = cli
+        self.idle_timeout = idle_timeout
+        self.config_vars = get_config_vars(os.environ)
+        self._create_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._last_request = time.time()
+        self._n_active = 0
+        self._active_lock = threading.Lock()
+
+    def _create_env(self, cmds, cli):
+        # conda's context is global, so one environment at a time
+        with self._create_lock:
+            return create_env(cmds, cli)
+
+    def resolve(self, request):
+        """Return a (reply, env_lock) tuple for the `run` request: the reply
+        to send to the client, and the lock which keeps the environment in
+        use until the client holds its own (or None).
+        """
+        argv, cwd, env_vars = request['argv'], request['cwd'], request['env']
+        if (get_config_vars(env_vars) != self.config_vars or
+                'CONDA_SHELL_ENV_NAME' in env_vars):
+            return _decline('conda-shell settings differ')
+        if len(argv) < 2 or argv[1] in SUBCOMMANDS:
+            return _decline('not a conda-shell environment')
+
+        script_fpath = os.path.join(cwd, argv[1])
+        in_shebang = (argv[0].endswith('conda-shell') and
+                      os.path.isfile(script_fpath) and
+                      os.access(script_fpath, os.X_OK))
+        if in_shebang:
+            argv = [argv[0], script_fpath] + argv[2:]
+        cmds = parse_cmds(argv, self.cli, in_shebang=in_shebang, cwd=cwd)
+        if (cmds[0].run is None or
+                any(getattr(cmds[0], attr, None) for attr in DECLINED_ATTRS)):
+            return _decline('unsupported arguments')
+
+        created = False
+        env_dpath = find_env(cmds, self.cli)
+        if env_dpath is None:
+            env_dpath, created = find_or_create_env(
+                cmds, self.cli, create_fn=self._create_env
+            )
+        env_lock = acquire_env(env_dpath)
+        if not os.path.isdir(env_dpath):
+            # Garbage collection removed the environment in the meantime
+            if env_lock is not None:
+                env_lock.release()
+            return _decline('environment was removed')
+        if created:
+            collect_default_garbage(self.cli.prefix_dpath)
+
+        env_vars = activate_env(dict(env_vars), env_dpath)
+        messages = []
+        if not created:
+            env_name = os.path.basename(env_dpath)
+            messages.append('Reusing shell env "{}"...'.format(env_name))
+            env_vars['CONDA_SHELL_ENV_NAME'] = (
+                env_name if os.path.dirname(env_dpath) == self.cli.prefix_dpath
+                else env_dpath
+            )
+        run_cmd = shlex.split(cmds[0].run)
+        if in_shebang:
+            # Retain arguments from cmdline
+            run_cmd += argv[2:]
+        return {
+            'action': 'exec',
+            'argv': run_cmd,
+            'env': env_vars,
+            'env_dpath': env_dpath,
+            'lock_fpath': env_lock.fpath if env_lock is not None else None,
+            'messages': messages,
+        }, env_lock
+
+    def handle(self, conn):
+        """Serve the request on the connection conn, and close it."""
+        env_lock = None
+        try:
+            request = json.loads(recv_all(conn).decode('utf-8'))
+            command = request.get('command')
+            if command == 'run':
+                try:
+                    reply, env_lock = self.resolve(request)
+                except (Exception, SystemExit) as err:
+                    # conda-shell reproduces (and reports) the error itself
+                    reply, env_lock = _decline(repr(err))
+            elif command == 'status':
+                reply = {'action': 'status', 'pid': os.getpid()}
+            elif command == 'stop':
+                self._stopping.set()
+                reply = {'action': 'stopping', 'pid': os.getpid()}
+            else:
+                reply = {'action': 'error',
+                         'reason': 'unknown command {!r}'.format(command)}
+            conn.sendall(json.dumps(reply).encode('utf-8'))
+            conn.shutdown(socket.SHUT_WR)
+            # Wait for the client to take over the environment
+            recv_all(conn)
+        except (socket.error, ValueError) as err:
+            print('conda-shell daemon: {}'.format(err), file=sys.stderr)
+        finally:
+            if env_lock is not None:
+                env_lock.release()
+            conn.close()
+            with self._active_lock:
+                self._n_active -= 1
+                self._last_request = time.time()
+
+    def _is_idle(self):
+        with self._active_lock:
+            return (self.idle_timeout is not None and self._n_active == 0 and
+                    time.time() - self._last_request > self.idle_timeout)
+
+    def _bind(self):
+        response = send({'command': 'status'}, self.socket_fpath)
+        if response is not None:
+            response[1].close()
+            raise ValueError('A conda-shell daemon is already listening on'
+                             ' "{}"'.format(self.socket_fpath))
+        if os.path.exists(self.socket_fpath):
+            # Left behind by a daemon which crashed
+            os.remove(self.socket_fpath)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the user may connect
+        old_umask = os.umask(0o077)
+        try:
+            sock.bind(self.socket_fpath)
+        finally:
+            os.umask(old_umask)
+        sock.listen(64)
+        sock.settimeout(ACCEPT_TIMEOUT)
+        return sock
+
+    def serve(self, ready=None):
+        """Serve requests until stopped (or idle, or terminated by a signal).
+        If given, the threading.Event ready is set once the socket accepts
+        connections.
+        """
+        sock = self._bind()
+        socket_stat = os.stat(self.socket_fpath)
+        print('conda-shell daemon listening on "{}" (pid {})'.format(
+            self.socket_fpath, os.getpid()
+        ), file=sys.stderr)
+        if ready is not None:
+            ready.set()
+        try:
+            # Signal handlers can only be set from the main thread
+            with exit_on_signals(enabled=(threading.current_thread().name ==
+                                          'MainThread')):
+                while not self._stopping.is_set() and not self._is_idle():
+                    try:
+                        conn, _ = sock.accept()
+                    except socket.timeout:
+                        continue
+                    conn.settimeout(None)
+                    with self._active_lock:
+                        self._n_active += 1
+                    thread = threading.Thread(target=self.handle,
+                                              args=(conn,))
+                    thread.daemon = True
+                    thread.start()
+        finally:
+            sock.close()
+            try:
+                # Unless another daemon replaced the socket since
+                if os.stat(self.socket_fpath).st_ino == socket_stat.st_ino:
+                    os.remove(self.socket_fpath)
+            except OSError:
+                pass
+
+    def stop(self):
+        """Make `serve` return (within ACCEPT_TIMEOUT seconds)."""
+        self._stopping.set()
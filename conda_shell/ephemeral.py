@@ -0,0 +1,114 @@
+"""
+Support for ephemeral environments (`--ephemeral`): environments created in
+memory-backed storage for a single run, and removed afterwards.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import sys
+import errno
+import signal
+import tempfile
+import subprocess
+import contextlib
+
+
+SHM_DPATH = '/dev/shm'
+# Signals which terminate conda-shell (other than SIGINT, which raises
+# KeyboardInterrupt already)
+EXIT_SIGNALS = tuple(getattr(signal, name)
+                     for name in ('SIGTERM', 'SIGHUP', 'SIGQUIT')
+                     if hasattr(signal, name))
+
+
+def get_ephemeral_dpath():
+    """Return the directory (creating it if necessary) where ephemeral
+    environments are created: $CONDA_SHELL_EPHEMERAL_DIR, or a per-user
+    directory underneath /dev/shm (or the temporary directory, if there is no
+    /dev/shm).
+    """
+    ephemeral_dpath = os.environ.get('CONDA_SHELL_EPHEMERAL_DIR')
+    if not ephemeral_dpath:
+        base_dpath = (SHM_DPATH if os.path.isdir(SHM_DPATH)
+                      else tempfile.gettempdir())
+        ephemeral_dpath = os.path.join(
+            base_dpath, 'conda-shell-{}'.format(os.getuid())
+        )
+    ephemeral_dpath = os.path.abspath(os.path.expanduser(ephemeral_dpath))
+    if not os.path.isdir(ephemeral_dpath):
+        os.makedirs(ephemeral_dpath, 0o700)
+    return ephemeral_dpath
+
+
+@contextlib.contextmanager
+def softlink_packages():
+    """Make conda symlink package files from its package cache, instead of
+    hard-linking (impossible across filesystems) or copying them, for the
+    duration of the context.
+    """
+    old_value = os.environ.get('CONDA_ALWAYS_SOFTLINK')
+    os.environ['CONDA_ALWAYS_SOFTLINK'] = 'true'
+    try:
+        yield
+    finally:
+        if old_value is None:
+            del os.environ['CONDA_ALWAYS_SOFTLINK']
+        else:
+            os.environ['CONDA_ALWAYS_SOFTLINK'] = old_value
+
+
+def _raise_exit(signum, frame):
+    sys.exit(128 + signum)
+
+
+@contextlib.contextmanager
+def exit_on_signals(enabled=True):
+    """Turn EXIT_SIGNALS into SystemExit for the duration of the context (if
+    enabled), so that `finally` clauses get to clean up.
+    """
+    old_handlers = {}
+    if enabled:
+        for signum in EXIT_SIGNALS:
+            old_handlers[signum] = signal.signal(signum, _raise_exit)
+    try:
+        yield
+    finally:
+        for signum, old_handler in old_handlers.items():
+            signal.signal(signum, old_handler)
+
+
+def call_forwarding_signals(run_cmd, **kwargs):
+    """Run run_cmd (with the keyword arguments of `subprocess.Popen`), wait
+    for it and return its exit status, like `subprocess.call`. EXIT_SIGNALS
+    which conda-shell receives meanwhile are passed on to the command instead
+    of ending conda-shell (see `exit_on_signals`), so that the command exits
+    before its environment is removed.
+    """
+    process = subprocess.Popen(run_cmd, **kwargs)
+
+    def forward(signum, frame):
+        try:
+            process.send_signal(signum)
+        except OSError:
+            # The command exited already
+            pass
+    old_handlers = dict((signum, signal.signal(signum, forward))
+                        for signum in EXIT_SIGNALS)
+    try:
+        while True:
+            try:
+                return process.wait()
+            except OSError as err:
+                # Python 2 doesn't retry waits interrupted by signals
+                if err.errno != errno.EINTR:
+                    raise
+    except BaseException:
+        # e.g. KeyboardInterrupt, which subprocess.call handles the same way
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        for signum, old_handler in old_handlers.items():
+            signal.signal(signum, old_handler)
@@ -0,0 +1,79 @@
+"""
+Read and write conda's "explicit" environment specs: lists of package URLs
+(with md5 checksums) which conda can install without running its solver.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from .matching import load_installed_records
+from .utils import atomic_write
+
+
+EXPLICIT_MARKER = '@EXPLICIT'
+
+
+def get_explicit_specs(env_dpath):
+    """Return a list of "<url>#<md5>" strings describing every package
+    installed in the conda environment at env_dpath, in the same order as
+    `conda list --explicit --md5`. Raise ValueError if a package has no URL
+    (e.g. it was installed from a local tarball that no longer exists).
+    """
+    specs = []
+    records = sorted(load_installed_records(env_dpath),
+                     key=lambda record: record.get('name', ''))
+    for record in records:
+        url = record.get('url')
+        if not url:
+            raise ValueError('Package "{}" in "{}" has no URL'.format(
+                record.get('name'), env_dpath
+            ))
+        if record.get('md5'):
+            url += '#' + record['md5']
+        specs.append(url)
+    return specs
+
+
+def get_env_platform(env_dpath):
+    """Return the platform (conda subdir, e.g. "linux-64") of the packages
+    installed in the conda environment at env_dpath, or None if unknown.
+    """
+    for record in load_installed_records(env_dpath):
+        if record.get('subdir') not in (None, 'noarch'):
+            return record['subdir']
+    return None
+
+
+def write_explicit_file(fpath, specs, platform=None):
+    """Atomically write specs (see `get_explicit_specs`) to fpath in conda's
+    explicit file format.
+    """
+    lines = []
+    if platform is not None:
+        lines.append('# platform: ' + platform)
+    lines.append(EXPLICIT_MARKER)
+    lines.extend(specs)
+    atomic_write(fpath, '\n'.join(lines) + '\n')
+
+
+def read_explicit_file(fpath):
+    """Return the package URLs listed in the explicit file at fpath. Raise
+    ValueError if the file isn't in conda's explicit format.
+    """
+    specs = []
+    is_explicit = False
+    with open(fpath, 'r') as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line == EXPLICIT_MARKER:
+                is_explicit = True
+            elif is_explicit:
+                specs.append(line)
+    if not is_explicit:
+        raise ValueError(
+            '"{}" is not an explicit environment file (it is missing the {}'
+            ' line)'.format(fpath, EXPLICIT_MARKER)
+        )
+    return specs
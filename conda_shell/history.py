@@ -0,0 +1,140 @@
+"""
+Incremental parsing of conda environment histories (`conda-meta/history`).
+The parsed commands of each history file are cached along with the file's
+identity and the number of bytes consumed, so that a history which was
+appended to (by `conda install`) only has its new lines parsed.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import shlex
+import argparse
+
+from .utils import (CACHE_DNAME, get_cache_dpath, load_json,
+                    atomic_write_json)
+
+
+HISTORY_CACHE_DNAME = 'histories'
+HISTORY_CACHE_VERSION = 1
+
+# Namespace attributes of a parsed history command which conda-shell relies
+# on (see `matching.get_requested_specs` and `main.get_env_key`)
+HISTORY_ATTRS = ('packages', 'channel', 'file')
+
+
+def _normalize(args, kind):
+    cmd = {'kind': kind}
+    for attr in HISTORY_ATTRS:
+        cmd[attr] = getattr(args, attr, None)
+    return cmd
+
+
+def parse_history_lines(lines, cli):
+    """Return the normalized commands (dicts with a `kind` and the
+    HISTORY_ATTRS of the parsed arguments) of the `conda create` and
+    `conda install` commands in lines.
+    """
+    cmds = []
+    for line in lines:
+        if not line.startswith('# cmd: conda'):
+            continue
+
+        hist_ln = line.split('# cmd: ', 1)[1]
+        if hist_ln.startswith('conda create'):
+            hist_argv = shlex.split(hist_ln)[2:]
+            cmds.append(_normalize(cli.parse_create_args(hist_argv),
+                                   'create'))
+        elif hist_ln.startswith('conda install'):
+            hist_argv = shlex.split(hist_ln)[2:]
+            cmds.append(_normalize(cli.parse_install_args(hist_argv),
+                                   'install'))
+    return cmds
+
+
+class HistoryCache(object):
+    """Parsed histories of the environments in the conda environments
+    directory prefix_dpath, one cache file per environment. An entry is keyed
+    by the history file's path, inode, size and modification time.
+    """
+
+    def __init__(self, prefix_dpath):
+        """Constructor."""
+        self.dpath = os.path.join(prefix_dpath, CACHE_DNAME,
+                                  HISTORY_CACHE_DNAME)
+        self.prefix_dpath = prefix_dpath
+
+    def _fpath(self, env_dpath):
+        return os.path.join(self.dpath, os.path.basename(env_dpath) + '.json')
+
+    def _load(self, env_dpath, hist_fpath):
+        entry = load_json(self._fpath(env_dpath))
+        if (not isinstance(entry, dict) or
+                entry.get('version') != HISTORY_CACHE_VERSION or
+                entry.get('path') != hist_fpath):
+            return None
+        return entry
+
+    def _save(self, env_dpath, entry):
+        try:
+            get_cache_dpath(self.prefix_dpath, HISTORY_CACHE_DNAME)
+            atomic_write_json(self._fpath(env_dpath), entry)
+        except (IOError, OSError):
+            # e.g. a read-only environments directory; parse again next time
+            pass
+
+    def get_cmds(self, env_dpath, cli):
+        """Return the normalized commands (see `parse_history_lines`) recorded
+        in the history of the conda environment at env_dpath.
+        """
+        hist_fpath = os.path.join(env_dpath, 'conda-meta', 'history')
+        hist_stat = os.stat(hist_fpath)
+        entry = self._load(env_dpath, hist_fpath)
+        if (entry is not None and entry['offset'] == hist_stat.st_size and
+                entry['inode'] == hist_stat.st_ino and
+                entry['size'] == hist_stat.st_size and
+                entry['mtime'] == hist_stat.st_mtime):
+            return entry['cmds']
+
+        if (entry is None or entry['inode'] != hist_stat.st_ino or
+                entry['offset'] > hist_stat.st_size or
+                entry['size'] == hist_stat.st_size):
+            # New, replaced or truncated file, or one which was modified
+            # without growing (rewritten in place): parse it from the start
+            entry = {'version': HISTORY_CACHE_VERSION, 'path': hist_fpath,
+                     'offset': 0, 'cmds': []}
+        with open(hist_fpath, 'rb') as fp:
+            fp.seek(entry['offset'])
+            data = fp.read(hist_stat.st_size - entry['offset'])
+        # Only complete lines are cached; a trailing partial line (which may
+        # still be written to) is parsed again next time
+        split_idx = data.rfind(b'\n') + 1
+        entry['cmds'] = entry['cmds'] + parse_history_lines(
+            data[:split_idx].decode('utf-8', 'replace').splitlines(), cli
+        )
+        entry['offset'] += split_idx
+        entry['inode'] = hist_stat.st_ino
+        entry['size'] = hist_stat.st_size
+        entry['mtime'] = hist_stat.st_mtime
+        self._save(env_dpath, entry)
+        return entry['cmds'] + parse_history_lines(
+            data[split_idx:].decode('utf-8', 'replace').splitlines(), cli
+        )
+
+    def remove(self, env_dpath):
+        """Forget the parsed history of the environment at env_dpath."""
+        try:
+            os.remove(self._fpath(env_dpath))
+        except OSError:
+            pass
+
+
+def get_history_cmds(env_dpath, cli):
+    """Return a list of argparse.Namespace objects, one for each `conda create`
+    and `conda install` command recorded in the history of the conda
+    environment at env_dpath. Only the HISTORY_ATTRS of each command are set.
+    """
+    cache = HistoryCache(os.path.dirname(os.path.abspath(env_dpath)))
+    return [argparse.Namespace(**cmd)
+            for cmd in cache.get_cmds(env_dpath, cli)]
@@ -0,0 +1,245 @@
+"""
+Persistent index which maps package specs to conda-shell environments, so that
+finding a reusable environment doesn't require reading every history file.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import json
+import hashlib
+
+from .utils import (CACHE_DNAME, get_cache_dpath, load_json,
+                    atomic_write_json)
+from .matching import get_requested_specs
+from .scan import parallel_map
+from .stores import is_writable_store
+from .locking import get_lock
+
+
+INDEX_FNAME = 'index.json'
+INDEX_VERSION = 4
+INDEX_LOCK_NAME = 'index'
+
+
+def get_history_stamp(env_dpath):
+    """Return the [mtime, size] of the history of the environment at
+    env_dpath, which changes whenever conda installs into or removes from
+    the environment, or None if it has no history.
+    """
+    try:
+        hist_stat = os.stat(os.path.join(env_dpath, 'conda-meta', 'history'))
+    except OSError:
+        return None
+    return [hist_stat.st_mtime, hist_stat.st_size]
+
+
+def cmds_key(cmds, match='exact'):
+    """Return a hex digest which canonically identifies the package/channel
+    arguments in cmds (a list of argparse.Namespace objects). Specs and
+    channels of all commands are merged (see `get_requested_specs`); the order
+    of package specs doesn't matter, but the order of channels (which
+    determines their priority) does.
+
+    If the first command has a `lock_specs` attribute (see
+    `main.load_lock_cmds`), the digest identifies that explicit list of
+    packages instead.
+
+    Environments found by another match mode than "exact" (e.g. "satisfy",
+    see `main.find_env`) were not created with these specs, so they are
+    recorded under a separate digest for that mode.
+    """
+    lock_specs = getattr(cmds[0], 'lock_specs', None) if cmds else None
+    if lock_specs is not None:
+        # Environments created from an explicit list of packages
+        key_data = ['explicit', sorted(lock_specs)]
+    else:
+        packages, channels = get_requested_specs(cmds)
+        key_data = [sorted(packages), channels]
+    if match != 'exact':
+        key_data.insert(0, match)
+    return hashlib.sha1(json.dumps(key_data).encode('utf-8')).hexdigest()
+
+
+class EnvIndex(object):
+    """On-disk mapping of `cmds_key` digests to environment names, stored
+    underneath the conda environments directory.
+
+    The index records the modification time of the environments directory
+    when it was last written. If that no longer matches (e.g. environments
+    were created or removed behind conda-shell's back), or if the index file is
+    missing, it is considered stale and rebuilt from the environments'
+    histories. The history of each indexed environment is stamped as well
+    (see `get_history_stamp`), so that an environment which was modified in
+    place since it was indexed isn't taken for its old package specs.
+    """
+
+    def __init__(self, prefix_dpath):
+        """Constructor."""
+        self.prefix_dpath = prefix_dpath
+        self.fpath = os.path.join(prefix_dpath, CACHE_DNAME, INDEX_FNAME)
+        self._data = None
+
+    def _load(self):
+        """Return the index contents, or None if the index is missing or was
+        written by an incompatible version of conda-shell.
+        """
+        data = load_json(self.fpath)
+        if (not isinstance(data, dict) or
+                data.get('version') != INDEX_VERSION):
+            return None
+        return data
+
+    def _is_stale(self, data):
+        return data.get('prefix_mtime') != os.path.getmtime(self.prefix_dpath)
+
+    def _is_outdated(self, env_name):
+        """Return True if the environment named env_name was removed, or
+        modified in place, since it was indexed.
+        """
+        env_dpath = os.path.join(self.prefix_dpath, env_name)
+        return (not os.path.isdir(env_dpath) or
+                get_history_stamp(env_dpath) !=
+                self._data['stamps'].get(env_name))
+
+    def _lock(self):
+        """Return the lock which serializes the writers of the index, or None
+        for a read-only store.
+        """
+        if not is_writable_store(self.prefix_dpath):
+            return None
+        return get_lock(self.prefix_dpath, INDEX_LOCK_NAME)
+
+    def _save(self, envs, stamps, prefix_mtime=None):
+        """Write envs (and the history stamps of their environments) to the
+        index, recording prefix_mtime (by default, the current modification
+        time of the environments directory). Callers which write to disk hold
+        the index lock.
+        """
+        writable = is_writable_store(self.prefix_dpath)
+        if writable:
+            # Creating the directory changes the mtime which is recorded
+            get_cache_dpath(self.prefix_dpath)
+        self._data = {
+            'version': INDEX_VERSION,
+            'prefix_mtime': (os.path.getmtime(self.prefix_dpath)
+                             if prefix_mtime is None else prefix_mtime),
+            'envs': envs,
+            'stamps': stamps,
+        }
+        if not writable:
+            # e.g. a shared store, which its own writers keep up to date
+            return
+        # Readers only ever see complete index files, so an environment is
+        # published to other processes (and nodes) all at once
+        atomic_write_json(self.fpath, self._data)
+
+    def _update(self, update_fn):
+        """Replace the envs and history stamps of the index on disk with
+        update_fn(envs, stamps), while holding the index lock, so that
+        concurrent updates aren't lost. If there is no usable index on disk,
+        nothing is written.
+        """
+        lock = self._lock()
+        if lock is not None:
+            lock.acquire()
+        try:
+            data = self._load()
+            if data is None:
+                return
+            self._save(*update_fn(data['envs'], data['stamps']))
+        finally:
+            if lock is not None:
+                lock.release()
+
+    def rebuild(self, env_dpaths, key_fn):
+        """Recreate the index from scratch. env_dpaths should be ordered by
+        preference (most-preferred first) and key_fn should map an environment
+        directory to its `cmds_key` digest (or None if it can't be determined).
+        key_fn is called concurrently for several environments.
+        """
+        return self._rebuild(lambda: env_dpaths, key_fn)
+
+    def _rebuild(self, env_dpaths_fn, key_fn):
+        """Recreate the index from the environments env_dpaths_fn() (see
+        `rebuild`), listed and scanned while holding the index lock, so that
+        environments added meanwhile are recorded on top of the rebuilt index
+        rather than lost. The index records the modification time from before
+        the scan, so an environment created or removed during the scan makes
+        it stale.
+        """
+        if is_writable_store(self.prefix_dpath):
+            get_cache_dpath(self.prefix_dpath)
+        lock = self._lock()
+        if lock is not None:
+            lock.acquire()
+        try:
+            prefix_mtime = os.path.getmtime(self.prefix_dpath)
+            env_dpaths = list(env_dpaths_fn())
+            envs, stamps = {}, {}
+            # Stamped before the history is read, so that a change during
+            # the scan shows up as a mismatch later
+            for env_dpath, (stamp, key) in zip(env_dpaths, parallel_map(
+                    lambda env_dpath: (get_history_stamp(env_dpath),
+                                       key_fn(env_dpath)),
+                    env_dpaths)):
+                if key is not None and key not in envs:
+                    envs[key] = os.path.basename(env_dpath)
+                    stamps[envs[key]] = stamp
+            self._save(envs, stamps, prefix_mtime=prefix_mtime)
+        finally:
+            if lock is not None:
+                lock.release()
+        return envs
+
+    def envs(self, env_dpaths_fn, key_fn, force_rebuild=False):
+        """Return the key-to-environment-name mapping, rebuilding the index
+        from env_dpaths_fn() and key_fn (see `rebuild`) when it is missing or
+        stale.
+        """
+        if self._data is None:
+            self._data = self._load()
+        if (force_rebuild or self._data is None or
+                self._is_stale(self._data)):
+            return self._rebuild(env_dpaths_fn, key_fn)
+        return self._data['envs']
+
+    def lookup(self, cmds, env_dpaths_fn, key_fn, match='exact'):
+        """Return the directory path of an environment matching cmds (in
+        the match mode match), or None if there isn't one.
+        """
+        key = cmds_key(cmds, match=match)
+        env_name = self.envs(env_dpaths_fn, key_fn).get(key)
+        if env_name is not None and self._is_outdated(env_name):
+            env_name = self.envs(env_dpaths_fn, key_fn,
+                                 force_rebuild=True).get(key)
+        if env_name is None:
+            return None
+        return os.path.join(self.prefix_dpath, env_name)
+
+    def add(self, cmds, env_name, match='exact'):
+        """Record that the environment named env_name satisfies cmds (in the
+        match mode match). If there is no usable index on disk, nothing is
+        written: the next lookup rebuilds the index anyway, and will find
+        env_name through its history.
+        """
+        key = cmds_key(cmds, match=match)
+        stamp = get_history_stamp(os.path.join(self.prefix_dpath, env_name))
+
+        def add_env(envs, stamps):
+            envs[key] = env_name
+            stamps[env_name] = stamp
+            return envs, stamps
+        self._update(add_env)
+
+    def remove(self, env_name):
+        """Forget the environment named env_name (e.g. after it was deleted),
+        keeping the rest of the index usable.
+        """
+        self._update(lambda envs, stamps: (
+            dict((key, name) for key, name in envs.items()
+                 if name != env_name),
+            dict((name, stamp) for name, stamp in stamps.items()
+                 if name != env_name)
+        ))
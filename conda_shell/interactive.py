@@ -15,6 +15,21 @@ import shlex
 import six
 
 from . import __version__
+from .utils import atomic_write
+from .activation import get_delta, apply_delta
+
+
+BASHRC_FNAME = 'bashrc'
+# Start-up file of interactive bash shells: the user's own start-up file
+# runs first, then the environment is put back in front of PATH (in case the
+# user's file changed it), and the prompt is set
+BASHRC = """# Written by conda-shell
+if [ -f ~/.bashrc ]; then
+    . ~/.bashrc
+fi
+PATH="$CONDA_PREFIX/bin:$PATH"
+PS1="$CONDA_SHELL_PROMPT"
+"""
 
 
 def teardown_env(old_path, old_pstartup):
@@ -23,17 +38,65 @@ def teardown_env(old_path, old_pstartup):
 
 
 def setup_env(env_vars, env_dpath):
+    """Activate the conda environment at env_dpath in env_vars (see
+    `activate_env`), and return env_vars. PATH and PYTHONSTARTUP are restored
+    in this process's environment at exit.
+    """
+    atexit.register(teardown_env, env_vars.get('PATH', ''),
+                    env_vars.get('PYTHONSTARTUP', ''))
+    return activate_env(env_vars, env_dpath)
+
+
+def activate_env(env_vars, env_dpath):
+    """Activate the conda environment at env_dpath in env_vars, including the
+    changes made by its activation scripts (see `activation.get_delta`), and
+    return env_vars.
+    """
     old_path = env_vars.get('PATH', '')
-    old_pstartup = env_vars.get('PYTHONSTARTUP', '')
-    atexit.register(teardown_env, old_path, old_pstartup)
     env_bindir = os.path.join(env_dpath, 'bin')
     env_vars['PATH'] = os.pathsep.join([env_bindir, old_path])
+    env_vars['CONDA_PREFIX'] = env_dpath
+    env_vars['CONDA_DEFAULT_ENV'] = os.path.basename(env_dpath)
     if 'PYTHONSTARTUP' in env_vars:
         del env_vars['PYTHONSTARTUP']
-    return env_vars
+    return apply_delta(env_vars, get_delta(env_dpath, env_vars))
+
+
+def stdin_isatty():
+    """Return True if standard input is a terminal."""
+    try:
+        return sys.stdin.isatty()
+    except (AttributeError, ValueError, IOError, OSError):
+        return False
+
+
+def get_shell_cmd(env_vars, prompt, rc_dpath):
+    """Return the command line of an interactive `$SHELL` (default: /bin/sh)
+    whose prompt is prompt, and update env_vars for it. bash reads a start-up
+    file in rc_dpath, which is written if necessary; other shells take their
+    prompt from $PS1.
+    """
+    shell = env_vars.get('SHELL') or '/bin/sh'
+    if os.path.basename(shell) == 'bash':
+        rc_fpath = os.path.join(rc_dpath, BASHRC_FNAME)
+        try:
+            with open(rc_fpath, 'r') as fp:
+                is_current = fp.read() == BASHRC
+        except (IOError, OSError):
+            is_current = False
+        if not is_current:
+            atomic_write(rc_fpath, BASHRC)
+        env_vars['CONDA_SHELL_PROMPT'] = prompt
+        return [shell, '--rcfile', rc_fpath, '-i']
+    env_vars['PS1'] = prompt
+    return [shell, '-i']
 
 
 class InteractiveShell(cmd.Cmd):
+    """Line-by-line shell, which runs every line as a separate command. Used
+    when standard input isn't a terminal (see `get_shell_cmd`).
+    """
+
     def __init__(self, prompt, intro=None, env=None):
         if six.PY2:
             cmd.Cmd.__init__(self)
@@ -0,0 +1,128 @@
+"""
+Lightweight stand-in for `CondaShellCLI` which understands just enough of the
+command line to find an existing environment, without importing conda.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import sys
+import argparse
+
+from .stores import get_local_store_dpath, get_store_dpaths
+
+
+MATCH_MODES = ('exact', 'satisfy')
+
+# conda-shell arguments (each of which takes a value) that conda itself doesn't
+# understand
+SHELL_ONLY_OPTIONS = ('--run', '-i', '--interpreter', '--match', '--lock',
+                      '--from-lock', '--store', '--profile', '--zygote')
+# ...and conda-shell flags (which don't take a value)
+SHELL_ONLY_FLAGS = ('--no-solve-cache', '--ephemeral', '--no-exec')
+
+
+class CondaShellArgumentError(Exception):
+    pass
+
+
+class UnsupportedArgumentError(Exception):
+    """Raised when the command line uses arguments that only conda's own
+    parsers understand. Callers should fall back to `CondaShellCLI`.
+    """
+    pass
+
+
+def get_conda_install_dpath():
+    """Return the root directory of the conda installation that conda-shell
+    runs from. Errors-out if the user isn't using Python from within conda.
+    """
+    if 'conda' not in sys.executable:  # pragma: no cover
+        raise ValueError('Failed to find directory where conda is'
+                         ' installed. conda-shell expects to find conda'
+                         ' installed in a directory with "conda" in the'
+                         ' name.')
+    return sys.executable.split('conda')[0] + 'conda'
+
+
+def get_default_match_mode():
+    """Return the default for the `--match` argument."""
+    return os.environ.get('CONDA_SHELL_MATCH', 'exact')
+
+
+class _LightArgumentParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise UnsupportedArgumentError(message)
+
+
+class LightShellCLI(object):
+    """Parse the small subset of `conda-shell`, `conda create` and
+    `conda install` arguments that identify an environment (package specs,
+    channels, name, and conda-shell's own arguments such as `--run`). The
+    resulting Namespaces carry the same `packages` and `channel` values that
+    conda's parsers would produce, so they can be matched against existing
+    environments.
+
+    Any other argument raises `UnsupportedArgumentError`.
+    """
+
+    def __init__(self):
+        """Constructor."""
+        self.prefix_dpath = get_local_store_dpath(
+            os.path.join(get_conda_install_dpath(), 'envs')
+        )
+        self.store_dpaths = get_store_dpaths(self.prefix_dpath)
+        parser_kwargs = {'prog': 'conda-shell', 'add_help': False}
+        if sys.version_info >= (3, 5):
+            # Abbreviated options could mean something else to conda's parsers
+            parser_kwargs['allow_abbrev'] = False
+        self._parser = _LightArgumentParser(**parser_kwargs)
+        self._parser.add_argument('-n', '--name', default=None)
+        self._parser.add_argument('-c', '--channel', action='append')
+        self._parser.add_argument('-y', '--yes', action='store_true',
+                                  default=False)
+        self._parser.add_argument('--run', type=str)
+        self._parser.add_argument('-i', '--interpreter', type=str)
+        self._parser.add_argument('--match', choices=MATCH_MODES,
+                                  default=get_default_match_mode())
+        self._parser.add_argument('--no-solve-cache', action='store_true',
+                                  default=False)
+        self._parser.add_argument('--lock', type=str)
+        self._parser.add_argument('--from-lock', type=str)
+        self._parser.add_argument('--store', type=str)
+        self._parser.add_argument('--ephemeral', action='store_true',
+                                  default=False)
+        self._parser.add_argument('--no-exec', action='store_true',
+                                  default=False)
+        self._parser.add_argument('--profile', type=str)
+        self._parser.add_argument('--zygote', type=str)
+        self._parser.add_argument('--file', action='append')
+        self._parser.add_argument('packages', nargs='*')
+
+    def _parse(self, argv):
+        args, unknown = self._parser.parse_known_args(argv)
+        if unknown:
+            raise UnsupportedArgumentError(
+                'Unrecognized arguments: ' + ' '.join(unknown)
+            )
+        if args.run is not None and args.interpreter is not None:
+            raise UnsupportedArgumentError(
+                '--run and -i/--interpreter are mutually exclusive'
+            )
+        return args
+
+    def parse_create_args(self, argv):
+        """Parse argv as if `conda create` were called over the command line.
+        """
+        return self._parse(argv)
+
+    def parse_install_args(self, argv):
+        """Parse argv as if `conda install` were called over the command line.
+        """
+        return self._parse(argv)
+
+    def parse_shell_args(self, argv):
+        """Parse argv as if `conda-shell` were called over the command line.
+        """
+        return self._parse(argv)
@@ -0,0 +1,131 @@
+"""
+Inter-process coordination: advisory file locks, and markers for environments
+which are still being created.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import errno
+import fcntl
+import contextlib
+
+from .utils import CACHE_DNAME, get_cache_dpath
+
+
+LOCKS_DNAME = 'locks'
+BUILDING_DNAME = 'building'
+
+
+class FileLock(object):
+    """Advisory (`flock`) lock on a file, which is created if necessary. The
+    lock is released when the process exits, even if it crashes.
+    """
+
+    def __init__(self, fpath, shared=False):
+        """Constructor."""
+        self.fpath = fpath
+        self.shared = shared
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        """Acquire the lock. Return False if blocking is False and another
+        process holds the lock, True otherwise.
+        """
+        if self._fd is None:
+            self._fd = os.open(self.fpath, os.O_RDWR | os.O_CREAT, 0o644)
+        flags = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._fd, flags)
+        except (IOError, OSError) as err:
+            if err.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        return True
+
+    def release(self):
+        """Release the lock."""
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def keep_on_exec(self):
+        """Let a program which replaces this process (via `os.exec*`) inherit
+        the lock, so that it is held until that program exits.
+        """
+        if self._fd is not None and hasattr(os, 'set_inheritable'):
+            os.set_inheritable(self._fd, True)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def get_lock(prefix_dpath, name, shared=False):
+    """Return a FileLock for name, kept underneath the conda environments
+    directory prefix_dpath.
+    """
+    return FileLock(os.path.join(get_cache_dpath(prefix_dpath, LOCKS_DNAME),
+                                 name + '.lock'),
+                    shared=shared)
+
+
+def get_building_env_names(prefix_dpath):
+    """Return the set of names of environments which are being created (or
+    whose creation failed) and must not be used.
+    """
+    try:
+        return set(os.listdir(os.path.join(prefix_dpath, CACHE_DNAME,
+                                           BUILDING_DNAME)))
+    except OSError:
+        return set()
+
+
+def is_building_stale(prefix_dpath, env_name):
+    """Return True if env_name is marked as being created, but the process
+    which created it has exited (so the environment is left half-created).
+    """
+    marker_fpath = os.path.join(prefix_dpath, CACHE_DNAME, BUILDING_DNAME,
+                                env_name)
+    if not os.path.exists(marker_fpath):
+        return False
+    lock = FileLock(marker_fpath)
+    if not lock.acquire(blocking=False):
+        return False
+    lock.release()
+    return True
+
+
+def clear_building(prefix_dpath, env_name):
+    """Remove the marker of env_name, if any."""
+    marker_fpath = os.path.join(prefix_dpath, CACHE_DNAME, BUILDING_DNAME,
+                                env_name)
+    if os.path.exists(marker_fpath):
+        os.remove(marker_fpath)
+
+
+@contextlib.contextmanager
+def building(prefix_dpath, env_name):
+    """Mark env_name as being created for the duration of the context. The
+    marker is removed (publishing the environment) only if the context exits
+    without an exception; otherwise the half-created environment stays hidden
+    from `get_conda_env_dirs`.
+    """
+    marker_fpath = os.path.join(get_cache_dpath(prefix_dpath, BUILDING_DNAME),
+                                env_name)
+    lock = FileLock(marker_fpath)
+    lock.acquire()
+    try:
+        yield
+    except BaseException:
+        lock.release()
+        raise
+    os.remove(marker_fpath)
+    lock.release()
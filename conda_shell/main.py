@@ -12,13 +12,44 @@ import subprocess
 import uuid
 import shlex
 import copy
-
-from .conda_cli import CondaShellCLI, CondaShellArgumentError
-from .interactive import setup_env, InteractiveShell
+import argparse
+
+from .light_cli import (LightShellCLI, CondaShellArgumentError,
+                        UnsupportedArgumentError)
+from .index import EnvIndex, cmds_key
+from .script_cache import ScriptCache, read_header
+from .history import get_history_cmds
+from .scan import list_dir, parallel_map, find_first
+from .matching import env_satisfies, get_requested_specs
+from .solve_cache import SolveCache
+from .pool import (load_pool, save_pool, make_base, pool_env_name,
+                   is_pool_env_ready, find_pool_base, clone_from_pool,
+                   refill_pool, remove_pool_env)
+from .locking import (get_lock, building, get_building_env_names,
+                      is_building_stale)
+from .cleanup import (parse_size, get_default_budget, get_env_lock,
+                      record_use, remove_env, collect_garbage)
+from .ephemeral import (get_ephemeral_dpath, softlink_packages,
+                        exit_on_signals, call_forwarding_signals)
+from .stores import is_writable_store
+from .snapshots import (get_snapshot_dpath, fetch_snapshot, pack_env,
+                        restore_env)
+from .explicit import (get_explicit_specs, get_env_platform,
+                       read_explicit_file, write_explicit_file)
+from .interactive import (setup_env, stdin_isatty, get_shell_cmd,
+                          InteractiveShell)
+from .zygote import parse_modules, run_script
+from .profiling import (clock, span, profiled, get_profile_fpath,
+                        is_profiling, start_profiling, finish_profiling)
+from .utils import get_cache_dpath
 
 
 DEFAULT_ENV_PREFIX = os.environ.get('CONDA_SHELL_ENV_PREFIX', 'shell_')
 
+# Namespace attributes which may differ between commands merged by `merge_cmds`
+MERGEABLE_ATTRS = ('packages', 'channel', '_argv', 'name', 'yes', 'run',
+                   'interpreter', 'zygote')
+
 
 def rand_env_name(prefix=None):
     """Return a unique environment name of prefix + some hex UUID. If prefix is
@@ -39,51 +70,47 @@ def is_shell_env(env_dpath, prefix=None):
     return os.path.basename(env_dpath).startswith(prefix)
 
 
-def parse_script_cmds(script_fpath, cli):
+def parse_shebang_lines(lines, cli):
     """Return a list of argparse.Namespace objects, representing parsed
-    arguments to be passed to `conda install`. Assumes that conda-shell
-    is being run from inside of a shebang line.
+    arguments to be passed to `conda install`, for the `#!conda-shell` lines
+    among lines. The interpreter of every command is set, but neither its
+    environment name nor its --run command.
     """
     conda_cmds = []
     interpreter = None
-    with open(script_fpath, 'r') as fp:
-        for line in fp:
-            if re.match(r'^#!\s*conda-shell\s+', line):
-                cs_cmd = shlex.split(line.split('conda-shell', 1)[1].rstrip())
-                args = cli.parse_shell_args(cs_cmd)
-                if args.run is not None:
-                    raise CondaShellArgumentError(
-                        'Please do not provide --run argument when calling'
-                        ' conda-shell from the shebang line'
-                    )
-                if args.name is not None:
+    for line in lines:
+        if re.match(r'^#!\s*conda-shell\s+', line):
+            cs_cmd = shlex.split(line.split('conda-shell', 1)[1].rstrip())
+            args = cli.parse_shell_args(cs_cmd)
+            if args.run is not None:
+                raise CondaShellArgumentError(
+                    'Please do not provide --run argument when calling'
+                    ' conda-shell from the shebang line'
+                )
+            if args.name is not None:
+                raise CondaShellArgumentError(
+                    'Please do not provide -n/--name argument when calling'
+                    ' conda-shell from the shebang line'
+                )
+            if not conda_cmds and args.interpreter is None:
+                raise CondaShellArgumentError(
+                    'The first "#!conda-shell" shebang line should provide'
+                    ' the -i/--interactive argument. This is necessary so'
+                    ' that conda-shell knows how to execute the script.'
+                )
+            args._argv = cs_cmd
+            if (args.interpreter is not None and
+                    args.interpreter != interpreter):
+                if interpreter is not None:
                     raise CondaShellArgumentError(
-                        'Please do not provide -n/--name argument when calling'
-                        ' conda-shell from the shebang line'
+                        'Conflicting -i/--interpreter arguments provided'
+                        ' in different shebang lines. Please make change'
+                        ' them to be equivalent, or remove all but the'
+                        ' first one.'
                     )
-                if not conda_cmds and args.interpreter is None:
-                    raise CondaShellArgumentError(
-                        'The first "#!conda-shell" shebang line should provide'
-                        ' the -i/--interactive argument. This is necessary so'
-                        ' that conda-shell knows how to execute the script.'
-                    )
-                args._argv = cs_cmd
-                if (args.interpreter is not None and
-                        args.interpreter != interpreter):
-                    if interpreter is not None:
-                        raise CondaShellArgumentError(
-                            'Conflicting -i/--interpreter arguments provided'
-                            ' in different shebang lines. Please make change'
-                            ' them to be equivalent, or remove all but the'
-                            ' first one.'
-                        )
-                    interpreter = args.interpreter
-                args.yes = True
-                if not conda_cmds:
-                    args.name = rand_env_name()
-                else:
-                    args.name = conda_cmds[0].name
-                conda_cmds.append(args)
+                interpreter = args.interpreter
+            args.yes = True
+            conda_cmds.append(args)
 
     if interpreter is None:
         raise CondaShellArgumentError(
@@ -91,139 +118,897 @@ def parse_script_cmds(script_fpath, cli):
             ' -i/--interactive argument. This is necessary so that conda-shell'
             ' knows how to execute the script.'
         )
-
-    # Set the --interpreter and --run arguments of each conda-shell command
-    # (read in the shebang lines)
     for cs_cmd in conda_cmds:
         cs_cmd.interpreter = interpreter
+    return conda_cmds
+
+
+@profiled('parse script')
+def parse_script_cmds(script_fpath, cli):
+    """Return a list of argparse.Namespace objects, representing parsed
+    arguments to be passed to `conda install`. Assumes that conda-shell
+    is being run from inside of a shebang line.
+
+    Only the header block of the script is read, and the parsed commands are
+    cached (see `script_cache`), so that an unchanged script isn't parsed
+    again.
+    """
+    fstat, header = read_header(script_fpath)
+    cache = ScriptCache(cli.prefix_dpath)
+    key = cache.key(script_fpath, fstat, header, cli)
+    conda_cmds = cache.lookup(script_fpath, key)
+    if conda_cmds is None:
+        conda_cmds = parse_shebang_lines(header, cli)
+        cache.store(script_fpath, key, conda_cmds)
+
+    # Set the name and --run arguments of each conda-shell command (read in
+    # the shebang lines)
+    env_name = rand_env_name()
+    for cs_cmd in conda_cmds:
+        cs_cmd.name = env_name
         cs_cmd.run = cs_cmd.interpreter + ' ' + script_fpath
 
     return conda_cmds
 
 
+def load_lock_cmds(cmds, base_dpath):
+    """If one of cmds has a `--from-lock` argument, return a list with a single
+    argparse.Namespace which creates an environment from that explicit file
+    (a relative path is relative to base_dpath). The explicit package list is
+    stored as the `lock_specs` attribute, which `cmds_key` uses to identify
+    the environment. Otherwise, return cmds unchanged.
+    """
+    lock_cmds = [cmd for cmd in cmds if getattr(cmd, 'from_lock', None)]
+    if not lock_cmds:
+        return cmds
+    if len(lock_cmds) > 1:
+        raise CondaShellArgumentError(
+            'Please provide the --from-lock argument only once'
+        )
+    if any(cmd.packages or cmd.channel for cmd in cmds):
+        raise CondaShellArgumentError(
+            'Package specs and channels can not be combined with the'
+            ' --from-lock argument'
+        )
+
+    lock_fpath = os.path.join(base_dpath,
+                              os.path.expanduser(lock_cmds[0].from_lock))
+    try:
+        lock_specs = read_explicit_file(lock_fpath)
+    except ValueError as err:
+        raise CondaShellArgumentError(str(err))
+
+    lock_cmd = copy.copy(cmds[0])
+    lock_cmd.lock_specs = lock_specs
+    lock_cmd.file = [lock_fpath]
+    lock_cmd._argv = list(cmds[0]._argv) + ['--file', lock_fpath]
+    return [lock_cmd]
+
+
+def write_lock(env_dpath, lock_fpath):
+    """Write the explicit list of packages installed in the conda environment
+    at env_dpath to lock_fpath.
+    """
+    write_explicit_file(lock_fpath, get_explicit_specs(env_dpath),
+                        platform=get_env_platform(env_dpath))
+
+
+def merge_cmds(cmds):
+    """Return a list with a single argparse.Namespace which requests the
+    packages and channels of every command in cmds, so that they can be
+    installed with one `conda create` (one solve and one link transaction)
+    instead of a `conda create` followed by several `conda install`s.
+
+    Commands which differ in any other argument can't be merged; in that case
+    cmds is returned unchanged.
+    """
+    if len(cmds) < 2:
+        return cmds
+    for cmd in cmds[1:]:
+        for key, value in vars(cmd).items():
+            if (key not in MERGEABLE_ATTRS and
+                    getattr(cmds[0], key, None) != value):
+                return cmds
+
+    merged = copy.copy(cmds[0])
+    merged.packages, channels = get_requested_specs(cmds)
+    merged.channel = channels or None
+    merged._argv = list(cmds[0]._argv)
+    for cmd in cmds[1:]:
+        for channel in (cmd.channel or []):
+            if channel not in (cmds[0].channel or []):
+                merged._argv.extend(['-c', channel])
+        merged._argv.extend(cmd.packages or [])
+    return [merged]
+
+
+@profiled('scan envs')
 def get_conda_env_dirs(prefix):
     """Return an iterable which yields strings representing the directory paths
     to all conda environments created by conda-shell, in descending order by
     last-modification time (recently modified come first). The `is_shell_env`
     function is used to determine whether the environment was created by
-    conda-shell.
+    conda-shell. Environments which are still being created are left out.
+
+    The environments are stat'ed concurrently (see `scan.parallel_map`).
     """
-    envs = os.listdir(prefix)
-    env_dpaths = sorted(map(lambda env: os.path.join(prefix, env),
-                            filter(is_shell_env, envs)),
-                        key=lambda dpath: os.path.getmtime(dpath),
-                        reverse=True)
-    return env_dpaths
+    building_envs = get_building_env_names(prefix)
+    env_dpaths = [dpath for env, dpath in list_dir(prefix)
+                  if is_shell_env(env) and env not in building_envs]
+
+    def get_mtime(dpath):
+        try:
+            return os.path.getmtime(dpath)
+        except OSError:
+            # Removed since the directory was listed
+            return None
+
+    mtimes = parallel_map(get_mtime, env_dpaths)
+    env_mtimes = [(mtime, dpath) for mtime, dpath in zip(mtimes, env_dpaths)
+                  if mtime is not None]
+    return [dpath for mtime, dpath in
+            sorted(env_mtimes, key=lambda item: item[0], reverse=True)]
+
+
+def get_stale_env_dirs(prefix):
+    """Return the directory paths of conda-shell environments whose creation
+    was interrupted (see `locking.is_building_stale`).
+    """
+    return [os.path.join(prefix, env)
+            for env in sorted(get_building_env_names(prefix))
+            if is_shell_env(env) and is_building_stale(prefix, env)]
+
+
+def collect_env_garbage(prefix, max_bytes=None, max_envs=None,
+                        dry_run=False):
+    """Remove interrupted and least-recently used conda-shell environments
+    until the rest fit in the budget (see `cleanup.collect_garbage`). Return
+    the list of removed environment directories.
+    """
+    return collect_garbage(prefix, get_conda_env_dirs(prefix),
+                           max_bytes=max_bytes, max_envs=max_envs,
+                           stale_env_dpaths=get_stale_env_dirs(prefix),
+                           env_index=EnvIndex(prefix), dry_run=dry_run)
+
+
+def collect_default_garbage(prefix):
+    """Run `collect_env_garbage` with the default budget (see
+    `cleanup.get_default_budget`), if there is one.
+    """
+    max_bytes, max_envs = get_default_budget()
+    if max_bytes is not None or max_envs is not None:
+        collect_env_garbage(prefix, max_bytes=max_bytes, max_envs=max_envs)
+
+
+@profiled('env key')
+def get_env_key(env_dpath, cli):
+    """Return the `cmds_key` digest of the conda environment at env_dpath, or
+    None if its history can't be read. Environments which were created from an
+    explicit file (see `load_lock_cmds`) are keyed by their installed
+    packages.
+    """
+    try:
+        hist_cmds = get_history_cmds(env_dpath, cli)
+        if (hist_cmds and getattr(hist_cmds[0], 'file', None) and
+                not any(cmd.packages for cmd in hist_cmds)):
+            hist_cmds[0].lock_specs = get_explicit_specs(env_dpath)
+        return cmds_key(hist_cmds)
+    except (IOError, OSError, ValueError):
+        return None
 
 
 def env_has_pkgs(env_dpath, cmds, cli):
     """Return True if env_dpath points to a conda environment which contains
-    packages requested by cmds list.
+    packages requested by cmds list. The package specs and channels of all
+    commands are merged before comparison, so an environment which was created
+    in one transaction (see `merge_cmds`) matches the same list of commands as
+    one which was created and then installed into.
 
     TODO: Refactor this function so it relies on fewer "hacks".
     """
-    hist_fpath = os.path.join(env_dpath, 'conda-meta', 'history')
-
-    cmd_idx = 0
-    with open(hist_fpath, 'r') as fp:
-        for line in fp:
-            if not line.startswith('# cmd: conda'):
-                continue
-
-            hist_ln = line.split('# cmd: ', 1)[1]
-            if hist_ln.startswith('conda create'):
-                hist_argv = shlex.split(hist_ln)[2:]
-                hist_args = cli.parse_create_args(hist_argv)
-            elif hist_ln.startswith('conda install'):
-                hist_argv = shlex.split(hist_ln)[2:]
-                hist_args = cli.parse_install_args(hist_argv)
-            else:
-                continue
-
-            if cmd_idx >= len(cmds):
-                return False
-            expected_args = cmds[cmd_idx]
-            if (expected_args.packages == hist_args.packages and
-                    expected_args.channel == hist_args.channel):
-                cmd_idx += 1
-            else:
-                return False
+    expected_pkgs, expected_chans = get_requested_specs(cmds)
+    hist_pkgs, hist_chans = get_requested_specs(
+        get_history_cmds(env_dpath, cli)
+    )
+    return (sorted(expected_pkgs) == sorted(hist_pkgs) and
+            expected_chans == hist_chans)
+
+
+@profiled('find env')
+def find_env(cmds, cli):
+    """Return the directory path of a conda-shell environment which satisfies
+    cmds, or None if there isn't one. The environment stores in
+    `cli.store_dpaths` (and the `store` of the first command, if any) are
+    searched in order (see `stores`). The persistent
+    `EnvIndex` of each store is consulted first; it is rebuilt from the
+    environments' histories when it is missing or stale.
+
+    If the first command's `match` attribute is "satisfy" and no environment
+    was created with the same package specs, fall back to the most recently
+    modified environment whose installed packages satisfy the specs (see
+    `matching.env_satisfies`). That requires conda's MatchSpec, so it is
+    skipped for CLI objects which don't provide `match_spec`. Environments
+    found that way are recorded in the index under the "satisfy" match mode,
+    so that they are never taken for exact matches.
+    """
+    store_dpaths = list(cli.store_dpaths)
+    if getattr(cmds[0], 'store', None) not in [None] + store_dpaths:
+        store_dpaths.append(cmds[0].store)
+    store_dpaths = [store_dpath for store_dpath in store_dpaths
+                    if os.path.isdir(store_dpath)]
+    for store_dpath in store_dpaths:
+        env_dpath = EnvIndex(store_dpath).lookup(
+            cmds,
+            lambda: get_conda_env_dirs(store_dpath),
+            lambda env_dpath: get_env_key(env_dpath, cli)
+        )
+        if env_dpath is not None:
+            return env_dpath
+    if (getattr(cmds[0], 'match', 'exact') == 'satisfy' and
+            hasattr(cli, 'match_spec')):
+        for store_dpath in store_dpaths:
+            env_index = EnvIndex(store_dpath)
+            env_dpath = env_index.lookup(
+                cmds,
+                lambda: get_conda_env_dirs(store_dpath),
+                lambda env_dpath: get_env_key(env_dpath, cli),
+                match='satisfy'
+            )
+            # The environment may have changed since it was recorded
+            if (env_dpath is not None and
+                    env_satisfies(env_dpath, cmds, cli)):
+                return env_dpath
+        for store_dpath in store_dpaths:
+            env_dpath = find_first(
+                lambda candidate_dpath: env_satisfies(candidate_dpath, cmds,
+                                                      cli),
+                get_conda_env_dirs(store_dpath)
+            )
+            if env_dpath is not None:
+                # Later lookups of the same specs can skip the scan; the
+                # environment isn't recorded as an exact match, though
+                EnvIndex(store_dpath).add(cmds, os.path.basename(env_dpath),
+                                          match='satisfy')
+                return env_dpath
+    return None
+
+
+def create_conda_env(cmds, cli, store_dpath):
+    """Create the conda environment requested by cmds in store_dpath, by
+    cloning a pool environment and installing the rest, or with conda.
+    """
+    # Solve and link everything in a single transaction when possible
+    create_cmds = merge_cmds(cmds)
+    pool_base = None
+    if (len(create_cmds) == 1 and store_dpath == cli.prefix_dpath and
+            getattr(create_cmds[0], 'lock_specs', None) is None):
+        pool_base = find_pool_base(create_cmds[0].packages or [],
+                                   create_cmds[0].channel, cli.prefix_dpath)
+    if pool_base is not None:
+        print('Cloning pool env "{}"...'.format(pool_env_name(pool_base)),
+              file=sys.stderr)
+        clone_from_pool(pool_base, create_cmds[0], cli)
+    else:
+        cli.conda_create(create_cmds[0])
+        for cmd in create_cmds[1:]:
+            cli.conda_install(cmd)
+
 
-    return cmd_idx == len(cmds)
+@profiled('create env')
+def create_env(cmds, cli, store_dpath=None):
+    """Create a fresh conda environment named after the first of cmds, which
+    satisfies cmds, and return its directory path. The environment is created
+    in store_dpath, the store given by the `store` attribute of the first
+    command, or the local store (`cli.prefix_dpath`). If a snapshot of the same
+    environment is available (see `snapshots`), it is unpacked instead of
+    running conda. While the environment is being created it is marked as
+    such (see `locking.building`), so that no other process picks it up; once
+    complete, it is published to the store's `EnvIndex`.
+    """
+    env_name = cmds[0].name
+    store_dpath = (store_dpath or getattr(cmds[0], 'store', None) or
+                   cli.prefix_dpath)
+    env_dpath = os.path.join(store_dpath, env_name)
+    print('Creating new environment "{}"...'.format(env_name),
+          file=sys.stderr)
+    with building(store_dpath, env_name):
+        # Unpacking a snapshot of the same environment is the fastest
+        restored = False
+        with fetch_snapshot(cmds_key(cmds)) as snapshot_fpath:
+            if snapshot_fpath is not None:
+                print('Restoring snapshot "{}"...'.format(snapshot_fpath),
+                      file=sys.stderr)
+                try:
+                    restore_env(snapshot_fpath, env_dpath)
+                    restored = True
+                except ValueError as err:
+                    print(str(err), file=sys.stderr)
+
+        if not restored:
+            # Tell conda which store to create the environment in
+            store_cmds = [copy.copy(cmd) for cmd in cmds]
+            for cmd in store_cmds:
+                cmd.store = store_dpath
+            create_conda_env(store_cmds, cli, store_dpath)
+        if not os.path.isdir(env_dpath):
+            raise ValueError('Could not find freshly-created environment named'
+                             ' "{}"'.format(env_name))
+    # Once it is no longer marked as being built, so that an index rebuild
+    # which left it out is updated afterwards
+    EnvIndex(store_dpath).add(cmds, env_name)
+    return env_dpath
+
+
+def create_ephemeral_env(cmds, cli):
+    """Create a fresh conda environment which satisfies cmds in the ephemeral
+    store (see `ephemeral.get_ephemeral_dpath`), symlinking package files
+    from conda's package cache. Return its directory path.
+    """
+    ephemeral_dpath = get_ephemeral_dpath()
+    try:
+        with softlink_packages():
+            return create_env(cmds, cli, store_dpath=ephemeral_dpath)
+    except BaseException:
+        remove_ephemeral_env(os.path.join(ephemeral_dpath, cmds[0].name))
+        raise
+
+
+def remove_ephemeral_env(env_dpath):
+    """Remove the ephemeral environment at env_dpath, along with conda-shell's
+    records of it.
+    """
+    store_dpath = os.path.dirname(env_dpath)
+    print('Removing ephemeral env "{}"...'.format(os.path.basename(env_dpath)),
+          file=sys.stderr)
+    remove_env(store_dpath, env_dpath, EnvIndex(store_dpath))
+
+
+def find_or_create_env(cmds, cli, create_fn=None):
+    """Return a (env_dpath, created) tuple: the directory path of an
+    environment which satisfies cmds, and whether it was freshly created (by
+    create_fn, `create_env` by default) because none was found. Only one
+    process creates an environment for the same specs; the others wait for it
+    to finish, and then reuse its environment.
+    """
+    creation_lock = get_lock(cli.prefix_dpath, cmds_key(cmds))
+    if not creation_lock.acquire(blocking=False):
+        print('Waiting for another conda-shell process to create the'
+              ' environment...', file=sys.stderr)
+        creation_lock.acquire()
+    try:
+        env_dpath = find_env(cmds, cli)
+        if env_dpath is not None:
+            return env_dpath, False
+        return (create_fn or create_env)(cmds, cli), True
+    finally:
+        creation_lock.release()
+
+
+def acquire_env(env_dpath):
+    """Record the use of the environment at env_dpath and keep garbage
+    collection away from it (see `cleanup`). Return the acquired in-use lock,
+    or None if the environment is in a read-only store.
+    """
+    store_dpath, env_name = os.path.split(env_dpath)
+    if not is_writable_store(store_dpath):
+        return None
+    env_lock = get_env_lock(store_dpath, env_name)
+    env_lock.acquire()
+    record_use(store_dpath, env_name)
+    return env_lock
 
 
-def run_cmds_in_env(cmds, cli, argv, in_shebang=False):
+def run_cmds_in_env(cmds, cli, argv, in_shebang=False, env_dpath=None,
+                    exec_run=False):
     """Execute the cmds (list of argparse.Namespace objects) in a temporary
     conda environment. Interactive shell functionality is a REPL. Shebang lines
     are handled the same way we handle running arbitrary commands with --run:
     the --run parameter simply becomes "<interpreter> <script_fpath>" in the
     case of a shebang line invocation of conda-shell.
+
+    If env_dpath is provided, it must point to an environment which is already
+    known to satisfy cmds.
+
+    If the first command's `ephemeral` attribute is set and no environment can
+    be reused, the environment is created in the ephemeral store and removed
+    once the command or interactive shell exits (also when conda-shell is
+    terminated by a signal, which is first passed on to the command).
+
+    The interactive shell is the user's `$SHELL`, if standard input is a
+    terminal (see `interactive.get_shell_cmd`).
+
+    If the first command's `zygote` attribute lists modules, a Python script
+    is run by a zygote of the environment with those modules imported (see
+    `zygote`), once one is running.
+
+    If exec_run is True, the --run command (or shell) replaces the current
+    process (see `os.execvpe`) unless there is something to clean up
+    afterwards, or the first command's `no_exec` attribute is set. Otherwise,
+    return the exit status of the command.
     """
     env_vars = os.environ.copy()
 
     # If there is an environment we can reuse, then find/activate it
     env_to_reuse = os.environ.get('CONDA_SHELL_ENV_NAME', None)
-    if env_to_reuse is None:
-        env_dpaths = get_conda_env_dirs(cli.prefix_dpath)
-        for env_dpath in env_dpaths:
-            if env_has_pkgs(env_dpath, cmds, cli):
+    ephemeral = (getattr(cmds[0], 'ephemeral', False) and
+                 env_to_reuse is None)
+    with exit_on_signals(enabled=ephemeral):
+        created = False
+        if env_to_reuse is not None:
+            # Environments outside of the local store are given by their path
+            env_dpath = os.path.join(cli.prefix_dpath, env_to_reuse)
+            env_lock = acquire_env(env_dpath)
+        else:
+            while True:
+                if env_dpath is None:
+                    env_dpath = find_env(cmds, cli)
+                if env_dpath is None and ephemeral:
+                    env_dpath = create_ephemeral_env(cmds, cli)
+                    created = True
+                elif env_dpath is None:
+                    env_dpath, created = find_or_create_env(cmds, cli)
+                env_lock = acquire_env(env_dpath)
+                if os.path.isdir(env_dpath):
+                    break
+                # Garbage collection removed the environment in the meantime
+                if env_lock is not None:
+                    env_lock.release()
+                env_dpath = None
+            if not created:
                 env_to_reuse = os.path.basename(env_dpath)
                 print('Reusing shell env "{}"...'.format(env_to_reuse),
                       file=sys.stderr)
-                env_vars['CONDA_SHELL_ENV_NAME'] = env_to_reuse
-                break
-
-    # Existing environment was not found, so create a fresh one.
-    if env_to_reuse is None:
-        print('Creating new environment "{}"...'.format(cmds[0].name),
-              file=sys.stderr)
-        cli.conda_create(cmds[0])
-        for cmd in cmds[1:]:
-            cli.conda_install(cmd)
-        found_env = False
-        env_dpaths = get_conda_env_dirs(cli.prefix_dpath)
-        for env_dpath in env_dpaths:
-            if os.path.basename(env_dpath) == cmds[0].name:
-                found_env = True
-                break
-        if not found_env:
-            raise ValueError('Could not find freshly-created environment named'
-                             ' "{}"'.format(cmds[0].name))
-
-    env_vars = setup_env(env_vars, env_dpath)
-    if cmds[0].run is not None:
-        for cmd in cmds:
-            if env_to_reuse is not None:
-                cmd.name = env_to_reuse
-        # Retain arguments from cmdline if called from a shebang
-        if in_shebang:
-            run_cmd = shlex.split(cmds[0].run) + argv[2:]
-        else:
-            run_cmd = shlex.split(cmds[0].run)
-        subprocess.call(run_cmd,
-                        env=env_vars,
-                        universal_newlines=True)
-    else:
-        prompt = '[{}]: '.format(os.path.basename(env_dpath))
-        InteractiveShell(prompt, env=env_vars).cmdloop()
-
-
-def main(argv):
-    cli = CondaShellCLI()
-
-    in_shebang = (len(argv) > 1 and
-                  argv[0].endswith('conda-shell') and
-                  os.path.isfile(argv[1]) and
-                  os.access(argv[1], os.X_OK))
-
+                env_vars['CONDA_SHELL_ENV_NAME'] = (
+                    env_to_reuse
+                    if os.path.dirname(env_dpath) == cli.prefix_dpath
+                    else env_dpath
+                )
+
+        try:
+            if created and not ephemeral:
+                collect_default_garbage(cli.prefix_dpath)
+
+            for cmd in cmds:
+                if getattr(cmd, 'lock', None):
+                    write_lock(env_dpath, cmd.lock)
+
+            with span('activate'):
+                env_vars = setup_env(env_vars, env_dpath)
+            prompt = '[{}]: '.format(os.path.basename(env_dpath))
+            if cmds[0].run is not None:
+                for cmd in cmds:
+                    if env_to_reuse is not None:
+                        cmd.name = env_to_reuse
+                # Retain arguments from cmdline if called from a shebang
+                if in_shebang:
+                    run_cmd = shlex.split(cmds[0].run) + argv[2:]
+                else:
+                    run_cmd = shlex.split(cmds[0].run)
+            elif stdin_isatty():
+                # One long-lived shell for the whole session
+                run_cmd = get_shell_cmd(env_vars, prompt,
+                                        get_cache_dpath(cli.prefix_dpath))
+            else:
+                InteractiveShell(prompt, env=env_vars).cmdloop()
+                return 0
+
+            if in_shebang and getattr(cmds[0], 'zygote', None):
+                status = run_script(
+                    env_dpath, env_vars, run_cmd,
+                    parse_modules(cmds[0].zygote),
+                    lock_fpath=env_lock.fpath if env_lock is not None else None
+                )
+                if status is not None:
+                    return status
+
+            if (exec_run and not (created and ephemeral) and
+                    not getattr(cmds[0], 'no_exec', False)):
+                # The command keeps the environment in use until it exits
+                if env_lock is not None:
+                    env_lock.keep_on_exec()
+                finish_profiling()
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os.execvpe(run_cmd[0], run_cmd, env_vars)
+            with span('run', cmd=run_cmd[0]):
+                # Termination signals must not end conda-shell (and remove
+                # the environment) before the command exits
+                call_fn = (call_forwarding_signals if ephemeral
+                           else subprocess.call)
+                return call_fn(run_cmd, env=env_vars, universal_newlines=True)
+        finally:
+            if env_lock is not None:
+                env_lock.release()
+            if created and ephemeral:
+                remove_ephemeral_env(env_dpath)
+
+
+def parse_cmds(argv, cli, in_shebang=False, cwd=None):
+    """Return the list of argparse.Namespace objects described by argv, either
+    directly or via the shebang lines of the script that argv refers to.
+    Relative `--lock`/`--from-lock`/`--store`/`--profile` paths are resolved
+    against the script's directory (in a shebang) or cwd (by default, the
+    current working directory).
+    """
     if in_shebang:
         script_fpath = argv[1]
         cmds = parse_script_cmds(script_fpath, cli)
+        base_dpath = os.path.dirname(os.path.abspath(script_fpath))
     else:
         cmds = [cli.parse_shell_args(argv[1:])]
         cmds[0]._argv = copy.deepcopy(argv)
         cmds[0].yes = True
         if cmds[0].name is None:
             cmds[0].name = rand_env_name()
+        base_dpath = cwd or os.getcwd()
+    for cmd in cmds:
+        if getattr(cmd, 'lock', None):
+            cmd.lock = os.path.join(base_dpath, os.path.expanduser(cmd.lock))
+        if getattr(cmd, 'store', None):
+            cmd.store = os.path.abspath(
+                os.path.join(base_dpath, os.path.expanduser(cmd.store))
+            )
+        if getattr(cmd, 'profile', None):
+            cmd.profile = os.path.join(base_dpath,
+                                       os.path.expanduser(cmd.profile))
+    return load_lock_cmds(cmds, base_dpath)
+
+
+def find_env_fast(argv, in_shebang=False):
+    """Try to resolve argv to an existing environment without importing conda.
+    Return a (cmds, cli, env_dpath) tuple on success, or None if conda's own
+    parsers are needed (unfamiliar arguments, or no matching environment).
+    """
+    try:
+        cli = LightShellCLI()
+        cmds = parse_cmds(argv, cli, in_shebang=in_shebang)
+        env_to_reuse = os.environ.get('CONDA_SHELL_ENV_NAME', None)
+        if env_to_reuse is not None:
+            env_dpath = os.path.join(cli.prefix_dpath, env_to_reuse)
+        else:
+            env_dpath = find_env(cmds, cli)
+    except UnsupportedArgumentError:
+        return None
+    if env_dpath is None:
+        return None
+    return cmds, cli, env_dpath
+
+
+def clear_cache_cmd(argv):
+    """Implementation of `conda-shell clear-cache`."""
+    parser = argparse.ArgumentParser(
+        prog='conda-shell clear-cache',
+        description='Remove cached information about the conda installation'
+                    ' (e.g. after modifying conda in-place).'
+    )
+    parser.add_argument('--solves', action='store_true',
+                        help='Also remove cached solver results')
+    args = parser.parse_args(argv)
+    from .conda_cli import clear_cli_cache
+    clear_cli_cache()
+    if args.solves:
+        SolveCache(LightShellCLI().prefix_dpath).clear()
+
+
+def pool_cmd(argv):
+    """Implementation of `conda-shell pool`."""
+    parser = argparse.ArgumentParser(
+        prog='conda-shell pool',
+        description='Manage the pool of base environments. Requests which'
+                    ' include all packages of a base (on the same channels)'
+                    ' are served by cloning it and installing the rest.'
+    )
+    subparsers = parser.add_subparsers(dest='action')
+    for action, help_msg in (('add', 'Define a base environment'),
+                             ('remove', 'Remove a base environment')):
+        action_parser = subparsers.add_parser(action, help=help_msg)
+        action_parser.add_argument('-c', '--channel', action='append',
+                                   default=[])
+        action_parser.add_argument('packages', nargs='+')
+    subparsers.add_parser('list', help='List base environments')
+    subparsers.add_parser('refill',
+                          help='Create the base environments which are'
+                               ' missing')
+    args = parser.parse_args(argv)
+
+    prefix_dpath = LightShellCLI().prefix_dpath
+    bases = load_pool(prefix_dpath)
+    if args.action in ('add', 'remove'):
+        base = make_base(args.packages, args.channel)
+        if args.action == 'add' and base not in bases:
+            bases.append(base)
+        elif args.action == 'remove' and base in bases:
+            bases.remove(base)
+            remove_pool_env(prefix_dpath, base)
+        save_pool(prefix_dpath, bases)
+    elif args.action == 'list':
+        for base in bases:
+            print('{} {}{}'.format(
+                pool_env_name(base),
+                ''.join('-c {} '.format(chan) for chan in base['channels']),
+                ' '.join(base['packages']),
+            ) + ('' if is_pool_env_ready(prefix_dpath, base)
+                 else ' (missing)'))
+    elif args.action == 'refill':
+        from .conda_cli import CondaShellCLI
+        for base in refill_pool(CondaShellCLI()):
+            print('Created pool env "{}"'.format(pool_env_name(base)),
+                  file=sys.stderr)
+    else:
+        parser.print_usage()
+
+
+def gc_cmd(argv):
+    """Implementation of `conda-shell gc`."""
+    default_max_bytes, default_max_envs = get_default_budget()
+    parser = argparse.ArgumentParser(
+        prog='conda-shell gc',
+        description='Remove least-recently used conda-shell environments'
+                    ' until the rest fit in the budget. Environments which are'
+                    ' in use are never removed; environments whose creation'
+                    ' was interrupted always are.'
+    )
+    parser.add_argument('--max-bytes', type=parse_size,
+                        default=default_max_bytes,
+                        help='Disk budget, e.g. 20G (default:'
+                             ' $CONDA_SHELL_GC_MAX_BYTES)')
+    parser.add_argument('--max-envs', type=int, default=default_max_envs,
+                        help='Maximum number of environments to keep'
+                             ' (default: $CONDA_SHELL_GC_MAX_ENVS)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only list the environments to remove')
+    args = parser.parse_args(argv)
+
+    removed = collect_env_garbage(LightShellCLI().prefix_dpath,
+                                  max_bytes=args.max_bytes,
+                                  max_envs=args.max_envs,
+                                  dry_run=args.dry_run)
+    for env_dpath in removed:
+        print('{} shell env "{}"'.format(
+            'Would remove' if args.dry_run else 'Removed',
+            os.path.basename(env_dpath)
+        ), file=sys.stderr)
+
+
+def snapshot_cmd(argv):
+    """Implementation of `conda-shell snapshot`."""
+    parser = argparse.ArgumentParser(
+        prog='conda-shell snapshot',
+        description='Pack conda-shell environments into snapshots, which'
+                    ' conda-shell unpacks (from $CONDA_SHELL_SNAPSHOT_DIR or'
+                    ' $CONDA_SHELL_SNAPSHOT_MIRROR) instead of creating the'
+                    ' same environment with conda.'
+    )
+    parser.add_argument('-o', '--output', default=get_snapshot_dpath(),
+                        help='Directory to write the snapshots to (default:'
+                             ' $CONDA_SHELL_SNAPSHOT_DIR)')
+    parser.add_argument('env_names', nargs='*', metavar='ENV',
+                        help='Names of the environments to pack (default:'
+                             ' all environments in the local store)')
+    args = parser.parse_args(argv)
+    if args.output is None:
+        parser.error('Please provide -o/--output or set'
+                     ' $CONDA_SHELL_SNAPSHOT_DIR')
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    cli = LightShellCLI()
+    if args.env_names:
+        env_dpaths = [os.path.join(cli.prefix_dpath, env_name)
+                      for env_name in args.env_names]
+    else:
+        env_dpaths = get_conda_env_dirs(cli.prefix_dpath)
+    for env_dpath in env_dpaths:
+        try:
+            key = get_env_key(env_dpath, cli)
+        except UnsupportedArgumentError:
+            from .conda_cli import CondaShellCLI
+            cli = CondaShellCLI()
+            key = get_env_key(env_dpath, cli)
+        if key is None:
+            print('Skipping shell env "{}", whose history can not be'
+                  ' read'.format(os.path.basename(env_dpath)),
+                  file=sys.stderr)
+            continue
+        print('Packed shell env "{}" to "{}"'.format(
+            os.path.basename(env_dpath), pack_env(env_dpath, key, args.output)
+        ), file=sys.stderr)
+
+
+def daemon_cmd(argv):
+    """Implementation of `conda-shell daemon`."""
+    from .client import get_socket_fpath, send
+    parser = argparse.ArgumentParser(
+        prog='conda-shell daemon',
+        description='Run a conda-shell server which keeps conda-shell loaded'
+                    ' in memory. When it is running, conda-shell resolves'
+                    ' --run commands and scripts through it, instead of'
+                    ' starting from scratch.'
+    )
+    parser.add_argument('--socket', default=get_socket_fpath(),
+                        help='Unix socket to listen on (default:'
+                             ' $CONDA_SHELL_DAEMON_SOCKET, or %(default)s)')
+    parser.add_argument('--idle-timeout', type=float, metavar='SECONDS',
+                        help='Exit after SECONDS without requests')
+    action_group = parser.add_mutually_exclusive_group()
+    action_group.add_argument('--status', action='store_true',
+                              help='Report whether a daemon is running')
+    action_group.add_argument('--stop', action='store_true',
+                              help='Stop the running daemon')
+    args = parser.parse_args(argv)
+
+    if args.status or args.stop:
+        response = send({'command': 'stop' if args.stop else 'status'},
+                        args.socket)
+        if response is None:
+            print('No conda-shell daemon is listening on "{}"'.format(
+                args.socket
+            ), file=sys.stderr)
+            return 1
+        reply, sock = response
+        sock.close()
+        print('conda-shell daemon (pid {}) {} on "{}"'.format(
+            reply['pid'], 'is stopping' if args.stop else 'is listening',
+            args.socket
+        ), file=sys.stderr)
+        return 0
+
+    from .conda_cli import CondaShellCLI
+    from .daemon import Daemon
+    try:
+        Daemon(args.socket, CondaShellCLI(),
+               idle_timeout=args.idle_timeout).serve()
+    except ValueError as err:
+        print(str(err), file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def batch_cmd(argv):
+    """Implementation of `conda-shell batch`."""
+    import multiprocessing
+    from .batch import DEFAULT_LOG_DNAME, run_batch
+    parser = argparse.ArgumentParser(
+        prog='conda-shell batch',
+        description='Run many conda-shell scripts. Each distinct environment'
+                    ' which they request is found or created once, then the'
+                    ' scripts run in parallel, with a log file each.'
+    )
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='Number of scripts to run (and environments to'
+                             ' create) at a time (default: %(default)s)')
+    parser.add_argument('-o', '--log-dir', default=DEFAULT_LOG_DNAME,
+                        help='Directory to write the logs and a summary.json'
+                             ' of the scripts to (default: %(default)s)')
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='Scripts, or directories of conda-shell'
+                             ' scripts')
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('-j/--jobs should be at least 1')
+
+    def load_conda_cli():
+        from .conda_cli import CondaShellCLI
+        return CondaShellCLI()
+    results = run_batch(args.paths, LightShellCLI(), args.jobs,
+                        os.path.abspath(args.log_dir), load_conda_cli)
+    n_failed = sum(1 for result in results if result['status'] != 0)
+    print('{} scripts, {} failed (logs in "{}")'.format(
+        len(results), n_failed, args.log_dir
+    ), file=sys.stderr)
+    return 1 if n_failed else 0
+
+
+def prefetch_cmd(argv):
+    """Implementation of `conda-shell prefetch`."""
+    from .prefetch import DEFAULT_PREFETCH_WORKERS, prefetch
+    parser = argparse.ArgumentParser(
+        prog='conda-shell prefetch',
+        description='Download the packages of the environments which'
+                    ' conda-shell scripts (or spec files) request into'
+                    " conda's package cache, so that creating them later"
+                    ' only links packages. Spec files are explicit files (as'
+                    ' written by --lock) or lists of package specs.'
+    )
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=DEFAULT_PREFETCH_WORKERS,
+                        help='Number of packages to download at a time'
+                             ' (default: %(default)s)')
+    parser.add_argument('--pkgs-dir',
+                        help="Package cache to download to (default: conda's)")
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='Scripts, spec files, or directories of'
+                             ' conda-shell scripts')
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('-j/--jobs should be at least 1')
+
+    def load_conda_cli():
+        from .conda_cli import CondaShellCLI
+        return CondaShellCLI()
+    fetched, errors = prefetch(args.paths, LightShellCLI(), load_conda_cli,
+                               pkgs_dpath=args.pkgs_dir, n_workers=args.jobs)
+    for path, error in sorted(errors.items()):
+        print('Could not resolve "{}": {}'.format(path, error),
+              file=sys.stderr)
+    n_failed = 0
+    for url, result in fetched.items():
+        if result not in ('cached', 'downloaded'):
+            n_failed += 1
+            print('Could not fetch "{}": {}'.format(url, result),
+                  file=sys.stderr)
+    print('{} packages: {} downloaded, {} already cached, {} failed'.format(
+        len(fetched), list(fetched.values()).count('downloaded'),
+        list(fetched.values()).count('cached'), n_failed
+    ), file=sys.stderr)
+    return 1 if errors or n_failed else 0
+
+
+# Subcommands which take the place of package specs in argv[1]
+SUBCOMMANDS = {
+    'batch': batch_cmd,
+    'clear-cache': clear_cache_cmd,
+    'daemon': daemon_cmd,
+    'gc': gc_cmd,
+    'pool': pool_cmd,
+    'prefetch': prefetch_cmd,
+    'snapshot': snapshot_cmd,
+}
+
+
+def start_cmds_profiling(cmds, start_time):
+    """Enable profiling (see `profiling`) if the first of cmds requests it
+    with `--profile` and it isn't enabled yet, e.g. in a shebang line. The
+    trace begins at start_time.
+    """
+    if getattr(cmds[0], 'profile', None) and not is_profiling():
+        start_profiling(cmds[0].profile, start_time=start_time)
 
-    run_cmds_in_env(cmds, cli, argv, in_shebang=in_shebang)
+
+def main(argv, exec_run=False):
+    """Run conda-shell with the command-line arguments argv, and return the
+    exit status of the --run command (or None). If exec_run is True, the
+    --run command may replace the current process (see `run_cmds_in_env`).
+
+    If requested by `--profile` or $CONDA_SHELL_PROFILE, the phases of the run
+    are timed (see `profiling`).
+    """
+    start_time = clock()
+    subcommand = SUBCOMMANDS.get(argv[1]) if len(argv) > 1 else None
+    in_shebang = (subcommand is None and len(argv) > 1 and
+                  argv[0].endswith('conda-shell') and
+                  os.path.isfile(argv[1]) and
+                  os.access(argv[1], os.X_OK))
+    # Arguments after the script (or subcommand) aren't conda-shell's
+    profile_fpath = get_profile_fpath(
+        [] if in_shebang or subcommand is not None else argv[1:]
+    )
+    if profile_fpath is not None:
+        start_profiling(profile_fpath, start_time=start_time)
+
+    try:
+        if subcommand is not None:
+            return subcommand(argv[2:])
+
+        # Fast path: reuse an existing environment without loading conda
+        with span('find env (fast path)'):
+            found = find_env_fast(argv, in_shebang=in_shebang)
+        if found is not None:
+            cmds, cli, env_dpath = found
+            start_cmds_profiling(cmds, start_time)
+            return run_cmds_in_env(cmds, cli, argv, in_shebang=in_shebang,
+                                   env_dpath=env_dpath, exec_run=exec_run)
+
+        with span('load conda CLI'):
+            from .conda_cli import CondaShellCLI
+            cli = CondaShellCLI()
+        with span('parse args'):
+            cmds = parse_cmds(argv, cli, in_shebang=in_shebang)
+        start_cmds_profiling(cmds, start_time)
+        return run_cmds_in_env(cmds, cli, argv, in_shebang=in_shebang,
+                               exec_run=exec_run)
+    finally:
+        finish_profiling()
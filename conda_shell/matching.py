@@ -0,0 +1,72 @@
+"""
+Match requested package specs against the packages installed in existing
+conda environments, rather than against the specs they were created with.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import json
+import glob
+
+
+def get_requested_specs(cmds):
+    """Return a (packages, channels) tuple which merges the package specs and
+    channels of every command in cmds. Channels keep their order of first
+    appearance.
+    """
+    packages, channels = [], []
+    for cmd in cmds:
+        packages.extend(cmd.packages or [])
+        for channel in (cmd.channel or []):
+            if channel not in channels:
+                channels.append(channel)
+    return packages, channels
+
+
+def load_installed_records(env_dpath):
+    """Return the package records (dicts) of every package installed in the
+    conda environment at env_dpath, as recorded in its conda-meta directory.
+    """
+    records = []
+    for rec_fpath in glob.glob(os.path.join(env_dpath, 'conda-meta',
+                                            '*.json')):
+        try:
+            with open(rec_fpath, 'r') as fp:
+                records.append(json.load(fp))
+        except (IOError, OSError, ValueError):
+            continue
+    return records
+
+
+def env_satisfies(env_dpath, cmds, cli):
+    """Return True if the packages installed in the conda environment at
+    env_dpath satisfy every package spec requested by cmds, using conda's
+    MatchSpec semantics. When channels are requested, matching packages must
+    come from one of them (or from the default channels, whose packages are
+    recorded under their own names, see `default_channel_names`).
+    """
+    packages, channels = get_requested_specs(cmds)
+    records = load_installed_records(env_dpath)
+    if not records:
+        return False
+
+    allowed_channels = None
+    if channels:
+        allowed_channels = set(cli.channel_name(channel)
+                               for channel in channels)
+        allowed_channels.update(cli.default_channel_names())
+
+    for package in packages:
+        spec = cli.match_spec(package)
+        for record in records:
+            if (allowed_channels is not None and
+                    cli.channel_name(record.get('channel') or 'defaults')
+                    not in allowed_channels):
+                continue
+            if spec.match(record):
+                break
+        else:
+            return False
+    return True
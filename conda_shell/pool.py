@@ -0,0 +1,158 @@
+"""
+Pool of pre-created "base" environments. A request whose packages include all
+of a base's packages is served by cloning the base and installing only the
+missing packages.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import json
+import shutil
+import hashlib
+import collections
+
+from .utils import get_cache_dpath, load_json, atomic_write_json
+
+
+POOL_FNAME = 'pool.json'
+POOL_ENV_PREFIX = os.environ.get('CONDA_SHELL_POOL_PREFIX', 'shellpool_')
+
+
+def _get_pool_fpath(prefix_dpath):
+    return os.path.join(get_cache_dpath(prefix_dpath), POOL_FNAME)
+
+
+def load_pool(prefix_dpath):
+    """Return the list of base definitions, each a dict with `packages` and
+    `channels` lists.
+    """
+    return load_json(_get_pool_fpath(prefix_dpath), {}).get('bases', [])
+
+
+def save_pool(prefix_dpath, bases):
+    """Replace the list of base definitions."""
+    atomic_write_json(_get_pool_fpath(prefix_dpath), {'bases': bases})
+
+
+def make_base(packages, channels):
+    """Return a base definition for the package specs and channels."""
+    return {'packages': sorted(packages), 'channels': list(channels or [])}
+
+
+def pool_env_name(base):
+    """Return the name of the environment which implements base. The name
+    doesn't start with the conda-shell environment prefix, so pool
+    environments are never reused (or removed) directly.
+    """
+    return POOL_ENV_PREFIX + hashlib.sha1(
+        json.dumps([base['packages'], base['channels']]).encode('utf-8')
+    ).hexdigest()
+
+
+def is_pool_env_ready(prefix_dpath, base):
+    """Return True if the environment which implements base exists."""
+    return os.path.isfile(os.path.join(prefix_dpath, pool_env_name(base),
+                                       'conda-meta', 'history'))
+
+
+def find_pool_base(packages, channels, prefix_dpath):
+    """Return the existing base with the most packages which are all part of
+    the requested packages, on exactly the requested channels, or None if no
+    base qualifies.
+    """
+    requested = collections.Counter(packages)
+    best_base = None
+    for base in load_pool(prefix_dpath):
+        if base['channels'] != list(channels or []):
+            continue
+        base_pkgs = collections.Counter(base['packages'])
+        if base_pkgs - requested:
+            continue
+        if (best_base is not None and
+                len(base['packages']) <= len(best_base['packages'])):
+            continue
+        if is_pool_env_ready(prefix_dpath, base):
+            best_base = base
+    return best_base
+
+
+def _channel_argv(channels):
+    argv = []
+    for channel in channels:
+        argv.extend(['-c', channel])
+    return argv
+
+
+def ensure_history_cmd(env_dpath, hist_argv):
+    """Make sure the history of the conda environment at env_dpath starts
+    with a `conda create` command, recording hist_argv if it doesn't (conda
+    doesn't always log the command line of a clone).
+    """
+    hist_fpath = os.path.join(env_dpath, 'conda-meta', 'history')
+    if os.path.exists(hist_fpath):
+        with open(hist_fpath, 'r') as fp:
+            for line in fp:
+                if line.startswith('# cmd: conda create'):
+                    return
+    with open(hist_fpath, 'a') as fp:
+        fp.write('# cmd: conda create {}\n'.format(
+            ' '.join(hist_argv)
+        ))
+
+
+def clone_from_pool(base, cmd, cli):
+    """Create the environment requested by cmd (an argparse.Namespace) by
+    cloning the environment which implements base, then installing the
+    packages which base lacks.
+
+    The history of the new environment records base's packages for the clone
+    and the remaining packages for the install, so the merged history matches
+    the original request.
+    """
+    base_name = pool_env_name(base)
+    chan_argv = _channel_argv(base['channels'])
+    clone_args = cli.parse_create_args(['-n', cmd.name, '--clone', base_name,
+                                        '-y'])
+    clone_args._argv = chan_argv + base['packages']
+    cli.conda_create(clone_args)
+    env_dpath = os.path.join(cli.prefix_dpath, cmd.name)
+    ensure_history_cmd(env_dpath, ['-n', cmd.name, '--clone', base_name] +
+                       clone_args._argv)
+
+    delta = list((collections.Counter(cmd.packages) -
+                  collections.Counter(base['packages'])).elements())
+    if delta:
+        install_args = cli.parse_install_args(['-n', cmd.name, '-y'] +
+                                              chan_argv + delta)
+        install_args._argv = chan_argv + delta
+        cli.conda_install(install_args)
+
+
+def refill_pool(cli):
+    """Create the environments of all bases which don't exist yet. Return the
+    list of bases which were created.
+    """
+    created = []
+    for base in load_pool(cli.prefix_dpath):
+        if is_pool_env_ready(cli.prefix_dpath, base):
+            continue
+        env_name = pool_env_name(base)
+        env_dpath = os.path.join(cli.prefix_dpath, env_name)
+        if os.path.isdir(env_dpath):
+            # Left over from an interrupted refill
+            shutil.rmtree(env_dpath)
+        base_argv = _channel_argv(base['channels']) + base['packages']
+        args = cli.parse_create_args(['-n', env_name, '-y'] + base_argv)
+        args._argv = base_argv
+        cli.conda_create(args)
+        created.append(base)
+    return created
+
+
+def remove_pool_env(prefix_dpath, base):
+    """Delete the environment which implements base, if it exists."""
+    env_dpath = os.path.join(prefix_dpath, pool_env_name(base))
+    if os.path.isdir(env_dpath):
+        shutil.rmtree(env_dpath)
@@ -0,0 +1,280 @@
+"""
+Prefetching of packages into conda's package cache (`conda-shell prefetch`).
+The environments requested by conda-shell scripts (or by spec files) are
+resolved to explicit lists of package URLs: directly for `--from-lock` files,
+and otherwise through conda's solver (see `conda_cli.CondaCLI.solve`), whose
+solutions are kept in `SolveCache`. The tarballs of every list are then
+downloaded concurrently, once each, so that creating the environments later
+only extracts and links packages.
+
+Local channels (`file://` URLs) work offline; their tarballs are copied into
+the package cache.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import copy
+import errno
+import socket
+import hashlib
+import threading
+import collections
+
+try:
+    from urllib.request import urlopen
+    from urllib.error import URLError
+except ImportError:  # pragma: no cover
+    from urllib2 import urlopen, URLError
+
+from .light_cli import UnsupportedArgumentError, get_conda_install_dpath
+from .matching import get_requested_specs
+from .explicit import read_explicit_file
+from .scan import parallel_map
+from .batch import is_script, find_scripts, group_scripts
+from .main import find_env
+
+
+DEFAULT_PREFETCH_WORKERS = 4
+DEFAULT_DOWNLOAD_TIMEOUT = 60
+URLS_FNAME = 'urls.txt'
+CHUNK_SIZE = 1024 * 1024
+PACKAGE_EXTENSIONS = ('.tar.bz2', '.conda')
+
+_urls_lock = threading.Lock()
+
+
+def get_default_pkgs_dpath():
+    """Return the package cache which conda uses by default: the first
+    directory of $CONDA_PKGS_DIRS, or the `pkgs` directory of the conda
+    installation.
+    """
+    pkgs_dpaths = [dpath for dpath in
+                   os.environ.get('CONDA_PKGS_DIRS', '').split(',') if dpath]
+    if pkgs_dpaths:
+        return os.path.abspath(os.path.expanduser(pkgs_dpaths[0]))
+    return os.path.join(get_conda_install_dpath(), 'pkgs')
+
+
+def get_download_timeout():
+    """Return the number of seconds after which a stalled package download
+    is given up ($CONDA_SHELL_DOWNLOAD_TIMEOUT, default: 60).
+    """
+    return float(os.environ.get('CONDA_SHELL_DOWNLOAD_TIMEOUT') or
+                 DEFAULT_DOWNLOAD_TIMEOUT)
+
+
+def split_spec(spec):
+    """Return the (url, md5) tuple of the explicit spec "<url>#<md5>"; md5
+    may be None.
+    """
+    url, _, md5 = spec.partition('#')
+    return url, md5 or None
+
+
+def get_package_fname(url):
+    """Return the file name of the package tarball at url."""
+    return url.rstrip('/').rsplit('/', 1)[-1]
+
+
+def _md5sum(fpath):
+    md5 = hashlib.md5()
+    with open(fpath, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def is_cached(pkgs_dpath, url, md5=None):
+    """Return True if the package at url is in the package cache pkgs_dpath,
+    either as a tarball (whose checksum is md5, if given) or extracted.
+    """
+    fname = get_package_fname(url)
+    for extension in PACKAGE_EXTENSIONS:
+        if fname.endswith(extension):
+            if os.path.isdir(os.path.join(pkgs_dpath,
+                                          fname[:-len(extension)])):
+                return True
+    fpath = os.path.join(pkgs_dpath, fname)
+    return os.path.isfile(fpath) and (md5 is None or _md5sum(fpath) == md5)
+
+
+def download(url, md5, pkgs_dpath, timeout=None):
+    """Download the package at url into the package cache pkgs_dpath, and
+    record it in the cache's urls.txt (as conda does). Raise ValueError if
+    its checksum isn't md5 (if given), or if the server doesn't respond
+    within timeout seconds (default: `get_download_timeout`).
+    """
+    if timeout is None:
+        timeout = get_download_timeout()
+    fpath = os.path.join(pkgs_dpath, get_package_fname(url))
+    tmp_fpath = '{}.{}.part'.format(fpath, os.getpid())
+    checksum = hashlib.md5()
+    try:
+        try:
+            response = urlopen(url, timeout=timeout)
+            try:
+                with open(tmp_fpath, 'wb') as fp:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE),
+                                      b''):
+                        checksum.update(chunk)
+                        fp.write(chunk)
+            finally:
+                response.close()
+        except (socket.timeout, URLError) as err:
+            if not isinstance(getattr(err, 'reason', err), socket.timeout):
+                raise
+            raise ValueError('Timed out downloading "{}" (after {:g}'
+                             ' seconds without data)'.format(url, timeout))
+        if md5 is not None and checksum.hexdigest() != md5:
+            raise ValueError('Checksum mismatch for "{}": expected {}, got'
+                             ' {}'.format(url, md5, checksum.hexdigest()))
+        os.rename(tmp_fpath, fpath)
+    finally:
+        if os.path.exists(tmp_fpath):
+            os.remove(tmp_fpath)
+    with _urls_lock:
+        with open(os.path.join(pkgs_dpath, URLS_FNAME), 'a') as fp:
+            fp.write(url + '\n')
+
+
+def fetch_specs(specs, pkgs_dpath, n_workers=DEFAULT_PREFETCH_WORKERS):
+    """Download the packages of specs (explicit specs, see `split_spec`) which
+    aren't in the package cache pkgs_dpath yet, n_workers at a time. Each
+    package is fetched once, even if it is listed several times. Return an
+    OrderedDict which maps each package URL to "cached", "downloaded", or an
+    error message.
+    """
+    packages = collections.OrderedDict()
+    for spec in specs:
+        url, md5 = split_spec(spec)
+        packages.setdefault(url, md5)
+    try:
+        os.makedirs(pkgs_dpath)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+    def fetch(package):
+        url, md5 = package
+        if is_cached(pkgs_dpath, url, md5):
+            return 'cached'
+        try:
+            download(url, md5, pkgs_dpath)
+        except (IOError, OSError, ValueError) as err:
+            return str(err) or repr(err)
+        return 'downloaded'
+    return collections.OrderedDict(zip(
+        packages, parallel_map(fetch, list(packages.items()),
+                               max_workers=n_workers)
+    ))
+
+
+def read_spec_file(fpath):
+    """Return a (specs, explicit) tuple for the spec file at fpath: either the
+    package URLs of an explicit file (explicit is True), or its package specs,
+    one per line as for `conda create --file`.
+    """
+    try:
+        return read_explicit_file(fpath), True
+    except ValueError:
+        pass
+    with open(fpath, 'r') as fp:
+        return [line.split('#', 1)[0].strip() for line in fp
+                if line.split('#', 1)[0].strip()], False
+
+
+def _solve_cmds(cmds):
+    """Return a single `conda create` Namespace for the specs of cmds."""
+    solve_cmd = copy.copy(cmds[0])
+    solve_cmd.packages, channels = get_requested_specs(cmds)
+    solve_cmd.channel = channels or None
+    return solve_cmd
+
+
+def collect_requests(paths, cli):
+    """Return a (requests, errors) tuple for the scripts and spec files given
+    by paths (directories contribute their conda-shell scripts). requests is
+    a list of (description, explicit specs or None, cmds or None) tuples, one
+    per distinct environment which doesn't exist yet: explicit specs are
+    known without solving, cmds need to be solved. errors maps the paths
+    which can't be read to the error message.
+    `light_cli.UnsupportedArgumentError` is propagated.
+    """
+    script_fpaths, spec_fpaths = [], []
+    for path in paths:
+        if os.path.isdir(path) or is_script(path):
+            script_fpaths.extend(find_scripts([path]))
+        else:
+            spec_fpaths.append(os.path.abspath(path))
+
+    requests = []
+    groups, errors = group_scripts(script_fpaths, cli)
+    for scripts in groups.values():
+        script_fpath, cmds = scripts[0]
+        if find_env(cmds, cli) is not None:
+            continue
+        lock_specs = getattr(cmds[0], 'lock_specs', None)
+        requests.append((script_fpath, lock_specs,
+                         None if lock_specs is not None else cmds))
+
+    for spec_fpath in spec_fpaths:
+        try:
+            specs, explicit = read_spec_file(spec_fpath)
+        except (IOError, OSError) as err:
+            errors[spec_fpath] = str(err)
+            continue
+        if explicit:
+            requests.append((spec_fpath, specs, None))
+        else:
+            cmd = cli.parse_shell_args(specs)
+            cmd._argv = ['conda-shell'] + specs
+            cmd.name = os.path.basename(spec_fpath)
+            requests.append((spec_fpath, None, [cmd]))
+    return requests, errors
+
+
+def resolve_requests(requests, cli):
+    """Return a (specs, errors) tuple: the explicit specs of all requests (see
+    `collect_requests`), solving those which need it with cli, and a dict
+    which maps the descriptions of the requests which can't be solved to the
+    error message.
+    """
+    specs, errors = [], {}
+    for description, explicit_specs, cmds in requests:
+        if explicit_specs is None:
+            try:
+                explicit_specs = cli.solve(_solve_cmds(cmds))
+            except (Exception, SystemExit) as err:
+                errors[description] = str(err) or repr(err)
+                continue
+        specs.extend(explicit_specs)
+    return specs, errors
+
+
+def prefetch(paths, cli, load_conda_cli, pkgs_dpath=None,
+             n_workers=DEFAULT_PREFETCH_WORKERS):
+    """Download the packages of the environments requested by paths (see
+    `collect_requests`) into the package cache pkgs_dpath (by default,
+    conda's). Return a (fetched, errors) tuple: the result of `fetch_specs`,
+    and a dict of the paths which couldn't be resolved.
+
+    cli parses the scripts; load_conda_cli returns the CLI which replaces it
+    if conda's parsers or solver are needed.
+    """
+    try:
+        requests, errors = collect_requests(paths, cli)
+    except UnsupportedArgumentError:
+        cli = load_conda_cli()
+        requests, errors = collect_requests(paths, cli)
+    if (not hasattr(cli, 'solve') and
+            any(cmds is not None for _, _, cmds in requests)):
+        cli = load_conda_cli()
+        requests, errors = collect_requests(paths, cli)
+    specs, solve_errors = resolve_requests(requests, cli)
+    errors.update(solve_errors)
+    if pkgs_dpath is None:
+        pkgs_dpath = (cli.get_pkgs_dpath() if hasattr(cli, 'get_pkgs_dpath')
+                      else get_default_pkgs_dpath())
+    return fetch_specs(specs, pkgs_dpath, n_workers=n_workers), errors
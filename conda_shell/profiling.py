@@ -0,0 +1,197 @@
+"""
+Timing instrumentation of conda-shell's phases, enabled with `--profile FILE`
+or $CONDA_SHELL_PROFILE. Each phase (importing conda, scanning environment
+stores, solving, running the command...) is a named span. At exit, the spans
+are written to FILE in the Chrome trace event format (viewable in
+chrome://tracing or https://ui.perfetto.dev), and the top-level phases are
+summarized in one line on stderr.
+
+When profiling is disabled, `span` and `profiled` cost a single global lookup.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import sys
+import time
+import functools
+import threading
+
+from .utils import atomic_write_json
+
+
+PROFILE_ENV = 'CONDA_SHELL_PROFILE'
+PROFILE_OPTION = '--profile'
+
+clock = getattr(time, 'perf_counter', time.time)
+
+# The active Profiler, if any
+_profiler = None
+
+
+class Profiler(object):
+    """Collection of finished spans, written to trace_fpath by `write`."""
+
+    def __init__(self, trace_fpath, start_time=None):
+        self.trace_fpath = trace_fpath
+        self.start_time = clock() if start_time is None else start_time
+        self.events = []
+        self._local = threading.local()
+        self._main_tid = threading.current_thread().ident
+
+    def enter(self):
+        """Mark the start of a span in the current thread, and return its
+        start time.
+        """
+        self._local.depth = getattr(self._local, 'depth', 0) + 1
+        return clock()
+
+    def exit(self, name, start, args=None):
+        """Record the span name, which started at start in the current
+        thread.
+        """
+        end = clock()
+        self._local.depth -= 1
+        tid = threading.current_thread().ident
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': (start - self.start_time) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': tid,
+            # Only top-level spans of the main thread are summarized
+            'top': self._local.depth == 0 and tid == self._main_tid,
+        }
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def summary(self):
+        """Return a one-line summary of the total time and the time spent in
+        each top-level phase (in order of first appearance).
+        """
+        total = clock() - self.start_time
+        phases = []
+        durations = {}
+        for event in sorted(self.events, key=lambda event: event['ts']):
+            if not event['top']:
+                continue
+            if event['name'] not in durations:
+                phases.append(event['name'])
+                durations[event['name']] = 0
+            durations[event['name']] += event['dur'] / 1e6
+        return 'conda-shell profile: {:.3f}s total{}{} (trace: {})'.format(
+            total, ': ' if phases else '',
+            ', '.join('{} {:.3f}s'.format(name, durations[name])
+                      for name in phases),
+            self.trace_fpath
+        )
+
+    def write(self):
+        """Write the spans to trace_fpath, in the Chrome trace event
+        format.
+        """
+        trace_events = []
+        for event in self.events:
+            trace_event = dict(event)
+            del trace_event['top']
+            trace_events.append(trace_event)
+        atomic_write_json(self.trace_fpath, {
+            'traceEvents': trace_events,
+            'displayTimeUnit': 'ms',
+        })
+
+
+class _Span(object):
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = self.profiler.enter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.exit(self.name, self.start, self.args)
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def get_profile_fpath(argv):
+    """Return the trace file requested by the `--profile` argument in argv, or
+    by $CONDA_SHELL_PROFILE, or None if profiling wasn't requested.
+    """
+    for idx, arg in enumerate(argv):
+        if arg == PROFILE_OPTION and idx + 1 < len(argv):
+            return argv[idx + 1]
+        if arg.startswith(PROFILE_OPTION + '='):
+            return arg.split('=', 1)[1]
+    return os.environ.get(PROFILE_ENV) or None
+
+
+def is_profiling():
+    """Return True if profiling is enabled."""
+    return _profiler is not None
+
+
+def start_profiling(trace_fpath, start_time=None):
+    """Enable profiling, with spans written to trace_fpath by
+    `finish_profiling`. If given, start_time (a `clock` value) is the
+    beginning of the trace.
+    """
+    global _profiler
+    _profiler = Profiler(os.path.abspath(os.path.expanduser(trace_fpath)),
+                         start_time=start_time)
+
+
+def finish_profiling():
+    """If profiling is enabled, write the trace file, print the summary to
+    stderr, and disable profiling.
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return
+    try:
+        profiler.write()
+    except (IOError, OSError) as err:
+        print('Could not write profile "{}": {}'.format(
+            profiler.trace_fpath, err
+        ), file=sys.stderr)
+    print(profiler.summary(), file=sys.stderr)
+
+
+def span(name, **args):
+    """Return a context manager which records its duration as the span name
+    (with the optional args shown in the trace), if profiling is enabled.
+    """
+    if _profiler is None:
+        return _NULL_SPAN
+    return _Span(_profiler, name, args)
+
+
+def profiled(name):
+    """Decorator which records each call of the function as the span
+    name.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _Span(_profiler, name, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
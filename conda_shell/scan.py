@@ -0,0 +1,82 @@
+"""
+Concurrent scanning of environment directories. On network filesystems every
+stat and history read is a round trip, so they are issued from a bounded pool
+of threads instead of one at a time.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import collections
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # pragma: no cover
+    # Python 2 without the `futures` backport: scan serially
+    ThreadPoolExecutor = None
+
+
+DEFAULT_SCAN_WORKERS = 8
+
+
+def get_scan_workers():
+    """Return the maximum number of scanning threads, from
+    $CONDA_SHELL_SCAN_WORKERS (default: DEFAULT_SCAN_WORKERS). 1 disables
+    threads.
+    """
+    return max(1, int(os.environ.get('CONDA_SHELL_SCAN_WORKERS',
+                                     DEFAULT_SCAN_WORKERS)))
+
+
+def list_dir(dpath):
+    """Return a list of (name, path) tuples for the entries of dpath."""
+    if hasattr(os, 'scandir'):
+        return [(entry.name, entry.path) for entry in os.scandir(dpath)]
+    return [(name, os.path.join(dpath, name))  # pragma: no cover
+            for name in os.listdir(dpath)]
+
+
+def parallel_map(fn, items, max_workers=None):
+    """Return [fn(item) for item in items], calling fn from up to max_workers
+    threads (default: `get_scan_workers()`).
+    """
+    items = list(items)
+    if max_workers is None:
+        max_workers = get_scan_workers()
+    if ThreadPoolExecutor is None or max_workers < 2 or len(items) < 2:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        return list(pool.map(fn, items))
+
+
+def find_first(pred, items, max_workers=None):
+    """Return the first of items (in order) for which pred returns True, or
+    None. pred is evaluated concurrently for up to max_workers items ahead of
+    the current one; no further items are submitted once a match is found.
+    """
+    if max_workers is None:
+        max_workers = get_scan_workers()
+    if ThreadPoolExecutor is None or max_workers < 2:
+        for item in items:
+            if pred(item):
+                return item
+        return None
+
+    items = iter(items)
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for item in items:
+            pending.append((item, pool.submit(pred, item)))
+            if len(pending) >= max_workers:
+                break
+        while pending:
+            item, future = pending.popleft()
+            if future.result():
+                for _, other_future in pending:
+                    other_future.cancel()
+                return item
+            for next_item in items:
+                pending.append((next_item, pool.submit(pred, next_item)))
+                break
+    return None
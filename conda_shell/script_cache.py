@@ -0,0 +1,134 @@
+"""
+Cache of the parsed shebang lines of conda-shell scripts. Only the header
+block of a script (its leading `#!` lines) is read; the commands parsed from
+it are cached, keyed by the script's path, size and modification time, a
+digest of the header, and the CLI which parsed them. Running an unchanged
+script again then skips argparse altogether.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import io
+import glob
+import json
+import hashlib
+import argparse
+
+from .light_cli import get_default_match_mode
+from .utils import (CACHE_DNAME, get_cache_dpath, load_json,
+                    atomic_write_json)
+
+
+SCRIPT_CACHE_DNAME = 'scripts'
+SCRIPT_CACHE_VERSION = 1
+DEFAULT_SCRIPT_CACHE_SIZE = 1024
+
+
+def read_header(script_fpath):
+    """Return a (stat, lines) tuple: the os.stat result of script_fpath, and
+    the lines of its header block (the leading lines which start with "#!").
+    The rest of the script isn't read.
+    """
+    lines = []
+    with io.open(script_fpath, 'r', errors='replace') as fp:
+        fstat = os.fstat(fp.fileno())
+        for line in fp:
+            if not line.startswith('#!'):
+                break
+            lines.append(line)
+    return fstat, lines
+
+
+def get_cli_key(cli):
+    """Return what, besides the shebang lines, determines the commands which
+    cli parses: the kind of CLI, conda's version, and the defaults taken from
+    environment variables.
+    """
+    return [type(cli).__name__, getattr(cli, 'conda_version', None),
+            get_default_match_mode()]
+
+
+class ScriptCache(object):
+    """Parsed shebang lines of scripts, stored underneath the conda
+    environments directory prefix_dpath, one cache file per script path.
+    Least-recently used entries are evicted once there are more than
+    max_entries of them.
+    """
+
+    def __init__(self, prefix_dpath, max_entries=DEFAULT_SCRIPT_CACHE_SIZE):
+        """Constructor."""
+        self.dpath = os.path.join(prefix_dpath, CACHE_DNAME,
+                                  SCRIPT_CACHE_DNAME)
+        self.prefix_dpath = prefix_dpath
+        self.max_entries = max_entries
+
+    def _fpath(self, script_fpath):
+        return os.path.join(self.dpath, hashlib.sha1(
+            script_fpath.encode('utf-8')
+        ).hexdigest() + '.json')
+
+    @staticmethod
+    def key(script_fpath, fstat, header, cli):
+        """Return the cache key of the script at script_fpath, whose os.stat
+        result is fstat and whose header lines are header, as parsed by cli.
+        """
+        return hashlib.sha1(json.dumps([
+            os.path.abspath(script_fpath), fstat.st_size, fstat.st_mtime,
+            hashlib.sha1(''.join(header).encode('utf-8')).hexdigest(),
+            get_cli_key(cli),
+        ]).encode('utf-8')).hexdigest()
+
+    def lookup(self, script_fpath, key):
+        """Return the list of argparse.Namespace objects cached for
+        script_fpath under key, or None.
+        """
+        fpath = self._fpath(os.path.abspath(script_fpath))
+        entry = load_json(fpath)
+        if (not isinstance(entry, dict) or
+                entry.get('version') != SCRIPT_CACHE_VERSION or
+                entry.get('key') != key):
+            return None
+        try:
+            # Mark the entry as recently used
+            os.utime(fpath, None)
+        except OSError:
+            pass
+        return [argparse.Namespace(**cmd) for cmd in entry['cmds']]
+
+    def store(self, script_fpath, key, cmds):
+        """Cache cmds (argparse.Namespace objects) for script_fpath under key.
+        Commands whose arguments can't be serialized aren't cached.
+        """
+        entry = {'version': SCRIPT_CACHE_VERSION, 'key': key,
+                 'cmds': [vars(cmd) for cmd in cmds]}
+        try:
+            json.dumps(entry)
+        except (TypeError, ValueError):
+            return
+        try:
+            get_cache_dpath(self.prefix_dpath, SCRIPT_CACHE_DNAME)
+            atomic_write_json(self._fpath(os.path.abspath(script_fpath)),
+                              entry)
+        except (IOError, OSError):
+            # e.g. a read-only environments directory; parse again next time
+            return
+        self._evict()
+
+    def _evict(self):
+        fpaths = glob.glob(os.path.join(self.dpath, '*.json'))
+        if len(fpaths) <= self.max_entries:
+            return
+        mtimes = {}
+        for fpath in fpaths:
+            try:
+                mtimes[fpath] = os.path.getmtime(fpath)
+            except OSError:
+                continue
+        lru_fpaths = sorted(mtimes, key=lambda fpath: mtimes[fpath])
+        for fpath in lru_fpaths[:len(lru_fpaths) - self.max_entries]:
+            try:
+                os.remove(fpath)
+            except OSError:
+                pass
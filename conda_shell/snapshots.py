@@ -0,0 +1,269 @@
+"""
+Packed environment snapshots: archives of conda-shell environments which can
+be unpacked on another machine instead of solving, downloading and linking
+the environment's packages again.
+
+A snapshot is a gzipped tarball of the environment, named after the
+environment's `cmds_key` digest and platform. Its manifest lists the files
+which contain the environment's original prefix; they are rewritten for the
+new prefix on restore, the way conda relocates packages.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import io
+import re
+import sys
+import json
+import shutil
+import tarfile
+import platform
+import tempfile
+import contextlib
+
+try:
+    from urllib.request import urlopen
+except ImportError:  # pragma: no cover
+    from urllib2 import urlopen
+
+from .explicit import get_env_platform
+
+
+SNAPSHOT_VERSION = 1
+MANIFEST_NAME = '.conda-shell-snapshot.json'
+DEFAULT_SNAPSHOT_TIMEOUT = 30
+
+
+def get_snapshot_dpath():
+    """Return the local directory of snapshots ($CONDA_SHELL_SNAPSHOT_DIR), or
+    None.
+    """
+    snapshot_dpath = os.environ.get('CONDA_SHELL_SNAPSHOT_DIR')
+    return os.path.expanduser(snapshot_dpath) if snapshot_dpath else None
+
+
+def get_snapshot_mirror():
+    """Return the base URL of a read-only mirror of snapshots
+    ($CONDA_SHELL_SNAPSHOT_MIRROR), or None.
+    """
+    return os.environ.get('CONDA_SHELL_SNAPSHOT_MIRROR') or None
+
+
+def get_snapshot_timeout():
+    """Return the number of seconds after which a stalled download from the
+    snapshot mirror is given up ($CONDA_SHELL_SNAPSHOT_TIMEOUT, default: 30).
+    """
+    return float(os.environ.get('CONDA_SHELL_SNAPSHOT_TIMEOUT') or
+                 DEFAULT_SNAPSHOT_TIMEOUT)
+
+
+def get_platform():
+    """Return conda's name (subdir) for the platform conda-shell runs on, e.g.
+    "linux-64" or "osx-64".
+    """
+    os_name = {'darwin': 'osx', 'win32': 'win'}.get(
+        sys.platform, sys.platform.rstrip('0123456789')
+    )
+    machine = platform.machine()
+    if machine in ('x86_64', 'AMD64', 'i386', 'i686', 'x86'):
+        bits = '64' if sys.maxsize > 2 ** 32 else '32'
+    else:
+        bits = {'arm64': 'arm64'}.get(machine, machine)
+    return '{}-{}'.format(os_name, bits)
+
+
+def snapshot_name(key, platform_name):
+    """Return the file name of the snapshot of an environment with the
+    `cmds_key` digest key, on platform_name.
+    """
+    return '{}-{}.tar.gz'.format(key, platform_name)
+
+
+def _find_prefix_files(env_dpath):
+    """Return {relative path: "text"/"binary"/"symlink"} for the files and
+    symlinks in env_dpath which refer to env_dpath.
+    """
+    prefix = env_dpath.encode('utf-8')
+    prefix_files = {}
+    for root, dirnames, fnames in os.walk(env_dpath):
+        for name in fnames + dirnames:
+            fpath = os.path.join(root, name)
+            rel_fpath = os.path.relpath(fpath, env_dpath)
+            if os.path.islink(fpath):
+                if os.readlink(fpath).startswith(env_dpath):
+                    prefix_files[rel_fpath] = 'symlink'
+                continue
+            if not os.path.isfile(fpath):
+                continue
+            with open(fpath, 'rb') as fp:
+                data = fp.read()
+            if prefix in data:
+                prefix_files[rel_fpath] = ('binary' if b'\0' in data
+                                           else 'text')
+    return prefix_files
+
+
+def pack_env(env_dpath, key, snapshot_dpath):
+    """Write a snapshot of the conda environment at env_dpath, whose
+    `cmds_key` digest is key, to snapshot_dpath. Return the path of the
+    snapshot.
+    """
+    env_dpath = os.path.abspath(env_dpath)
+    platform_name = get_env_platform(env_dpath) or get_platform()
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'key': key,
+        'platform': platform_name,
+        'prefix': env_dpath,
+        'prefix_files': _find_prefix_files(env_dpath),
+    }
+    manifest_data = json.dumps(manifest, sort_keys=True).encode('utf-8')
+
+    snapshot_fpath = os.path.join(snapshot_dpath,
+                                  snapshot_name(key, platform_name))
+    fd, tmp_fpath = tempfile.mkstemp(dir=snapshot_dpath, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            with tarfile.open(fileobj=fp, mode='w:gz') as tar:
+                info = tarfile.TarInfo(MANIFEST_NAME)
+                info.size = len(manifest_data)
+                tar.addfile(info, io.BytesIO(manifest_data))
+                for name in sorted(os.listdir(env_dpath)):
+                    tar.add(os.path.join(env_dpath, name), arcname=name)
+        # Readers never see a partially-written snapshot
+        os.rename(tmp_fpath, snapshot_fpath)
+    except Exception:
+        if os.path.exists(tmp_fpath):
+            os.remove(tmp_fpath)
+        raise
+    return snapshot_fpath
+
+
+def _binary_replace(data, old_prefix, new_prefix):
+    """Replace old_prefix with new_prefix within the NUL-terminated strings of
+    data, padding with NULs so that the length of data is preserved.
+    """
+    if len(new_prefix) > len(old_prefix):
+        raise ValueError('New prefix is longer than the snapshot\'s prefix')
+
+    def replace(match):
+        occurrences = match.group().count(old_prefix)
+        padding = (len(old_prefix) - len(new_prefix)) * occurrences
+        return match.group().replace(old_prefix, new_prefix) + b'\0' * padding
+
+    pattern = re.compile(re.escape(old_prefix) + b'([^\0]*?)\0')
+    return pattern.sub(replace, data)
+
+
+def _relocate(env_dpath, manifest):
+    old_prefix = manifest['prefix']
+    for rel_fpath, kind in manifest['prefix_files'].items():
+        fpath = os.path.join(env_dpath, rel_fpath)
+        if kind == 'symlink':
+            target = os.readlink(fpath)
+            os.remove(fpath)
+            os.symlink(env_dpath + target[len(old_prefix):], fpath)
+            continue
+        with open(fpath, 'rb') as fp:
+            data = fp.read()
+        if kind == 'binary':
+            data = _binary_replace(data, old_prefix.encode('utf-8'),
+                                   env_dpath.encode('utf-8'))
+        else:
+            data = data.replace(old_prefix.encode('utf-8'),
+                                env_dpath.encode('utf-8'))
+        # The file may be hard-linked from conda's package cache, so it is
+        # replaced rather than modified in place
+        mode = os.stat(fpath).st_mode
+        os.remove(fpath)
+        with open(fpath, 'wb') as fp:
+            fp.write(data)
+        os.chmod(fpath, mode)
+
+
+def _is_safe_member(member):
+    name = os.path.normpath(member.name)
+    return not (os.path.isabs(name) or name.startswith('..') or
+                member.isdev())
+
+
+def restore_env(snapshot_fpath, env_dpath):
+    """Unpack the snapshot at snapshot_fpath into env_dpath (which must not
+    exist yet), relocating it from the snapshot's original prefix. Raise
+    ValueError if the snapshot is unusable; env_dpath is removed in that case.
+    """
+    env_dpath = os.path.abspath(env_dpath)
+    try:
+        with tarfile.open(snapshot_fpath, 'r:gz') as tar:
+            members = tar.getmembers()
+            if not members or members[0].name != MANIFEST_NAME:
+                raise ValueError('"{}" is not a conda-shell snapshot'.format(
+                    snapshot_fpath
+                ))
+            manifest = json.loads(
+                tar.extractfile(members[0]).read().decode('utf-8')
+            )
+            if manifest.get('version') != SNAPSHOT_VERSION:
+                raise ValueError('Unsupported snapshot version in "{}"'.format(
+                    snapshot_fpath
+                ))
+            if not all(_is_safe_member(member) for member in members[1:]):
+                raise ValueError('Unsafe paths in snapshot "{}"'.format(
+                    snapshot_fpath
+                ))
+            os.makedirs(env_dpath)
+            extract_kwargs = {}
+            if hasattr(tarfile, 'tar_filter'):
+                # Python versions with extraction filters also refuse
+                # members which would end up outside of env_dpath
+                extract_kwargs['filter'] = 'tar'
+            tar.extractall(env_dpath, members=members[1:], **extract_kwargs)
+        _relocate(env_dpath, manifest)
+    except (ValueError, IOError, OSError, tarfile.TarError) as err:
+        if os.path.isdir(env_dpath):
+            shutil.rmtree(env_dpath)
+        raise ValueError('Could not restore snapshot "{}": {}'.format(
+            snapshot_fpath, err
+        ))
+
+
+@contextlib.contextmanager
+def fetch_snapshot(key, platform_name=None):
+    """Yield the path of a local copy of the snapshot with the `cmds_key`
+    digest key (for platform_name, default: this platform), or None if
+    neither the snapshot directory nor the mirror has it. Snapshots from the
+    mirror are downloaded to a temporary file, which is removed afterwards;
+    a mirror which doesn't respond within `get_snapshot_timeout` seconds is
+    treated as not having the snapshot.
+    """
+    name = snapshot_name(key, platform_name or get_platform())
+    snapshot_dpath = get_snapshot_dpath()
+    if snapshot_dpath is not None:
+        snapshot_fpath = os.path.join(snapshot_dpath, name)
+        if os.path.isfile(snapshot_fpath):
+            yield snapshot_fpath
+            return
+
+    mirror = get_snapshot_mirror()
+    if mirror is None:
+        yield None
+        return
+    fd, tmp_fpath = tempfile.mkstemp(suffix='.tar.gz')
+    try:
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                response = urlopen(mirror.rstrip('/') + '/' + name,
+                                   timeout=get_snapshot_timeout())
+                shutil.copyfileobj(response, fp)
+                response.close()
+        except (IOError, OSError):
+            # Also raised for HTTP errors, such as a missing snapshot, and
+            # for timeouts (socket.timeout)
+            yield None
+        else:
+            yield tmp_fpath
+    finally:
+        if os.path.exists(tmp_fpath):
+            os.remove(tmp_fpath)
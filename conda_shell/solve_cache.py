@@ -0,0 +1,113 @@
+"""
+Cache of solved `conda create` transactions. Each solution is stored as an
+explicit list of package URLs, which conda can install without running its
+solver when the same request comes up again.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import glob
+import json
+import hashlib
+
+from .explicit import write_explicit_file
+from .utils import get_cache_dpath
+
+
+SOLVE_CACHE_DNAME = 'solves'
+DEFAULT_SOLVE_CACHE_SIZE = 256
+
+
+def get_solve_cache_size():
+    """Return the maximum number of solutions to keep, from
+    $CONDA_SHELL_SOLVE_CACHE_SIZE (default: DEFAULT_SOLVE_CACHE_SIZE).
+    """
+    return int(os.environ.get('CONDA_SHELL_SOLVE_CACHE_SIZE',
+                              DEFAULT_SOLVE_CACHE_SIZE))
+
+
+def repodata_fingerprint(pkgs_dpaths):
+    """Return a digest of conda's cached repodata: the name, size and mtime of
+    every JSON file in the `cache` directory of each of pkgs_dpaths. It
+    changes whenever conda refreshes its view of a channel.
+    """
+    stats = []
+    for pkgs_dpath in pkgs_dpaths:
+        for fpath in glob.glob(os.path.join(pkgs_dpath, 'cache', '*.json')):
+            try:
+                fstat = os.stat(fpath)
+            except OSError:
+                continue
+            stats.append([fpath, fstat.st_size, fstat.st_mtime])
+    return hashlib.sha1(
+        json.dumps(sorted(stats)).encode('utf-8')
+    ).hexdigest()
+
+
+class SolveCache(object):
+    """Directory of explicit environment files, one per solved request, kept
+    underneath the conda environments directory. Least-recently used entries
+    are evicted once there are more than `max_entries` of them.
+    """
+
+    def __init__(self, prefix_dpath, max_entries=None):
+        """Constructor."""
+        self.dpath = get_cache_dpath(prefix_dpath, SOLVE_CACHE_DNAME)
+        self.max_entries = (get_solve_cache_size() if max_entries is None
+                            else max_entries)
+
+    @staticmethod
+    def key(packages, channels, override_channels, platform, fingerprint):
+        """Return the cache key for a request of packages from channels, on
+        platform (conda's subdir, e.g. "linux-64"), given the repodata
+        fingerprint (see `repodata_fingerprint`).
+        """
+        return hashlib.sha1(json.dumps([
+            sorted(packages or []),
+            list(channels or []),
+            bool(override_channels),
+            platform,
+            fingerprint,
+        ]).encode('utf-8')).hexdigest()
+
+    def _fpath(self, key):
+        return os.path.join(self.dpath, key + '.txt')
+
+    def lookup(self, key):
+        """Return the path of the explicit file stored under key, or None."""
+        fpath = self._fpath(key)
+        try:
+            # Mark the entry as recently used
+            os.utime(fpath, None)
+        except OSError:
+            return None
+        return fpath
+
+    def store(self, key, specs, platform=None):
+        """Store specs (see `explicit.get_explicit_specs`) under key."""
+        write_explicit_file(self._fpath(key), specs, platform=platform)
+        self._evict()
+
+    def _evict(self):
+        fpaths = glob.glob(os.path.join(self.dpath, '*.txt'))
+        if len(fpaths) <= self.max_entries:
+            return
+        mtimes = {}
+        for fpath in fpaths:
+            try:
+                mtimes[fpath] = os.path.getmtime(fpath)
+            except OSError:
+                continue
+        lru_fpaths = sorted(mtimes, key=lambda fpath: mtimes[fpath])
+        for fpath in lru_fpaths[:len(lru_fpaths) - self.max_entries]:
+            try:
+                os.remove(fpath)
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove every stored solution."""
+        for fpath in glob.glob(os.path.join(self.dpath, '*.txt')):
+            os.remove(fpath)
@@ -0,0 +1,51 @@
+"""
+Environment stores: the directories which conda-shell searches for reusable
+environments. In order of preference:
+
+    - the local store, where environments are created
+      (`$CONDA_SHELL_LOCAL_STORE`, or the `envs` directory of the conda
+      installation)
+    - conda's environment directories (`$CONDA_ENVS_PATH`)
+    - shared stores, e.g. on a cluster filesystem
+      (`$CONDA_SHELL_SHARED_STORE`), which may be read-only
+
+Every store has its own `EnvIndex` and bookkeeping files.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+
+
+def _split_dpaths(value):
+    return [os.path.abspath(os.path.expanduser(dpath))
+            for dpath in (value or '').split(os.pathsep) if dpath]
+
+
+def get_local_store_dpath(default_dpath):
+    """Return the store where new environments are created:
+    $CONDA_SHELL_LOCAL_STORE, or default_dpath.
+    """
+    return (_split_dpaths(os.environ.get('CONDA_SHELL_LOCAL_STORE')) or
+            [default_dpath])[0]
+
+
+def get_store_dpaths(local_dpath):
+    """Return the ordered list of stores to search, starting with the local
+    store local_dpath. Stores which don't exist are left out (except for the
+    local store), as are duplicates.
+    """
+    store_dpaths = [local_dpath]
+    for dpath in (_split_dpaths(os.environ.get('CONDA_ENVS_PATH')) +
+                  _split_dpaths(os.environ.get('CONDA_SHELL_SHARED_STORE'))):
+        if dpath not in store_dpaths and os.path.isdir(dpath):
+            store_dpaths.append(dpath)
+    return store_dpaths
+
+
+def is_writable_store(store_dpath):
+    """Return True if conda-shell may write to store_dpath (to record use of
+    its environments, lock them, and update its index).
+    """
+    return os.access(store_dpath, os.W_OK)
@@ -0,0 +1,62 @@
+"""
+Small helpers shared by conda-shell's bookkeeping files.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import json
+import errno
+import tempfile
+
+
+CACHE_DNAME = '.conda-shell'
+
+
+def get_cache_dpath(prefix_dpath, *subdirs):
+    """Return the directory (creating it if necessary) where conda-shell keeps
+    its own files, underneath the conda environments directory prefix_dpath.
+    The directory name starts with a dot, so it is never mistaken for a
+    conda-shell environment.
+    """
+    cache_dpath = os.path.join(prefix_dpath, CACHE_DNAME, *subdirs)
+    try:
+        os.makedirs(cache_dpath)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    return cache_dpath
+
+
+def load_json(fpath, default=None):
+    """Return the decoded contents of the JSON file at fpath, or default if
+    the file is missing or unreadable.
+    """
+    try:
+        with open(fpath, 'r') as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def atomic_write(fpath, text):
+    """Write text to fpath. The data is written to a temporary file in the
+    same directory and renamed into place, so that readers never observe a
+    partially-written file.
+    """
+    fd, tmp_fpath = tempfile.mkstemp(dir=os.path.dirname(fpath) or '.',
+                                     prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(text)
+        os.rename(tmp_fpath, fpath)
+    except Exception:
+        if os.path.exists(tmp_fpath):
+            os.remove(tmp_fpath)
+        raise
+
+
+def atomic_write_json(fpath, obj):
+    """Serialize obj to fpath with `atomic_write`."""
+    atomic_write(fpath, json.dumps(obj, sort_keys=True))
@@ -0,0 +1,210 @@
+"""
+Preforked Python interpreters ("zygotes") for shebang scripts
+(`-i python --zygote numpy,pandas`). A zygote is a Python server process
+running in the script's environment, with the listed modules imported (see
+`zygote_server`). conda-shell hands each run of the script to the zygote,
+which forks and runs the script in the child; interpreter startup and the
+imports are paid once per zygote instead of once per run.
+
+The first run starts the zygote in the background and runs the script as
+usual. A zygote exits when it is idle for $CONDA_SHELL_ZYGOTE_TIMEOUT seconds
+(default: 600), or once its environment changes (see
+`activation.get_fingerprint`); the next run then starts a fresh one.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import re
+import sys
+import json
+import array
+import errno
+import fcntl
+import signal
+import socket
+import struct
+import hashlib
+import subprocess
+
+from .activation import get_fingerprint
+from .utils import get_cache_dpath
+from .zygote_server import LOCK_SUFFIX
+
+
+DEFAULT_ZYGOTE_TIMEOUT = 600
+ZYGOTE_LOG_FNAME = 'zygote.log'
+# Signals which are passed on to the script (which isn't in the terminal's
+# foreground process group)
+FORWARDED_SIGNALS = tuple(getattr(signal, name)
+                          for name in ('SIGINT', 'SIGTERM', 'SIGHUP',
+                                       'SIGQUIT', 'SIGUSR1', 'SIGUSR2')
+                          if hasattr(signal, name))
+SERVER_FPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'zygote_server.py')
+
+
+def get_zygote_timeout():
+    """Return the number of idle seconds after which zygotes exit."""
+    return float(os.environ.get('CONDA_SHELL_ZYGOTE_TIMEOUT',
+                                DEFAULT_ZYGOTE_TIMEOUT))
+
+
+def parse_modules(value):
+    """Return the list of module names in the comma-separated value."""
+    return [module.strip() for module in value.split(',') if module.strip()]
+
+
+def get_watched_fpaths(env_dpath):
+    """Return the files whose modification invalidates the zygotes of the
+    environment at env_dpath.
+    """
+    return [os.path.join(env_dpath, 'conda-meta', 'history'),
+            os.path.join(env_dpath, 'etc', 'conda', 'activate.d')]
+
+
+def get_socket_fpath(env_dpath, python_fpath, modules):
+    """Return the Unix socket of the zygote which runs python_fpath with
+    modules imported, in the current state of the environment at env_dpath.
+    Socket paths are limited to about 100 characters, so this is a digest
+    in a per-user directory (in $XDG_RUNTIME_DIR or /tmp).
+    """
+    digest = hashlib.sha1(json.dumps(
+        [get_fingerprint(env_dpath), python_fpath, modules]
+    ).encode('utf-8')).hexdigest()[:20]
+    socket_dpath = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp',
+                                'conda-shell-{}-zygotes'.format(os.getuid()))
+    try:
+        os.mkdir(socket_dpath, 0o700)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    return os.path.join(socket_dpath, digest + '.sock')
+
+
+def get_env_python(env_dpath, interpreter):
+    """Return the path of the Python interpreter of the environment at
+    env_dpath which the -i/--interpreter argument interpreter refers to, or
+    None if it isn't a Python interpreter of that environment.
+    """
+    name = os.path.basename(interpreter)
+    if not re.match(r'^python[0-9.]*$', name):
+        return None
+    python_fpath = os.path.join(env_dpath, 'bin', name)
+    if not os.path.isfile(python_fpath):
+        return None
+    return python_fpath
+
+
+def is_zygote_running(socket_fpath):
+    """Return True if a zygote of socket_fpath is running, even if it is
+    still importing its modules (and not listening yet).
+    """
+    try:
+        fd = os.open(socket_fpath + LOCK_SUFFIX, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except (IOError, OSError) as err:
+        if err.errno in (errno.EAGAIN, errno.EACCES):
+            return True
+        raise
+    finally:
+        os.close(fd)
+    return False
+
+
+def start_zygote(socket_fpath, python_fpath, modules, env_dpath, env_vars,
+                 lock_fpath=None):
+    """Start a zygote listening on socket_fpath in the background, without
+    waiting for it to import modules.
+    """
+    log_fpath = os.path.join(
+        get_cache_dpath(os.path.dirname(env_dpath)), ZYGOTE_LOG_FNAME
+    )
+    with open(os.devnull, 'r+') as devnull, open(log_fpath, 'a') as log_fp:
+        subprocess.Popen(
+            [python_fpath, SERVER_FPATH, socket_fpath, ','.join(modules),
+             str(get_zygote_timeout()), lock_fpath or ''] +
+            get_watched_fpaths(env_dpath),
+            env=env_vars, stdin=devnull, stdout=devnull, stderr=log_fp,
+            close_fds=True, preexec_fn=os.setsid
+        )
+
+
+def _read_message(fp):
+    line = fp.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+def run_in_zygote(socket_fpath, argv, env_vars):
+    """Run the script argv (script path and arguments) in the zygote
+    listening on socket_fpath, with this process's standard streams, working
+    directory and env_vars. Return the script's exit status, or None if the
+    zygote is unavailable (not running, or stale).
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_fpath)
+    except socket.error:
+        sock.close()
+        return None
+
+    try:
+        payload = json.dumps({'argv': argv, 'cwd': os.getcwd(),
+                              'env': env_vars}).encode('utf-8')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sock.sendmsg([struct.pack('!Q', len(payload))],
+                     [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                       array.array('i', [0, 1, 2]))])
+        sock.sendall(payload)
+        reply_fp = sock.makefile('rb')
+        reply = _read_message(reply_fp)
+        if reply is None or 'pid' not in reply:
+            return None
+
+        def forward(signum, frame):
+            try:
+                os.kill(reply['pid'], signum)
+            except OSError:
+                pass
+        old_handlers = dict((signum, signal.signal(signum, forward))
+                            for signum in FORWARDED_SIGNALS)
+        try:
+            reply = _read_message(reply_fp)
+        finally:
+            for signum, old_handler in old_handlers.items():
+                signal.signal(signum, old_handler)
+        if reply is None:
+            print('The zygote exited before the script did',
+                  file=sys.stderr)
+            return 1
+        return reply['status']
+    except (socket.error, ValueError):
+        return None
+    finally:
+        sock.close()
+
+
+def run_script(env_dpath, env_vars, run_cmd, modules, lock_fpath=None):
+    """Run the script of run_cmd (an interpreter, the script path and its
+    arguments) in a zygote of the environment at env_dpath which has modules
+    imported, and return its exit status. If there is no such zygote, start
+    one (for the next runs, unless one is starting already) and return None;
+    so does an interpreter which isn't the environment's Python, or a Python
+    without file descriptor passing (3.3+).
+    """
+    python_fpath = get_env_python(env_dpath, run_cmd[0])
+    if python_fpath is None or not hasattr(socket.socket, 'sendmsg'):
+        return None
+    socket_fpath = get_socket_fpath(env_dpath, python_fpath, modules)
+    status = run_in_zygote(socket_fpath, run_cmd[1:], env_vars)
+    if status is None and not is_zygote_running(socket_fpath):
+        start_zygote(socket_fpath, python_fpath, modules, env_dpath,
+                     env_vars, lock_fpath=lock_fpath)
+    return status
@@ -0,0 +1,294 @@
+"""
+Zygote server for Python scripts run by conda-shell (see `zygote`). This file
+is run as a script by the Python interpreter of a conda environment, which may
+not have conda-shell installed, so it only uses the standard library:
+
+    python zygote_server.py SOCKET MODULES TIMEOUT LOCK [WATCHED...]
+
+It imports the comma-separated MODULES, then listens on the Unix socket
+SOCKET. Each request carries a script's argv, working directory and
+environment variables, along with the client's standard input, output and
+error (passed as file descriptors); the server forks a child which runs the
+script with the modules already imported, and reports its exit status.
+
+The server exits after TIMEOUT seconds without requests, or once any of the
+WATCHED files (e.g. the environment's history) is modified. While it runs it
+holds a shared lock on the file LOCK (if given), which keeps garbage
+collection away from the environment, and an exclusive lock on SOCKET.lock,
+which keeps other servers of SOCKET from starting. Like conda-shell's other
+lock files (see `locking`), SOCKET.lock is never removed.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import array
+import runpy
+import select
+import signal
+import socket
+import struct
+import importlib
+import traceback
+
+
+HEADER_FORMAT = '!Q'
+# The server of SOCKET holds an exclusive lock on SOCKET + LOCK_SUFFIX for its
+# whole lifetime (see `zygote.is_zygote_running`)
+LOCK_SUFFIX = '.lock'
+N_FDS = 3
+SELECT_TIMEOUT = 0.5
+
+
+def get_mtimes(fpaths):
+    mtimes = []
+    for fpath in fpaths:
+        try:
+            mtimes.append(os.path.getmtime(fpath))
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def recv_exactly(conn, n_bytes):
+    chunks = []
+    while n_bytes > 0:
+        chunk = conn.recv(n_bytes)
+        if not chunk:
+            raise EOFError('connection closed')
+        chunks.append(chunk)
+        n_bytes -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_request(conn):
+    """Return the (request, fds) sent on conn."""
+    header_size = struct.calcsize(HEADER_FORMAT)
+    fd_array = array.array('i')
+    header, ancdata, _, _ = conn.recvmsg(
+        header_size, socket.CMSG_LEN(N_FDS * fd_array.itemsize)
+    )
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fd_array.frombytes(data[:len(data) - len(data) %
+                                    fd_array.itemsize])
+    fds = list(fd_array)
+    if len(header) < header_size:
+        header += recv_exactly(conn, header_size - len(header))
+    size, = struct.unpack(HEADER_FORMAT, header)
+    return json.loads(recv_exactly(conn, size).decode('utf-8')), fds
+
+
+def send_line(conn, message):
+    try:
+        conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+    except socket.error:
+        # The client went away
+        pass
+
+
+def _reopen_stdio():
+    # The standard streams were set up for /dev/null when the server started
+    sys.stdin = io.open(0, 'r', closefd=False)
+    # (buffering=1 is line buffering)
+    sys.stdout = io.open(1, 'w', 1 if os.isatty(1) else -1, closefd=False)
+    sys.stderr = io.open(2, 'w', 1, closefd=False)
+
+
+def run_script(request, fds):
+    """Run the script of request in this (forked) process, with the client's
+    standard streams fds, and exit with its status.
+    """
+    status = 1
+    try:
+        for target_fd, fd in enumerate(fds):
+            os.dup2(fd, target_fd)
+            os.close(fd)
+        _reopen_stdio()
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP,
+                       signal.SIGCHLD):
+            signal.signal(signum, signal.default_int_handler
+                          if signum == signal.SIGINT else signal.SIG_DFL)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        script_fpath = request['argv'][0]
+        sys.argv = list(request['argv'])
+        sys.path.insert(0, os.path.dirname(os.path.abspath(script_fpath)))
+        runpy.run_path(script_fpath, run_name='__main__')
+        status = 0
+    except SystemExit as exc:
+        if exc.code is None:
+            status = 0
+        elif isinstance(exc.code, int):
+            status = exc.code
+        else:
+            print(exc.code, file=sys.stderr)
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        os._exit(status)
+
+
+def exit_status(wait_status):
+    if os.WIFSIGNALED(wait_status):
+        return 128 + os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+def is_listening(socket_fpath):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_fpath)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+def acquire_server_lock(socket_fpath):
+    """Return the file descriptor of the exclusive lock of the server of
+    socket_fpath, or None if another server holds it.
+    """
+    fd = os.open(socket_fpath + LOCK_SUFFIX, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError) as err:
+        os.close(fd)
+        if err.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+    return fd
+
+
+def serve(socket_fpath, modules, timeout, lock_fpath, watched_fpaths):
+    # Held from before the (slow) imports until exit, so that only one server
+    # of socket_fpath runs at a time
+    server_lock_fd = acquire_server_lock(socket_fpath)
+    if server_lock_fd is None or is_listening(socket_fpath):
+        # Another client started the same zygote
+        return
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            traceback.print_exc()
+    if lock_fpath:
+        fcntl.flock(os.open(lock_fpath, os.O_RDWR | os.O_CREAT, 0o644),
+                    fcntl.LOCK_SH)
+    watched_mtimes = get_mtimes(watched_fpaths)
+
+    if os.path.exists(socket_fpath):
+        os.remove(socket_fpath)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        listener.bind(socket_fpath)
+    finally:
+        os.umask(old_umask)
+    listener.listen(16)
+
+    children = {}
+    last_request = time.time()
+    try:
+        while True:
+            # Report the exit status of finished scripts
+            while children:
+                try:
+                    pid, wait_status = os.waitpid(-1, os.WNOHANG)
+                except OSError as err:
+                    if err.errno != errno.ECHILD:
+                        raise
+                    break
+                if pid == 0:
+                    break
+                conn = children.pop(pid, None)
+                if conn is not None:
+                    send_line(conn, {'status': exit_status(wait_status)})
+                    conn.close()
+                last_request = time.time()
+
+            stale = get_mtimes(watched_fpaths) != watched_mtimes
+            if not children and (stale or
+                                 time.time() - last_request > timeout):
+                break
+            readable, _, _ = select.select([listener], [], [],
+                                           SELECT_TIMEOUT)
+            if not readable:
+                continue
+            conn, _ = listener.accept()
+            fds = []
+            try:
+                conn.settimeout(10)
+                request, fds = recv_request(conn)
+                conn.settimeout(None)
+            except (socket.error, EOFError, ValueError):
+                for fd in fds:
+                    os.close(fd)
+                conn.close()
+                continue
+            if stale or len(fds) != N_FDS:
+                # The environment changed since the modules were imported
+                send_line(conn, {'error': 'stale' if stale else 'bad fds'})
+                for fd in fds:
+                    os.close(fd)
+                conn.close()
+                continue
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                listener.close()
+                conn.close()
+                # Scripts (and their background processes) shouldn't keep the
+                # server's lock after it exits
+                os.close(server_lock_fd)
+                for child_conn in children.values():
+                    child_conn.close()
+                run_script(request, fds)
+            for fd in fds:
+                os.close(fd)
+            send_line(conn, {'pid': pid})
+            children[pid] = conn
+            last_request = time.time()
+    finally:
+        listener.close()
+        # The lock file stays: removing it while it is locked would let the
+        # next server lock a new file while this one still runs
+        try:
+            os.remove(socket_fpath)
+        except OSError:
+            pass
+
+
+def main(argv):
+    if not hasattr(socket.socket, 'recvmsg'):
+        # Passing file descriptors needs Python 3.3+
+        return 1
+    # Modules should be imported as the script would import them, not from
+    # this file's directory
+    del sys.path[0]
+    socket_fpath, modules, timeout, lock_fpath = argv[1:5]
+    serve(socket_fpath, [module for module in modules.split(',') if module],
+          float(timeout), lock_fpath, argv[5:])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,90 @@
+import os
+
+from conda_shell import activation
+from .fixtures import *
+
+
+def make_env(env_dpath):
+    activate_dpath = os.path.join(env_dpath, 'etc', 'conda', 'activate.d')
+    os.makedirs(activate_dpath)
+    os.makedirs(os.path.join(env_dpath, 'conda-meta'))
+    with open(os.path.join(activate_dpath, 'vars.sh'), 'w') as fp:
+        fp.write('echo activating\n'
+                 'export FOO=bar\n'
+                 'export PATH="$CONDA_PREFIX/tools:$PATH"\n'
+                 'unset OLD\n')
+    with open(os.path.join(env_dpath, 'conda-meta', 'history'), 'w') as fp:
+        fp.write('# cmd: conda create -n env python=3.6\n')
+
+
+class TestActivation(object):
+    def test_delta(self, tmp_dir):
+        """Test that the changes made by activation scripts are captured, and
+        applied to other environment variables.
+        """
+        env_dpath = os.path.join(tmp_dir.name, 'env')
+        make_env(env_dpath)
+        env_vars = {'PATH': '/usr/bin:/bin', 'CONDA_PREFIX': env_dpath,
+                    'OLD': '1'}
+        delta = activation.get_delta(env_dpath, env_vars)
+        assert delta == {'set': {'FOO': 'bar'},
+                         'wrap': {'PATH': [env_dpath + '/tools:', '']},
+                         'unset': ['OLD']}
+
+        new_vars = activation.apply_delta(
+            {'PATH': '/bin', 'CONDA_PREFIX': env_dpath, 'OLD': '2'}, delta
+        )
+        assert new_vars == {'PATH': env_dpath + '/tools:/bin',
+                            'CONDA_PREFIX': env_dpath, 'FOO': 'bar'}
+
+    def test_delta_baseline(self, tmp_dir):
+        """Test that variables which the shell drops by itself aren't unset,
+        and that only whole path lists are kept as wrapped values.
+        """
+        env_dpath = os.path.join(tmp_dir.name, 'env')
+        make_env(env_dpath)
+        with open(os.path.join(env_dpath, 'etc', 'conda', 'activate.d',
+                               'lib.sh'), 'w') as fp:
+            fp.write('export LIBS="x$LIBS:/opt/lib"\n'
+                     'export INCLUDE="$INCLUDE:/opt/include"\n')
+        env_vars = {'PATH': '/usr/bin:/bin', 'CONDA_PREFIX': env_dpath,
+                    'BASH_FUNC_module%%': '() {  :\n}',
+                    'LIBS': '/usr/lib', 'INCLUDE': '/usr/include'}
+        delta = activation.compute_delta(env_dpath, env_vars)
+        assert delta['unset'] == []
+        assert delta['set'] == {'FOO': 'bar', 'LIBS': 'x/usr/lib:/opt/lib'}
+        assert delta['wrap'] == {'PATH': [env_dpath + '/tools:', ''],
+                                 'INCLUDE': ['', ':/opt/include']}
+
+    def test_cache(self, tmp_dir, monkeypatch):
+        """Test that the delta is cached until the environment changes."""
+        env_dpath = os.path.join(tmp_dir.name, 'env')
+        make_env(env_dpath)
+        env_vars = {'PATH': '/bin', 'CONDA_PREFIX': env_dpath}
+        delta = activation.get_delta(env_dpath, env_vars)
+        assert os.path.isfile(os.path.join(env_dpath,
+                                           activation.ACTIVATION_FNAME))
+
+        def fail(*args):
+            raise AssertionError('activation scripts were run again')
+        monkeypatch.setattr(activation, 'compute_delta', fail)
+        assert activation.get_delta(env_dpath, env_vars) == delta
+
+        monkeypatch.undo()
+        history_fpath = os.path.join(env_dpath, 'conda-meta', 'history')
+        mtime = os.path.getmtime(history_fpath)
+        os.utime(history_fpath, (mtime + 10, mtime + 10))
+        monkeypatch.setattr(activation, 'compute_delta',
+                            lambda *args: {'set': {}, 'wrap': {},
+                                           'unset': []})
+        assert activation.get_delta(env_dpath, env_vars)['set'] == {}
+
+    def test_no_scripts(self, tmp_dir):
+        """Test that environments without activation scripts have an empty
+        delta.
+        """
+        env_dpath = os.path.join(tmp_dir.name, 'env')
+        os.makedirs(os.path.join(env_dpath, 'conda-meta'))
+        assert activation.compute_delta(env_dpath, {'PATH': '/bin'}) == {
+            'set': {}, 'wrap': {}, 'unset': []
+        }
@@ -0,0 +1,112 @@
+import os
+import json
+import argparse
+
+from conda_shell import batch, light_cli, main
+from .fixtures import *
+from .test_daemon import FakeCLI
+
+
+SCRIPTS = {
+    'a.sh': '#!conda-shell -i sh python=3.6 numpy\necho a $CONDA_PREFIX\n',
+    'b.sh': ('#!/usr/bin/env conda-shell\n#!conda-shell -i sh numpy\n'
+             '#!conda-shell python=3.6\necho b $CONDA_PREFIX\nexit 2\n'),
+    'c.sh': '#!conda-shell -i sh r-base\necho c $CONDA_PREFIX\n',
+    'd.sh': '#!conda-shell python=3.6\necho d\n',
+    'notes.txt': 'Not a script\n',
+}
+
+
+def make_namespace(packages):
+    return [argparse.Namespace(packages=packages, channel=None)]
+
+
+class TestBatch(object):
+    def test_run_batch(self, tmp_dir, monkeypatch, capfd):
+        """Test that scripts which request the same environment share it, and
+        that each script's exit status and output are recorded.
+        """
+        main.DEFAULT_ENV_PREFIX = '__testme_shell_'
+        store_dpath = os.path.join(tmp_dir.name, 'envs')
+        os.makedirs(store_dpath)
+        monkeypatch.setattr(light_cli, 'get_conda_install_dpath',
+                            lambda: tmp_dir.name)
+        for key in list(os.environ):
+            if key.startswith('CONDA_SHELL_') or key == 'CONDA_ENVS_PATH':
+                monkeypatch.delenv(key)
+        scripts_dpath = os.path.join(tmp_dir.name, 'scripts')
+        os.makedirs(scripts_dpath)
+        for fname, text in SCRIPTS.items():
+            with open(os.path.join(scripts_dpath, fname), 'w') as fp:
+                fp.write(text)
+        log_dpath = os.path.join(tmp_dir.name, 'logs')
+        cli = FakeCLI()
+
+        # a.sh is given twice, but runs once
+        results = batch.run_batch(
+            [os.path.join(scripts_dpath, 'a.sh'), scripts_dpath], cli, 2,
+            log_dpath, lambda: cli
+        )
+        assert ([os.path.basename(result['script']) for result in results] ==
+                ['a.sh', 'b.sh', 'c.sh', 'd.sh'])
+        assert len(os.listdir(log_dpath)) == 4
+        assert [result['status'] for result in results] == [0, 2, 0, None]
+        assert 'interactive' in results[3]['error']
+        env_dpaths = sorted(os.path.join(store_dpath, env_name)
+                            for env_name in os.listdir(store_dpath)
+                            if main.is_shell_env(env_name))
+        assert len(env_dpaths) == 2
+        assert results[0]['env'] == results[1]['env']
+        assert results[0]['env'] != results[2]['env']
+        with open(results[1]['log']) as fp:
+            assert fp.read() == 'b {}\n'.format(results[1]['env'])
+        with open(os.path.join(log_dpath, batch.SUMMARY_FNAME)) as fp:
+            assert json.load(fp) == results
+
+        # The environments are reused
+        capfd.readouterr()
+        rerun_results = batch.run_batch([scripts_dpath], cli, 2, log_dpath,
+                                        lambda: cli)
+        assert ([result.get('env') for result in rerun_results] ==
+                [result.get('env') for result in results])
+        assert 'Creating' not in capfd.readouterr()[1]
+
+    def test_get_lanes(self):
+        """Test that environments which share packages are created one after
+        the other.
+        """
+        keyed_cmds = [
+            ('a', make_namespace(['python=3.6', 'numpy'])),
+            ('b', make_namespace(['r-base'])),
+            ('c', make_namespace(['conda-forge::numpy >=1.13'])),
+            ('d', make_namespace(['pandas', 'r-base=3.4'])),
+            ('e', make_namespace(['curl'])),
+        ]
+        assert ([[key for key, _ in lane]
+                 for lane in batch.get_lanes(keyed_cmds)] ==
+                [['a', 'c'], ['b', 'd'], ['e']])
+
+    def test_group_scripts_usage_error(self, tmp_dir, monkeypatch):
+        """Test that a script which conda's parsers reject (with SystemExit)
+        is recorded as an error, without aborting the others.
+        """
+        monkeypatch.setattr(light_cli, 'get_conda_install_dpath',
+                            lambda: tmp_dir.name)
+
+        class ExitingCLI(FakeCLI):
+            def parse_shell_args(self, argv):
+                if '--bad' in argv:
+                    raise SystemExit(2)
+                return super(ExitingCLI, self).parse_shell_args(argv)
+
+        script_fpaths = []
+        for fname, text in (('bad.sh', '#!conda-shell --bad numpy\n'),
+                            ('good.sh', SCRIPTS['a.sh'])):
+            script_fpaths.append(os.path.join(tmp_dir.name, fname))
+            with open(script_fpaths[-1], 'w') as fp:
+                fp.write(text)
+        groups, errors = batch.group_scripts(script_fpaths, ExitingCLI())
+        assert list(errors) == [script_fpaths[0]]
+        assert 'exit status 2' in errors[script_fpaths[0]]
+        assert ([script_fpath for scripts in groups.values()
+                 for script_fpath, _ in scripts] == [script_fpaths[1]])
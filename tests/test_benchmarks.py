@@ -0,0 +1,30 @@
+import os
+import sys
+import json
+import subprocess
+
+from .fixtures import *
+
+
+BENCH_FPATH = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)
+)), 'benchmarks', 'run.py')
+
+
+class TestBenchmarks(object):
+    def test_quick_run(self, tmp_dir):
+        """Test that the benchmarks run offline against synthetic stores, and
+        write their results as JSON.
+        """
+        results_fpath = os.path.join(tmp_dir.name, 'results.json')
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, BENCH_FPATH, '--quick',
+                                   '--sizes', '3', '-o', results_fpath],
+                                  stdout=devnull, stderr=devnull)
+        with open(results_fpath) as fp:
+            results = json.load(fp)
+        assert results['meta']['sizes'] == [3]
+        for name in ('lookup/warm/n=3', 'lookup/cold/n=3', 'startup/warm/n=3',
+                     'shebang/lines=5', 'create/n=3'):
+            assert len(results['results'][name]['timings']) == 2
+            assert results['results'][name]['min'] >= 0
@@ -0,0 +1,79 @@
+import os
+import time
+
+from conda_shell import cleanup, locking, main
+from .fixtures import *
+
+
+def make_env(prefix_dpath, env_name, num_bytes, last_use):
+    env_dpath = os.path.join(prefix_dpath, env_name)
+    os.makedirs(os.path.join(env_dpath, 'conda-meta'))
+    with open(os.path.join(env_dpath, 'conda-meta', 'data'), 'wb') as fp:
+        fp.write(b'x' * num_bytes)
+    cleanup.record_use(prefix_dpath, env_name)
+    use_fpath = os.path.join(prefix_dpath, '.conda-shell',
+                             cleanup.LAST_USE_DNAME, env_name)
+    os.utime(use_fpath, (last_use, last_use))
+    return env_dpath
+
+
+class TestCleanup(object):
+    def test_parse_size(self):
+        """Test parsing of disk budgets."""
+        assert cleanup.parse_size('1000') == 1000
+        assert cleanup.parse_size('2k') == 2048
+        assert cleanup.parse_size('1.5G') == int(1.5 * 1024 ** 3)
+        assert cleanup.parse_size('10MB') == 10 * 1024 ** 2
+
+    def test_env_bytes(self, tmp_dir):
+        """Test that hard-linked files don't count towards an environment's
+        size.
+        """
+        env_dpath = make_env(tmp_dir.name, 'env', 100, time.time())
+        assert cleanup.get_env_bytes(env_dpath) == 100
+        os.link(os.path.join(env_dpath, 'conda-meta', 'data'),
+                os.path.join(tmp_dir.name, 'pkgs-data'))
+        assert cleanup.get_env_bytes(env_dpath) == 0
+
+    def test_collect_garbage(self, tmp_dir):
+        """Test that least-recently used environments are removed first, and
+        that environments in use or half-created are handled.
+        """
+        prefix_dpath = tmp_dir.name
+        main.DEFAULT_ENV_PREFIX = '__testme_shell_'
+        now = time.time()
+        for idx in range(4):
+            make_env(prefix_dpath, '__testme_shell_{}'.format(idx), 100,
+                     now - 100 * idx)
+
+        def env_names():
+            return sorted(os.path.basename(env_dpath) for env_dpath in
+                          main.get_conda_env_dirs(prefix_dpath))
+
+        removed = main.collect_env_garbage(prefix_dpath, max_envs=2,
+                                           dry_run=True)
+        assert ([os.path.basename(env_dpath) for env_dpath in removed] ==
+                ['__testme_shell_3', '__testme_shell_2'])
+        assert len(env_names()) == 4
+
+        # Environments in use are skipped
+        env_lock = cleanup.get_env_lock(prefix_dpath, '__testme_shell_3')
+        env_lock.acquire()
+        main.collect_env_garbage(prefix_dpath, max_bytes=250)
+        env_lock.release()
+        assert env_names() == ['__testme_shell_0', '__testme_shell_3']
+
+        # Half-created environments are removed regardless of the budget
+        make_env(prefix_dpath, '__testme_shell_4', 100, now)
+        try:
+            with locking.building(prefix_dpath, '__testme_shell_4'):
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        main.collect_env_garbage(prefix_dpath)
+        assert not os.path.exists(os.path.join(prefix_dpath,
+                                               '__testme_shell_4'))
+        assert env_names() == ['__testme_shell_0', '__testme_shell_3']
+
+        main.collect_env_garbage(prefix_dpath, max_envs=1)
+        assert env_names() == ['__testme_shell_0']
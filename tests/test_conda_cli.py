@@ -3,6 +3,8 @@ import os
 
 import pytest
 from conda_shell import main
+from conda_shell import light_cli as light_cli_mod
+from conda_shell import conda_cli
 from .fixtures import *
 
 
@@ -68,3 +70,148 @@ class TestCondaShellCLI(object):
         cli.conda_install(args)
         output = subprocess.check_output('conda list -n '+env_name, universal_newlines=True, shell=True)
         assert 'numpy' in output
+
+    def test_light_cli(self, cli):
+        """Test that LightShellCLI parses packages and channels the same way
+        as conda's parsers, and refuses arguments it doesn't know about.
+        """
+        light_cli = light_cli_mod.LightShellCLI()
+        assert light_cli.prefix_dpath == cli.prefix_dpath
+        for argv in (['python=3.6', 'numpy=1.13'],
+                     ['-c', 'conda-forge', 'pydap', '--run', 'python -V'],
+                     ['-i', 'python', '-c', 'chan1', '-c', 'chan2', 'pkg1']):
+            light_args = light_cli.parse_shell_args(argv)
+            args = cli.parse_shell_args(argv)
+            assert light_args.packages == args.packages
+            assert light_args.channel == args.channel
+            assert light_args.run == args.run
+            assert light_args.interpreter == args.interpreter
+
+        with pytest.raises(light_cli_mod.UnsupportedArgumentError):
+            light_cli.parse_shell_args(['--override-channels', 'pkg1'])
+        with pytest.raises(light_cli_mod.UnsupportedArgumentError):
+            light_cli.parse_shell_args(['-i', 'python', '--run', 'echo'])
+
+    def test_describe_and_build_parser(self):
+        """Test that parsers rebuilt from the CLI cache parse arguments the
+        same way as the parsers they were described from.
+        """
+        import argparse
+        import json
+
+        null = object()
+
+        class NullCountAction(argparse._CountAction):
+            def __call__(self, parser, namespace, values, option_string=None):
+                count = getattr(namespace, self.dest, null)
+                setattr(namespace, self.dest,
+                        1 if count is null else count + 1)
+
+        parser = argparse.ArgumentParser(prog='conda create')
+        parser.add_argument('-n', '--name')
+        parser.add_argument('-c', '--channel', action='append')
+        parser.add_argument('-y', '--yes', action='store_true', default=null)
+        parser.add_argument('-v', '--verbose', action=NullCountAction,
+                            default=null)
+        parser.add_argument('--jobs', type=int, default=1)
+        parser.add_argument('packages', metavar='package_spec', nargs='*')
+        desc = json.loads(json.dumps(conda_cli.describe_parser(parser)))
+        rebuilt = conda_cli.build_parser(desc)
+
+        argv = ['-n', 'env', '-c', 'chan1', '-c', 'chan2', '-y', '-vv',
+                '--jobs', '3', 'pkg1', 'pkg2']
+        assert vars(rebuilt.parse_args(argv)) == vars(parser.parse_args(argv))
+
+        cli = conda_cli.CondaCLI.__new__(conda_cli.CondaCLI)
+        conda_args = cli._to_conda_args(rebuilt.parse_args(['pkg1']),
+                                        rebuilt, parser)
+        assert conda_args.packages == ['pkg1']
+        assert conda_args.yes is null
+        assert conda_args.verbose is null
+        conda_args = cli._to_conda_args(rebuilt.parse_args(['-y', 'pkg1']),
+                                        rebuilt, parser)
+        assert conda_args.yes is True
+
+    def test_load_conda_threads(self, monkeypatch):
+        """Test that conda is loaded once, and completely, when several
+        threads need it at the same time.
+        """
+        import sys
+        import time
+        import types
+        import argparse
+        import threading
+
+        class MainMod(object):
+            def generate_parser(self):
+                parser = argparse.ArgumentParser(prog='conda')
+                return parser, parser.add_subparsers()
+
+        class SubcommandMod(object):
+            def __init__(self, name):
+                self.name = name
+
+            def configure_parser(self, sub_parsers):
+                # Slow enough for the other threads to catch up
+                time.sleep(0.1)
+                sub_parsers.add_parser(self.name)
+
+        imports = []
+
+        def import_conda_modules():
+            imports.append(True)
+            return (object(), MainMod(), SubcommandMod('install'),
+                    SubcommandMod('create'))
+        conda_mod = types.ModuleType(str('conda'))
+        conda_mod.__version__ = '4.3.0'
+        monkeypatch.setitem(sys.modules, 'conda', conda_mod)
+        cli = conda_cli.CondaCLI.__new__(conda_cli.CondaCLI)
+        cli._main_mod = None
+        cli._load_lock = threading.Lock()
+        cli._import_conda_modules = import_conda_modules
+
+        parsers = []
+
+        def load():
+            cli._load_conda()
+            parsers.append((cli._conda_create_parser,
+                            cli._conda_install_parser))
+        threads = [threading.Thread(target=load) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(imports) == 1
+        assert len(parsers) == 4
+        assert all(create_parser is not None and install_parser is not None
+                   for create_parser, install_parser in parsers)
+
+    def test_cli_cache_version(self, tmp_dir, monkeypatch):
+        """Test that the CLI cache is dropped once conda's recorded version
+        changes.
+        """
+        import json
+
+        monkeypatch.setattr(conda_cli, 'get_conda_install_dpath',
+                            lambda: tmp_dir.name)
+        sp_dpath = os.path.join(tmp_dir.name, 'lib', 'python3.6',
+                                'site-packages')
+        os.makedirs(os.path.join(sp_dpath, 'conda'))
+        conda_meta_dpath = os.path.join(tmp_dir.name, 'conda-meta')
+        os.makedirs(conda_meta_dpath)
+
+        def install_conda(version):
+            for fname in os.listdir(conda_meta_dpath):
+                os.remove(os.path.join(conda_meta_dpath, fname))
+            for name in ('conda', 'conda-build'):
+                rec_fname = '{}-{}-py36_0.json'.format(name, version)
+                with open(os.path.join(conda_meta_dpath, rec_fname),
+                          'w') as fp:
+                    json.dump({'name': name, 'version': version}, fp)
+        install_conda('4.3.30')
+        conda_cli.save_cli_cache(sp_dpath, '4.3.30', {})
+        assert conda_cli.load_cli_cache()['conda_version'] == '4.3.30'
+
+        # The package directory's mtime doesn't change
+        install_conda('4.4.0')
+        assert conda_cli.load_cli_cache() is None
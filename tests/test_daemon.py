@@ -0,0 +1,115 @@
+import os
+import threading
+
+import pytest
+from conda_shell import client, daemon, light_cli, main
+from .fixtures import *
+
+
+class FakeCLI(light_cli.LightShellCLI):
+    def __init__(self):
+        super(FakeCLI, self).__init__()
+        self.created = []
+
+    def conda_create(self, args):
+        env_dpath = os.path.join(args.store, args.name)
+        os.makedirs(os.path.join(env_dpath, 'conda-meta'))
+        with open(os.path.join(env_dpath, 'conda-meta', 'history'),
+                  'w') as fp:
+            fp.write('# cmd: conda create -n {} {}\n'.format(
+                args.name, ' '.join(args.packages)
+            ))
+        self.created.append(env_dpath)
+
+
+@pytest.fixture
+def server(tmp_dir, monkeypatch):
+    """Run a daemon with a fake conda installation in tmp_dir, and yield
+    it.
+    """
+    main.DEFAULT_ENV_PREFIX = '__testme_shell_'
+    os.makedirs(os.path.join(tmp_dir.name, 'envs'))
+    monkeypatch.setattr(light_cli, 'get_conda_install_dpath',
+                        lambda: tmp_dir.name)
+    for key in list(os.environ):
+        if key.startswith('CONDA_SHELL_') or key == 'CONDA_ENVS_PATH':
+            monkeypatch.delenv(key)
+    socket_fpath = os.path.join(tmp_dir.name, 'daemon.sock')
+    monkeypatch.setenv('CONDA_SHELL_DAEMON_SOCKET', socket_fpath)
+
+    server = daemon.Daemon(socket_fpath, FakeCLI())
+    ready = threading.Event()
+    thread = threading.Thread(target=server.serve, args=(ready,))
+    thread.start()
+    ready.wait()
+    yield server
+    server.stop()
+    thread.join()
+    assert not os.path.exists(socket_fpath)
+
+
+def run_request(argv):
+    reply, sock = client.request(argv)
+    sock.close()
+    return reply
+
+
+class TestDaemon(object):
+    def test_resolve(self, server):
+        """Test that environments are created, then reused, through the
+        daemon.
+        """
+        argv = ['conda-shell', 'python=3.6', '--run', 'python -V']
+        reply = run_request(argv)
+        assert reply['action'] == 'exec'
+        assert reply['argv'] == ['python', '-V']
+        env_dpath = reply['env_dpath']
+        assert server.cli.created == [env_dpath]
+        assert reply['env']['CONDA_PREFIX'] == env_dpath
+        assert reply['env']['PATH'].startswith(os.path.join(env_dpath, 'bin'))
+        assert os.path.isfile(reply['lock_fpath'])
+
+        reply = run_request(argv)
+        assert reply['env_dpath'] == env_dpath
+        assert (reply['env']['CONDA_SHELL_ENV_NAME'] ==
+                os.path.basename(env_dpath))
+        assert len(server.cli.created) == 1
+
+    def test_concurrent_creation(self, server):
+        """Test that concurrent requests for the same environment share its
+        creation.
+        """
+        argv = ['conda-shell', 'numpy=1.13', '--run', 'true']
+        replies = []
+        threads = [threading.Thread(target=lambda: replies.append(
+            run_request(argv)
+        )) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(server.cli.created) == 1
+        assert set(reply['env_dpath'] for reply in replies) == set(
+            server.cli.created
+        )
+
+    def test_decline(self, server, monkeypatch):
+        """Test that the daemon declines requests it can't serve exactly as
+        conda-shell would.
+        """
+        for argv in (['conda-shell', 'python=3.6'],
+                     ['conda-shell', 'gc'],
+                     ['conda-shell', 'python=3.6', '--run', 'true',
+                      '--ephemeral']):
+            assert run_request(argv)['action'] == 'fallback'
+        monkeypatch.setenv('CONDA_SHELL_MATCH', 'satisfy')
+        assert run_request(['conda-shell', 'python=3.6', '--run',
+                            'true'])['action'] == 'fallback'
+        assert server.cli.created == []
+
+    def test_no_daemon(self, tmp_dir, monkeypatch):
+        """Test that the client steps aside when no daemon is running."""
+        monkeypatch.setenv('CONDA_SHELL_DAEMON_SOCKET',
+                           os.path.join(tmp_dir.name, 'missing.sock'))
+        assert client.request(['conda-shell', 'python=3.6']) is None
+        assert client.run(['conda-shell', 'python=3.6']) is None
@@ -0,0 +1,104 @@
+import os
+import time
+import signal
+import argparse
+import threading
+
+import pytest
+from conda_shell import ephemeral, main
+from .fixtures import *
+
+
+class FakeCLI(object):
+    def __init__(self, prefix_dpath):
+        self.prefix_dpath = prefix_dpath
+        self.store_dpaths = [prefix_dpath]
+        self.created = []
+
+    def conda_create(self, args):
+        env_dpath = os.path.join(args.store, args.name)
+        os.makedirs(os.path.join(env_dpath, 'conda-meta'))
+        with open(os.path.join(env_dpath, 'conda-meta', 'history'),
+                  'w') as fp:
+            fp.write('# cmd: conda create -n {} {}\n'.format(
+                args.name, ' '.join(args.packages)
+            ))
+        self.created.append(env_dpath)
+
+
+class TestEphemeral(object):
+    def test_exit_on_signals(self):
+        """Test that termination signals raise SystemExit in the context,
+        and are restored afterwards.
+        """
+        old_handler = signal.getsignal(signal.SIGTERM)
+        with pytest.raises(SystemExit):
+            with ephemeral.exit_on_signals():
+                os.kill(os.getpid(), signal.SIGTERM)
+        assert signal.getsignal(signal.SIGTERM) == old_handler
+
+    def test_softlink_packages(self, monkeypatch):
+        """Test that conda's softlink setting is only changed temporarily."""
+        monkeypatch.delenv('CONDA_ALWAYS_SOFTLINK', raising=False)
+        with ephemeral.softlink_packages():
+            assert os.environ['CONDA_ALWAYS_SOFTLINK'] == 'true'
+        assert 'CONDA_ALWAYS_SOFTLINK' not in os.environ
+
+    def test_ephemeral_env(self, tmp_dir, monkeypatch):
+        """Test that ephemeral environments are created in the ephemeral
+        store, and removed after the run.
+        """
+        main.DEFAULT_ENV_PREFIX = '__testme_shell_'
+        ephemeral_dpath = os.path.join(tmp_dir.name, 'shm')
+        prefix_dpath = os.path.join(tmp_dir.name, 'envs')
+        os.makedirs(prefix_dpath)
+        monkeypatch.setenv('CONDA_SHELL_EPHEMERAL_DIR', ephemeral_dpath)
+        monkeypatch.delenv('CONDA_SHELL_ENV_NAME', raising=False)
+
+        cli = FakeCLI(prefix_dpath)
+        cmd = argparse.Namespace(packages=['python=3.6'], channel=None,
+                                 name=main.rand_env_name(), run='true',
+                                 ephemeral=True, _argv=[])
+        main.run_cmds_in_env([cmd], cli, ['conda-shell'])
+        assert len(cli.created) == 1
+        assert os.path.dirname(cli.created[0]) == ephemeral_dpath
+        assert not os.path.exists(cli.created[0])
+        assert main.get_conda_env_dirs(prefix_dpath) == []
+
+    def test_ephemeral_env_signal(self, tmp_dir, monkeypatch):
+        """Test that termination signals are passed on to the command, which
+        exits before its ephemeral environment is removed.
+        """
+        main.DEFAULT_ENV_PREFIX = '__testme_shell_'
+        ephemeral_dpath = os.path.join(tmp_dir.name, 'shm')
+        prefix_dpath = os.path.join(tmp_dir.name, 'envs')
+        os.makedirs(prefix_dpath)
+        monkeypatch.setenv('CONDA_SHELL_EPHEMERAL_DIR', ephemeral_dpath)
+        monkeypatch.delenv('CONDA_SHELL_ENV_NAME', raising=False)
+        ready_fpath = os.path.join(tmp_dir.name, 'ready')
+        out_fpath = os.path.join(tmp_dir.name, 'out')
+
+        def terminate():
+            for _ in range(100):
+                if os.path.exists(ready_fpath):
+                    break
+                time.sleep(0.05)
+            os.kill(os.getpid(), signal.SIGTERM)
+        thread = threading.Thread(target=terminate)
+        thread.start()
+
+        cli = FakeCLI(prefix_dpath)
+        run = ('sh -c \'trap "ls $CONDA_PREFIX > {}; exit 7" TERM; '
+               'touch {}; while :; do sleep 0.05; done\''
+               .format(out_fpath, ready_fpath))
+        cmd = argparse.Namespace(packages=['python=3.6'], channel=None,
+                                 name=main.rand_env_name(), run=run,
+                                 ephemeral=True, _argv=[])
+        try:
+            assert main.run_cmds_in_env([cmd], cli, ['conda-shell']) == 7
+        finally:
+            thread.join()
+        with open(out_fpath) as fp:
+            # The environment still existed when the command exited
+            assert 'conda-meta' in fp.read()
+        assert not os.path.exists(cli.created[0])
@@ -0,0 +1,88 @@
+import os
+import argparse
+
+from conda_shell import history
+from .fixtures import *
+
+
+class CountingCLI(object):
+    def __init__(self):
+        self.num_parsed = 0
+        self._parser = argparse.ArgumentParser()
+        self._parser.add_argument('-n', '--name')
+        self._parser.add_argument('-c', '--channel', action='append')
+        self._parser.add_argument('--file', action='append')
+        self._parser.add_argument('packages', nargs='*')
+
+    def parse_create_args(self, argv):
+        self.num_parsed += 1
+        return self._parser.parse_args(argv)
+
+    parse_install_args = parse_create_args
+
+
+class TestHistory(object):
+    def test_incremental_parse(self, tmp_dir):
+        """Test that parsed histories are cached, and that only the lines
+        appended since the last parse are parsed.
+        """
+        env_dpath = os.path.join(tmp_dir.name, 'env')
+        os.makedirs(os.path.join(env_dpath, 'conda-meta'))
+        hist_fpath = os.path.join(env_dpath, 'conda-meta', 'history')
+        with open(hist_fpath, 'w') as fp:
+            fp.write('==> 2017-08-01 12:34:56 <==\n'
+                     '# cmd: conda create -n env python=3.6 numpy\n')
+
+        cli = CountingCLI()
+        cmds = history.get_history_cmds(env_dpath, cli)
+        assert [cmd.packages for cmd in cmds] == [['python=3.6', 'numpy']]
+        assert cmds[0].kind == 'create'
+        assert cli.num_parsed == 1
+        cmds = history.get_history_cmds(env_dpath, cli)
+        assert [cmd.packages for cmd in cmds] == [['python=3.6', 'numpy']]
+        assert cli.num_parsed == 1
+
+        # Lines appended by `conda install`, the last one still incomplete
+        with open(hist_fpath, 'a') as fp:
+            fp.write('# cmd: conda install -n env -c conda-forge pydap\n'
+                     '# cmd: conda install -n env scipy')
+        os.utime(hist_fpath, (0, 0))
+        cmds = history.get_history_cmds(env_dpath, cli)
+        assert ([cmd.packages for cmd in cmds] ==
+                [['python=3.6', 'numpy'], ['pydap'], ['scipy']])
+        assert cmds[1].channel == ['conda-forge']
+        assert cli.num_parsed == 3
+
+        with open(hist_fpath, 'a') as fp:
+            fp.write('\n')
+        cmds = history.get_history_cmds(env_dpath, cli)
+        assert len(cmds) == 3
+        assert cli.num_parsed == 4
+
+        # A rewritten history is parsed from the start
+        os.remove(hist_fpath)
+        with open(hist_fpath, 'w') as fp:
+            fp.write('# cmd: conda create -n env python=2.7\n')
+        cmds = history.get_history_cmds(env_dpath, cli)
+        assert [cmd.packages for cmd in cmds] == [['python=2.7']]
+
+    def test_rewritten_in_place(self, tmp_dir):
+        """Test that a history which was rewritten in place, with the same
+        size, is parsed again.
+        """
+        env_dpath = os.path.join(tmp_dir.name, 'env')
+        os.makedirs(os.path.join(env_dpath, 'conda-meta'))
+        hist_fpath = os.path.join(env_dpath, 'conda-meta', 'history')
+        with open(hist_fpath, 'w') as fp:
+            fp.write('# cmd: conda create -n env python=3.6\n')
+        os.utime(hist_fpath, (0, 0))
+        cli = CountingCLI()
+        cmds = history.get_history_cmds(env_dpath, cli)
+        assert [cmd.packages for cmd in cmds] == [['python=3.6']]
+
+        inode = os.stat(hist_fpath).st_ino
+        with open(hist_fpath, 'r+') as fp:
+            fp.write('# cmd: conda create -n env python=2.7\n')
+        assert os.stat(hist_fpath).st_ino == inode
+        cmds = history.get_history_cmds(env_dpath, cli)
+        assert [cmd.packages for cmd in cmds] == [['python=2.7']]
@@ -0,0 +1,144 @@
+import os
+import time
+import argparse
+import threading
+
+import pytest
+from conda_shell import index
+from .fixtures import *
+
+
+def make_cmd(packages, channel=None):
+    return argparse.Namespace(packages=packages, channel=channel)
+
+
+class TestEnvIndex(object):
+    def test_cmds_key(self):
+        """Test that the index key only depends on packages and channels."""
+        cmd1 = make_cmd(['python=3.6', 'numpy=1.12'])
+        cmd2 = make_cmd(['pydap'], ['conda-forge'])
+        assert (index.cmds_key([cmd1, cmd2]) ==
+                index.cmds_key([make_cmd(['python=3.6', 'numpy=1.12'], []),
+                                make_cmd(['pydap'], ['conda-forge'])]))
+        assert index.cmds_key([cmd1, cmd2]) != index.cmds_key([cmd1])
+        assert (index.cmds_key([cmd1, cmd2]) !=
+                index.cmds_key([cmd1, make_cmd(['pydap'])]))
+
+    def test_lookup_rebuild_and_add(self, tmp_dir):
+        """Test that the index is rebuilt when missing or stale, and that
+        newly-added environments are found without a rebuild.
+        """
+        prefix_dpath = tmp_dir.name
+        cmds_a = [make_cmd(['python=3.6'])]
+        cmds_b = [make_cmd(['python=2.7'])]
+        env_keys = {}
+        for env_name, cmds in (('shell_a', cmds_a), ('shell_b', cmds_b)):
+            os.makedirs(os.path.join(prefix_dpath, env_name))
+            env_keys[os.path.join(prefix_dpath, env_name)] = \
+                index.cmds_key(cmds)
+        scans = []
+
+        def env_dpaths_fn():
+            scans.append(True)
+            return sorted(env_keys)
+
+        env_index = index.EnvIndex(prefix_dpath)
+        assert (env_index.lookup(cmds_a, env_dpaths_fn, env_keys.get) ==
+                os.path.join(prefix_dpath, 'shell_a'))
+        assert len(scans) == 1
+
+        env_index = index.EnvIndex(prefix_dpath)
+        assert (env_index.lookup(cmds_b, env_dpaths_fn, env_keys.get) ==
+                os.path.join(prefix_dpath, 'shell_b'))
+        assert len(scans) == 1
+
+        cmds_c = [make_cmd(['python=3.5'])]
+        os.makedirs(os.path.join(prefix_dpath, 'shell_c'))
+        env_index.add(cmds_c, 'shell_c')
+        env_index = index.EnvIndex(prefix_dpath)
+        assert (env_index.lookup(cmds_c, env_dpaths_fn, env_keys.get) ==
+                os.path.join(prefix_dpath, 'shell_c'))
+        assert len(scans) == 1
+
+        os.rmdir(os.path.join(prefix_dpath, 'shell_a'))
+        del env_keys[os.path.join(prefix_dpath, 'shell_a')]
+        env_index = index.EnvIndex(prefix_dpath)
+        assert env_index.lookup(cmds_a, env_dpaths_fn, env_keys.get) is None
+        assert len(scans) == 2
+
+    def test_concurrent_add(self, tmp_dir, monkeypatch):
+        """Test that environments added concurrently are all recorded."""
+        prefix_dpath = tmp_dir.name
+        index.EnvIndex(prefix_dpath).rebuild([], lambda env_dpath: None)
+        cmds_a = [make_cmd(['python=3.6'])]
+        cmds_b = [make_cmd(['python=2.7'])]
+        atomic_write_json = index.atomic_write_json
+        threads = []
+
+        def interleaved_write(fpath, obj):
+            if not threads:
+                # Another process adds its environment in the meantime
+                threads.append(threading.Thread(
+                    target=index.EnvIndex(prefix_dpath).add,
+                    args=(cmds_b, 'shell_b')
+                ))
+                threads[0].start()
+                time.sleep(0.2)
+            atomic_write_json(fpath, obj)
+        monkeypatch.setattr(index, 'atomic_write_json', interleaved_write)
+        index.EnvIndex(prefix_dpath).add(cmds_a, 'shell_a')
+        threads[0].join()
+
+        envs = index.EnvIndex(prefix_dpath).envs(lambda: [], lambda _: None)
+        assert envs == {index.cmds_key(cmds_a): 'shell_a',
+                        index.cmds_key(cmds_b): 'shell_b'}
+
+    def test_match_modes(self, tmp_dir):
+        """Test that environments recorded for a match mode other than
+        "exact" aren't found by exact lookups.
+        """
+        prefix_dpath = tmp_dir.name
+        os.makedirs(os.path.join(prefix_dpath, 'shell_a'))
+        index.EnvIndex(prefix_dpath).rebuild([], lambda env_dpath: None)
+        cmds = [make_cmd(['python=3.6'])]
+        assert (index.cmds_key(cmds) !=
+                index.cmds_key(cmds, match='satisfy'))
+        index.EnvIndex(prefix_dpath).add(cmds, 'shell_a', match='satisfy')
+
+        env_index = index.EnvIndex(prefix_dpath)
+        assert env_index.lookup(cmds, lambda: [], lambda _: None) is None
+        assert (env_index.lookup(cmds, lambda: [], lambda _: None,
+                                 match='satisfy') ==
+                os.path.join(prefix_dpath, 'shell_a'))
+
+    def test_modified_env(self, tmp_dir):
+        """Test that an environment which was installed into after it was
+        indexed isn't found under its old specs.
+        """
+        prefix_dpath = tmp_dir.name
+        env_dpath = os.path.join(prefix_dpath, 'shell_a')
+        hist_fpath = os.path.join(env_dpath, 'conda-meta', 'history')
+        os.makedirs(os.path.dirname(hist_fpath))
+        with open(hist_fpath, 'w') as fp:
+            fp.write('# cmd: conda create -n shell_a python=3.6\n')
+        cmds_a = [make_cmd(['python=3.6'])]
+        env_keys = {env_dpath: index.cmds_key(cmds_a)}
+
+        def env_dpaths_fn():
+            return sorted(env_keys)
+        assert (index.EnvIndex(prefix_dpath).lookup(cmds_a, env_dpaths_fn,
+                                                    env_keys.get) ==
+                env_dpath)
+
+        # `conda install` into the environment doesn't change the mtime of
+        # the environments directory
+        prefix_mtime = os.path.getmtime(prefix_dpath)
+        with open(hist_fpath, 'a') as fp:
+            fp.write('# cmd: conda install -n shell_a numpy\n')
+        cmds_b = [make_cmd(['python=3.6']), make_cmd(['numpy'])]
+        env_keys[env_dpath] = index.cmds_key(cmds_b)
+        assert os.path.getmtime(prefix_dpath) == prefix_mtime
+        env_index = index.EnvIndex(prefix_dpath)
+        assert env_index.lookup(cmds_a, env_dpaths_fn, env_keys.get) is None
+        assert (env_index.lookup(cmds_b, env_dpaths_fn, env_keys.get) ==
+                env_dpath)
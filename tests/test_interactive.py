@@ -0,0 +1,50 @@
+import os
+import subprocess
+
+import pytest
+from conda_shell import interactive
+from .fixtures import *
+
+
+class TestInteractive(object):
+    def test_shell_cmd(self, tmp_dir):
+        """Test the prompt and PATH of interactive shells."""
+        env_vars = interactive.setup_env(
+            {'PATH': '/usr/bin:/bin', 'SHELL': '/bin/sh'}, '/envs/shell_abc'
+        )
+        assert (interactive.get_shell_cmd(env_vars, '[shell_abc]: ',
+                                          tmp_dir.name) ==
+                ['/bin/sh', '-i'])
+        assert env_vars['PS1'] == '[shell_abc]: '
+        assert env_vars['CONDA_PREFIX'] == '/envs/shell_abc'
+
+        env_vars['SHELL'] = '/bin/bash'
+        shell_cmd = interactive.get_shell_cmd(env_vars, '[shell_abc]: ',
+                                              tmp_dir.name)
+        assert shell_cmd[:2] == ['/bin/bash', '--rcfile']
+        assert os.path.isfile(shell_cmd[2])
+
+    def test_bashrc(self, tmp_dir):
+        """Test that bash puts the environment first in PATH, even if the
+        user's start-up file changes PATH.
+        """
+        bash = '/bin/bash'
+        if not os.path.exists(bash):
+            pytest.skip('bash is not installed')
+        with open(os.path.join(tmp_dir.name, '.bashrc'), 'w') as fp:
+            fp.write('PATH="/user/bin:$PATH"\n')
+        env_vars = interactive.setup_env(
+            {'PATH': '/usr/bin:/bin', 'SHELL': bash, 'HOME': tmp_dir.name},
+            '/envs/shell_abc'
+        )
+        shell_cmd = interactive.get_shell_cmd(env_vars, '[shell_abc]: ',
+                                              tmp_dir.name)
+        output = subprocess.check_output(
+            shell_cmd + ['-c', 'echo "$PS1"; echo "$PATH"'], env=env_vars,
+            stdin=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True
+        )
+        lines = output.splitlines()
+        assert '[shell_abc]: ' in lines
+        assert ('/envs/shell_abc/bin:/user/bin:/envs/shell_abc/bin:/usr/bin'
+                ':/bin') in lines
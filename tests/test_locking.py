@@ -0,0 +1,55 @@
+import os
+
+import pytest
+from conda_shell import locking, main
+from .fixtures import *
+
+
+class TestLocking(object):
+    def test_file_lock(self, tmp_dir):
+        """Test that exclusive and shared locks exclude each other."""
+        fpath = os.path.join(tmp_dir.name, 'key.lock')
+        lock1 = locking.FileLock(fpath)
+        lock2 = locking.FileLock(fpath)
+        assert lock1.acquire(blocking=False)
+        assert not lock2.acquire(blocking=False)
+        lock1.release()
+        assert lock2.acquire(blocking=False)
+        lock2.release()
+
+        shared1 = locking.FileLock(fpath, shared=True)
+        shared2 = locking.FileLock(fpath, shared=True)
+        assert shared1.acquire(blocking=False)
+        assert shared2.acquire(blocking=False)
+        assert not lock1.acquire(blocking=False)
+        shared1.release()
+        shared2.release()
+        with lock1:
+            assert not lock2.acquire(blocking=False)
+
+    def test_building(self, tmp_dir):
+        """Test that environments being created are hidden from the reuse
+        scan, and stay hidden if their creation fails.
+        """
+        prefix_dpath = tmp_dir.name
+        main.DEFAULT_ENV_PREFIX = '__testme_shell_'
+        for env_name in ('__testme_shell_ok', '__testme_shell_failed'):
+            os.makedirs(os.path.join(prefix_dpath, env_name))
+
+        with locking.building(prefix_dpath, '__testme_shell_ok'):
+            env_dirs = main.get_conda_env_dirs(prefix_dpath)
+            assert ([os.path.basename(env_dir) for env_dir in env_dirs] ==
+                    ['__testme_shell_failed'])
+            assert not locking.is_building_stale(prefix_dpath,
+                                                 '__testme_shell_ok')
+        with pytest.raises(RuntimeError):
+            with locking.building(prefix_dpath, '__testme_shell_failed'):
+                raise RuntimeError()
+
+        env_dirs = main.get_conda_env_dirs(prefix_dpath)
+        assert ([os.path.basename(env_dir) for env_dir in env_dirs] ==
+                ['__testme_shell_ok'])
+        assert locking.is_building_stale(prefix_dpath,
+                                         '__testme_shell_failed')
+        assert not locking.is_building_stale(prefix_dpath,
+                                             '__testme_shell_ok')
@@ -276,6 +276,82 @@ print(f\'np.arange(10): {np.arange(10)}\')
         assert not main.env_has_pkgs(env_dpath, [cmd1], cli)
         assert not main.env_has_pkgs(env_dpath, [cmd1, cmd2, cmd3], cli)
 
+    def test_env_has_pkgs_unordered(self, tmp_dir):
+        """Test that the order of package specs within a command doesn't
+        affect environment matching.
+        """
+        env_name = '__testme_shell_0c1d0b8e4d2a4f7e9c1b6b3c8f2e5a71'
+        env_dpath = os.path.join(tmp_dir.name, env_name)
+        os.makedirs(os.path.join(env_dpath, 'conda-meta'))
+        hist_fpath = os.path.join(env_dpath, 'conda-meta', 'history')
+        with open(hist_fpath, 'w') as fp:
+            fp.write('''==> ABCD-EF-GH 12:34:56 <==
+# cmd: conda create -n {0} numpy=1.13 python=3.6
+'''.format(env_name))
+
+        import argparse
+        cli = conda_cli.CondaShellCLI()
+        cmd = mock.Mock(spec=argparse.Namespace, channel=None, packages=['python=3.6', 'numpy=1.13'], _argv=['conda-shell', 'python=3.6', 'numpy=1.13'])
+        assert main.env_has_pkgs(env_dpath, [cmd], cli)
+
+    def test_merge_cmds(self):
+        """Test that the commands from several shebang lines are merged into
+        a single command, unless they disagree on other arguments.
+        """
+        import argparse
+        cmd1 = argparse.Namespace(packages=['python=3.6', 'numpy=1.12'],
+                                  channel=None, name='env', yes=True,
+                                  override_channels=False,
+                                  _argv=['-i', 'python', 'python=3.6',
+                                         'numpy=1.12'])
+        cmd2 = argparse.Namespace(packages=['pandas', 'pydap'],
+                                  channel=['conda-forge'], name='env',
+                                  yes=True, override_channels=False,
+                                  _argv=['-c', 'conda-forge', 'pandas',
+                                         'pydap'])
+        merged = main.merge_cmds([cmd1, cmd2])
+        assert len(merged) == 1
+        assert merged[0].packages == ['python=3.6', 'numpy=1.12', 'pandas',
+                                      'pydap']
+        assert merged[0].channel == ['conda-forge']
+        assert merged[0]._argv == ['-i', 'python', 'python=3.6', 'numpy=1.12',
+                                   '-c', 'conda-forge', 'pandas', 'pydap']
+        assert cmd1.packages == ['python=3.6', 'numpy=1.12']
+        assert main.cmds_key(merged) == main.cmds_key([cmd1, cmd2])
+
+        cmd2.override_channels = True
+        assert main.merge_cmds([cmd1, cmd2]) == [cmd1, cmd2]
+
+    def test_load_lock_cmds(self, tmp_dir):
+        """Test that --from-lock replaces package specs with the explicit
+        package list, which then identifies the environment.
+        """
+        import argparse
+        lock_fpath = os.path.join(tmp_dir.name, 'script.lock')
+        with open(lock_fpath, 'w') as fp:
+            fp.write('@EXPLICIT\nhttps://repo/linux-64/zlib.tar.bz2#aaa\n')
+
+        def cmd(packages, from_lock=None):
+            return argparse.Namespace(packages=packages, channel=None,
+                                      from_lock=from_lock, _argv=packages)
+
+        cmds = [cmd(['python=3.6'])]
+        assert main.load_lock_cmds(cmds, tmp_dir.name) is cmds
+
+        lock_cmds = main.load_lock_cmds([cmd([], 'script.lock')],
+                                        tmp_dir.name)
+        assert len(lock_cmds) == 1
+        assert lock_cmds[0].lock_specs == [
+            'https://repo/linux-64/zlib.tar.bz2#aaa'
+        ]
+        assert lock_cmds[0].file == [lock_fpath]
+        assert lock_cmds[0]._argv == ['--file', lock_fpath]
+        assert main.cmds_key(lock_cmds) != main.cmds_key([cmd([])])
+
+        with pytest.raises(conda_cli.CondaShellArgumentError):
+            main.load_lock_cmds([cmd(['python=3.6'], 'script.lock')],
+                                tmp_dir.name)
+
     def test_env_reuse(self, remove_shell_envs):
         """Test that conda-shell reuses environments that already satisfy
         package dependencies.
@@ -373,3 +449,26 @@ import numpy as np
 
         # env reuse should save us at least 5 seconds
         assert first_tdiff - second_tdiff > 5
+
+    def test_run_exit_status(self, tmp_dir, monkeypatch):
+        """Test that the exit status of the --run command is returned, and
+        that it is preserved when the command replaces the process.
+        """
+        import argparse
+        monkeypatch.delenv('CONDA_SHELL_ENV_NAME', raising=False)
+        env_dpath = os.path.join(tmp_dir.name, '__testme_shell_exec')
+        os.makedirs(os.path.join(env_dpath, 'bin'))
+        cli = mock.Mock(prefix_dpath=tmp_dir.name)
+        cmd = argparse.Namespace(run='sh -c "exit 3"', _argv=[])
+        assert main.run_cmds_in_env([cmd], cli, ['conda-shell'],
+                                    env_dpath=env_dpath) == 3
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                main.run_cmds_in_env([cmd], cli, ['conda-shell'],
+                                     env_dpath=env_dpath, exec_run=True)
+            finally:
+                os._exit(1)
+        _, status = os.waitpid(pid, 0)
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 3
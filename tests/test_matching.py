@@ -0,0 +1,109 @@
+import os
+import json
+import argparse
+
+import pytest
+from conda_shell import matching
+from .fixtures import *
+
+
+class FakeMatchSpec(object):
+    def __init__(self, spec):
+        parts = spec.split('=')
+        self.name = parts[0]
+        self.version = parts[1] if len(parts) > 1 else None
+
+    def match(self, record):
+        return (record['name'] == self.name and
+                (self.version is None or
+                 record['version'].startswith(self.version)))
+
+
+class FakeCLI(object):
+    def match_spec(self, spec):
+        return FakeMatchSpec(spec)
+
+    def channel_name(self, channel):
+        # e.g. https://conda.anaconda.org/conda-forge/linux-64 -> conda-forge,
+        # https://repo.anaconda.com/pkgs/main/linux-64 -> pkgs/main
+        if '://' not in channel:
+            return channel
+        return '/'.join(channel.split('/')[3:-1])
+
+    def default_channel_names(self):
+        return set(['defaults', 'pkgs/main', 'pkgs/r'])
+
+
+def make_env(prefix_dpath, env_name, records):
+    conda_meta_dpath = os.path.join(prefix_dpath, env_name, 'conda-meta')
+    os.makedirs(conda_meta_dpath)
+    for record in records:
+        rec_fname = '{name}-{version}-0.json'.format(**record)
+        with open(os.path.join(conda_meta_dpath, rec_fname), 'w') as fp:
+            json.dump(record, fp)
+    return os.path.dirname(conda_meta_dpath)
+
+
+class TestMatching(object):
+    def test_get_requested_specs(self):
+        """Test that specs and channels of several commands are merged."""
+        cmds = [argparse.Namespace(packages=['python=3.6', 'numpy'],
+                                   channel=None),
+                argparse.Namespace(packages=['pydap'],
+                                   channel=['conda-forge', 'chan1']),
+                argparse.Namespace(packages=['pandas'],
+                                   channel=['chan1'])]
+        assert (matching.get_requested_specs(cmds) ==
+                (['python=3.6', 'numpy', 'pydap', 'pandas'],
+                 ['conda-forge', 'chan1']))
+
+    def test_env_satisfies(self, tmp_dir):
+        """Test that environments are matched by their installed packages,
+        regardless of the order of the requested specs.
+        """
+        env_dpath = make_env(tmp_dir.name, 'shell_a', [
+            {'name': 'python', 'version': '3.6.2', 'channel': 'defaults'},
+            {'name': 'numpy', 'version': '1.13.1', 'channel': 'defaults'},
+            {'name': 'pydap', 'version': '3.2.2',
+             'channel': 'https://conda.anaconda.org/conda-forge/linux-64'},
+        ])
+        cli = FakeCLI()
+
+        def cmd(packages, channel=None):
+            return argparse.Namespace(packages=packages, channel=channel)
+
+        assert matching.env_satisfies(
+            env_dpath, [cmd(['numpy=1.13', 'python=3.6'])], cli
+        )
+        assert matching.env_satisfies(env_dpath, [cmd(['numpy'])], cli)
+        assert matching.env_satisfies(
+            env_dpath, [cmd(['python=3.6']), cmd(['pydap'], ['conda-forge'])],
+            cli
+        )
+        assert not matching.env_satisfies(
+            env_dpath, [cmd(['numpy=1.12', 'python=3.6'])], cli
+        )
+        assert not matching.env_satisfies(
+            env_dpath, [cmd(['pydap'], ['chan1'])], cli
+        )
+        assert not matching.env_satisfies(
+            os.path.join(tmp_dir.name, 'missing'), [cmd(['numpy'])], cli
+        )
+
+    def test_env_satisfies_default_channels(self, tmp_dir):
+        """Test that packages from the default channels are accepted along
+        with the requested channels, whatever name they are recorded under.
+        """
+        env_dpath = make_env(tmp_dir.name, 'shell_a', [
+            {'name': 'python', 'version': '3.6.2', 'channel': 'pkgs/main'},
+            {'name': 'numpy', 'version': '1.13.1',
+             'channel': 'https://repo.anaconda.com/pkgs/main/linux-64'},
+            {'name': 'pydap', 'version': '3.2.2', 'channel': 'chan2'},
+        ])
+        cli = FakeCLI()
+        cmds = [argparse.Namespace(packages=['python=3.6', 'numpy'],
+                                   channel=['conda-forge'])]
+        assert matching.env_satisfies(env_dpath, cmds, cli)
+        cmds = [argparse.Namespace(packages=['pydap'],
+                                   channel=['conda-forge'])]
+        assert not matching.env_satisfies(env_dpath, cmds, cli)
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+from conda_shell import pool
+from .fixtures import *
+
+
+def make_pool_env(prefix_dpath, base):
+    conda_meta_dpath = os.path.join(prefix_dpath, pool.pool_env_name(base),
+                                    'conda-meta')
+    os.makedirs(conda_meta_dpath)
+    with open(os.path.join(conda_meta_dpath, 'history'), 'w') as fp:
+        fp.write('# cmd: conda create ' + ' '.join(base['packages']) + '\n')
+
+
+class TestPool(object):
+    def test_find_pool_base(self, tmp_dir):
+        """Test that the largest existing base which is a subset of the
+        request, on the same channels, is picked.
+        """
+        prefix_dpath = tmp_dir.name
+        small = pool.make_base(['python=3.6'], None)
+        large = pool.make_base(['python=3.6', 'numpy', 'pandas'], None)
+        forge = pool.make_base(['python=3.6', 'numpy', 'pandas', 'scipy'],
+                               ['conda-forge'])
+        missing = pool.make_base(['python=3.6', 'numpy', 'pandas', 'dask'],
+                                 None)
+        pool.save_pool(prefix_dpath, [small, large, forge, missing])
+        for base in (small, large, forge):
+            make_pool_env(prefix_dpath, base)
+
+        assert pool.find_pool_base(['python=3.6', 'numpy', 'pandas', 'dask'],
+                                   None, prefix_dpath) == large
+        assert pool.find_pool_base(['python=3.6', 'bzip2'], [],
+                                   prefix_dpath) == small
+        assert pool.find_pool_base(['numpy', 'pandas', 'python=3.6', 'scipy'],
+                                   ['conda-forge'], prefix_dpath) == forge
+        assert pool.find_pool_base(['python=2.7'], None, prefix_dpath) is None
+
+        pool.remove_pool_env(prefix_dpath, large)
+        assert pool.find_pool_base(['python=3.6', 'numpy', 'pandas'], None,
+                                   prefix_dpath) == small
+
+    def test_ensure_history_cmd(self, tmp_dir):
+        """Test that a create command is recorded only when it is missing."""
+        env_dpath = os.path.join(tmp_dir.name, 'env')
+        os.makedirs(os.path.join(env_dpath, 'conda-meta'))
+        pool.ensure_history_cmd(env_dpath, ['-n', 'env', 'python=3.6'])
+        pool.ensure_history_cmd(env_dpath, ['-n', 'env', 'python=2.7'])
+        with open(os.path.join(env_dpath, 'conda-meta', 'history')) as fp:
+            assert fp.read() == '# cmd: conda create -n env python=3.6\n'
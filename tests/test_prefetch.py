@@ -0,0 +1,110 @@
+import os
+import time
+import socket
+import hashlib
+
+from conda_shell import light_cli, main, prefetch
+from .fixtures import *
+from .test_daemon import FakeCLI
+
+
+def make_channel(channel_dpath, fnames):
+    """Write fake package tarballs to channel_dpath, and return the explicit
+    spec ("file://<path>#<md5>") of each.
+    """
+    subdir_dpath = os.path.join(channel_dpath, 'linux-64')
+    os.makedirs(subdir_dpath)
+    specs = []
+    for fname in fnames:
+        data = ('contents of ' + fname).encode('utf-8')
+        with open(os.path.join(subdir_dpath, fname), 'wb') as fp:
+            fp.write(data)
+        specs.append('file://{}#{}'.format(os.path.join(subdir_dpath, fname),
+                                           hashlib.md5(data).hexdigest()))
+    return specs
+
+
+class FakeSolveCLI(FakeCLI):
+    def __init__(self, solutions):
+        super(FakeSolveCLI, self).__init__()
+        self.solutions = solutions
+
+    def solve(self, args):
+        return self.solutions[tuple(args.packages)]
+
+
+class TestPrefetch(object):
+    def test_prefetch(self, tmp_dir, monkeypatch):
+        """Test that the packages of scripts and spec files are downloaded
+        from a local channel, once each.
+        """
+        main.DEFAULT_ENV_PREFIX = '__testme_shell_'
+        os.makedirs(os.path.join(tmp_dir.name, 'envs'))
+        monkeypatch.setattr(light_cli, 'get_conda_install_dpath',
+                            lambda: tmp_dir.name)
+        for key in list(os.environ):
+            if key.startswith('CONDA_SHELL_') or key == 'CONDA_ENVS_PATH':
+                monkeypatch.delenv(key)
+        specs = make_channel(os.path.join(tmp_dir.name, 'channel'),
+                             ['a-1.0-0.tar.bz2', 'b-1.0-0.tar.bz2',
+                              'c-1.0-0.tar.bz2'])
+        with open(os.path.join(tmp_dir.name, 'a.lock'), 'w') as fp:
+            fp.write('@EXPLICIT\n{}\n{}\n'.format(specs[0], specs[1]))
+        with open(os.path.join(tmp_dir.name, 'a.sh'), 'w') as fp:
+            fp.write('#!conda-shell -i sh --from-lock a.lock\necho a\n')
+        with open(os.path.join(tmp_dir.name, 'c.sh'), 'w') as fp:
+            fp.write('#!conda-shell -i sh c\necho c\n')
+        with open(os.path.join(tmp_dir.name, 'b.txt'), 'w') as fp:
+            fp.write('@EXPLICIT\n{}\n'.format(specs[1]))
+        pkgs_dpath = os.path.join(tmp_dir.name, 'pkgs')
+        paths = [os.path.join(tmp_dir.name, fname)
+                 for fname in ('a.sh', 'c.sh', 'b.txt')]
+        cli = FakeCLI()
+        conda_cli = FakeSolveCLI({('c',): [specs[2]]})
+
+        fetched, errors = prefetch.prefetch(paths, cli, lambda: conda_cli,
+                                            pkgs_dpath=pkgs_dpath,
+                                            n_workers=2)
+        assert errors == {}
+        assert list(fetched.values()) == ['downloaded'] * 3
+        assert (sorted(fname for fname in os.listdir(pkgs_dpath)) ==
+                ['a-1.0-0.tar.bz2', 'b-1.0-0.tar.bz2', 'c-1.0-0.tar.bz2',
+                 'urls.txt'])
+        with open(os.path.join(pkgs_dpath, 'urls.txt')) as fp:
+            assert sorted(fp.read().splitlines()) == sorted(
+                prefetch.split_spec(spec)[0] for spec in specs
+            )
+
+        # Packages are only downloaded once
+        fetched, errors = prefetch.prefetch(paths, cli, lambda: conda_cli,
+                                            pkgs_dpath=pkgs_dpath)
+        assert list(fetched.values()) == ['cached'] * 3
+
+    def test_checksum_mismatch(self, tmp_dir):
+        """Test that packages whose checksum doesn't match are rejected."""
+        spec, = make_channel(os.path.join(tmp_dir.name, 'channel'),
+                             ['a-1.0-0.tar.bz2'])
+        url, _ = prefetch.split_spec(spec)
+        pkgs_dpath = os.path.join(tmp_dir.name, 'pkgs')
+        fetched = prefetch.fetch_specs([url + '#' + '0' * 32], pkgs_dpath)
+        assert 'Checksum mismatch' in fetched[url]
+        assert os.listdir(pkgs_dpath) == []
+
+    def test_download_timeout(self, tmp_dir, monkeypatch):
+        """Test that stalled downloads are reported as errors."""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        url = 'http://127.0.0.1:{}/linux-64/a-1.0-0.tar.bz2'.format(
+            listener.getsockname()[1]
+        )
+        monkeypatch.setenv('CONDA_SHELL_DOWNLOAD_TIMEOUT', '0.5')
+        pkgs_dpath = os.path.join(tmp_dir.name, 'pkgs')
+        start = time.time()
+        try:
+            fetched = prefetch.fetch_specs([url], pkgs_dpath)
+        finally:
+            listener.close()
+        assert time.time() - start < 5
+        assert fetched[url].startswith('Timed out downloading')
+        assert os.listdir(pkgs_dpath) == []
@@ -0,0 +1,65 @@
+import os
+import json
+import threading
+
+from conda_shell import profiling
+from .fixtures import *
+
+
+@profiling.profiled('double')
+def double(value):
+    return value * 2
+
+
+class TestProfiling(object):
+    def test_get_profile_fpath(self, monkeypatch):
+        """Test that --profile takes precedence over $CONDA_SHELL_PROFILE."""
+        monkeypatch.delenv('CONDA_SHELL_PROFILE', raising=False)
+        assert profiling.get_profile_fpath(['python=3.6']) is None
+        assert profiling.get_profile_fpath(
+            ['python=3.6', '--profile', 'a.json']
+        ) == 'a.json'
+        assert profiling.get_profile_fpath(['--profile=b.json']) == 'b.json'
+        monkeypatch.setenv('CONDA_SHELL_PROFILE', 'c.json')
+        assert profiling.get_profile_fpath(['python=3.6']) == 'c.json'
+
+    def test_disabled(self):
+        """Test that spans are no-ops when profiling is disabled."""
+        assert not profiling.is_profiling()
+        with profiling.span('nothing'):
+            pass
+        assert double(2) == 4
+        profiling.finish_profiling()
+
+    def test_trace(self, tmp_dir, capsys):
+        """Test that spans are written as a Chrome trace, and that top-level
+        spans of the main thread are summarized.
+        """
+        trace_fpath = os.path.join(tmp_dir.name, 'trace.json')
+        profiling.start_profiling(trace_fpath)
+        try:
+            with profiling.span('outer', step=1):
+                assert double(3) == 6
+            thread = threading.Thread(target=double, args=(1,))
+            thread.start()
+            thread.join()
+            assert double(4) == 8
+        finally:
+            profiling.finish_profiling()
+        assert not profiling.is_profiling()
+
+        with open(trace_fpath) as fp:
+            events = json.load(fp)['traceEvents']
+        assert ([event['name'] for event in events] ==
+                ['double', 'outer', 'double', 'double'])
+        assert all(event['ph'] == 'X' and event['dur'] >= 0
+                   for event in events)
+        assert events[1]['args'] == {'step': 1}
+        assert events[0]['ts'] >= events[1]['ts']
+
+        summary = capsys.readouterr().err.strip().splitlines()
+        assert len(summary) == 1
+        assert summary[0].startswith('conda-shell profile: ')
+        assert ': outer ' in summary[0]
+        assert summary[0].count('double') == 1
+        assert summary[0].endswith('(trace: {})'.format(trace_fpath))
@@ -0,0 +1,62 @@
+import os
+import time
+import threading
+
+from conda_shell import main, scan
+from .fixtures import *
+
+
+class TestScan(object):
+    def test_parallel_map(self, tmp_dir):
+        """Test that results come back in the order of the items."""
+        def slow_square(num):
+            time.sleep(0.01 * (5 - num))
+            return num * num
+
+        assert scan.parallel_map(slow_square, range(5)) == [0, 1, 4, 9, 16]
+        assert (scan.parallel_map(slow_square, range(5), max_workers=1) ==
+                [0, 1, 4, 9, 16])
+
+        open(os.path.join(tmp_dir.name, 'a'), 'w').close()
+        assert (scan.list_dir(tmp_dir.name) ==
+                [('a', os.path.join(tmp_dir.name, 'a'))])
+
+    def test_find_first(self):
+        """Test that the first matching item (in order) wins, even if a later
+        one finishes first, and that the scan stops early.
+        """
+        evaluated = []
+        lock = threading.Lock()
+
+        def is_even(num):
+            with lock:
+                evaluated.append(num)
+            if num == 4:
+                time.sleep(0.05)
+            return num >= 4 and num % 2 == 0
+
+        assert scan.find_first(is_even, range(100), max_workers=4) == 4
+        assert len(evaluated) < 100
+        assert scan.find_first(is_even, range(100), max_workers=1) == 4
+        assert scan.find_first(is_even, [1, 3], max_workers=4) is None
+
+    def test_get_conda_env_dirs_removed(self, tmp_dir, monkeypatch):
+        """Test that environments removed while they are listed are left out,
+        and that the others are still ordered by modification time.
+        """
+        main.DEFAULT_ENV_PREFIX = '__testme_shell_'
+        for i, env_name in enumerate(('__testme_shell_a', '__testme_shell_b',
+                                      '__testme_shell_c')):
+            env_dpath = os.path.join(tmp_dir.name, env_name)
+            os.makedirs(env_dpath)
+            os.utime(env_dpath, (1000 + i, 1000 + i))
+        getmtime = os.path.getmtime
+
+        def removed_getmtime(path):
+            if os.path.basename(path) == '__testme_shell_b':
+                raise OSError(2, 'No such file or directory')
+            return getmtime(path)
+        monkeypatch.setattr(os.path, 'getmtime', removed_getmtime)
+        env_dirs = main.get_conda_env_dirs(tmp_dir.name)
+        assert ([os.path.basename(env_dir) for env_dir in env_dirs] ==
+                ['__testme_shell_c', '__testme_shell_a'])
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+from conda_shell import light_cli, main, script_cache
+from .fixtures import *
+
+
+SCRIPT = '''#!/usr/bin/env conda-shell
+#!conda-shell -i python python=3.6
+#!conda-shell -c conda-forge numpy
+import sys
+#!conda-shell pandas
+'''
+
+
+@pytest.fixture
+def light_cli_obj(tmp_dir, monkeypatch):
+    """Return a LightShellCLI of a fake conda installation in tmp_dir."""
+    monkeypatch.setattr(light_cli, 'get_conda_install_dpath',
+                        lambda: tmp_dir.name)
+    for key in list(os.environ):
+        if key.startswith('CONDA_SHELL_') or key == 'CONDA_ENVS_PATH':
+            monkeypatch.delenv(key)
+    os.makedirs(os.path.join(tmp_dir.name, 'envs'))
+    return light_cli.LightShellCLI()
+
+
+class TestScriptCache(object):
+    def test_parse_script_cmds(self, tmp_dir, light_cli_obj, monkeypatch):
+        """Test that only the header of scripts is parsed, and that unchanged
+        scripts are not parsed again.
+        """
+        cli = light_cli_obj
+        script_fpath = os.path.join(tmp_dir.name, 'script.py')
+        with open(script_fpath, 'w') as fp:
+            fp.write(SCRIPT)
+        cmds = main.parse_script_cmds(script_fpath, cli)
+        assert [cmd.packages for cmd in cmds] == [['python=3.6'], ['numpy']]
+        assert cmds[1].channel == ['conda-forge']
+        assert all(cmd.run == 'python ' + script_fpath for cmd in cmds)
+
+        def parse_shell_args(argv):
+            raise AssertionError('The script was parsed again')
+        monkeypatch.setattr(cli, 'parse_shell_args', parse_shell_args)
+        cached_cmds = main.parse_script_cmds(script_fpath, cli)
+        assert ([vars(cmd) for cmd in cached_cmds] ==
+                [dict(vars(cmd), name=cached_cmds[0].name) for cmd in cmds])
+        # Every run gets a new environment name
+        assert cached_cmds[0].name != cmds[0].name
+        assert cached_cmds[1].name == cached_cmds[0].name
+
+        # Modified scripts are parsed again
+        with open(script_fpath, 'a') as fp:
+            fp.write('print(sys.argv)\n')
+        with pytest.raises(AssertionError):
+            main.parse_script_cmds(script_fpath, cli)
+
+    def test_read_header(self, tmp_dir):
+        """Test that scripts are read up to the end of their header."""
+        script_fpath = os.path.join(tmp_dir.name, 'script.py')
+        with open(script_fpath, 'w') as fp:
+            fp.write(SCRIPT)
+        fstat, header = script_cache.read_header(script_fpath)
+        assert fstat.st_size == len(SCRIPT)
+        assert header == SCRIPT.splitlines(True)[:3]
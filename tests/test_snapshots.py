@@ -0,0 +1,93 @@
+import os
+import time
+import socket
+
+import pytest
+from conda_shell import snapshots
+from .fixtures import *
+
+
+def make_env(env_dpath):
+    os.makedirs(os.path.join(env_dpath, 'bin'))
+    os.makedirs(os.path.join(env_dpath, 'conda-meta'))
+    with open(os.path.join(env_dpath, 'bin', 'script'), 'w') as fp:
+        fp.write('#!{}/bin/python\n'.format(env_dpath))
+    with open(os.path.join(env_dpath, 'bin', 'binary'), 'wb') as fp:
+        fp.write(b'\x7fELF\0' + env_dpath.encode('utf-8') + b'/lib\0end')
+    os.symlink(os.path.join(env_dpath, 'bin', 'script'),
+               os.path.join(env_dpath, 'bin', 'link'))
+    with open(os.path.join(env_dpath, 'conda-meta', 'history'), 'w') as fp:
+        fp.write('# cmd: conda create -n env python=3.6\n')
+
+
+class TestSnapshots(object):
+    def test_pack_and_restore(self, tmp_dir):
+        """Test that a restored snapshot refers to its new prefix."""
+        env_dpath = os.path.join(tmp_dir.name, 'envs', 'shell_aaaa')
+        make_env(env_dpath)
+        snapshot_dpath = os.path.join(tmp_dir.name, 'snapshots')
+        os.makedirs(snapshot_dpath)
+        snapshot_fpath = snapshots.pack_env(env_dpath, 'key', snapshot_dpath)
+        assert os.path.basename(snapshot_fpath).startswith('key-')
+
+        new_dpath = os.path.join(tmp_dir.name, 'envs', 'shell_bb')
+        snapshots.restore_env(snapshot_fpath, new_dpath)
+        with open(os.path.join(new_dpath, 'bin', 'script')) as fp:
+            assert fp.read() == '#!{}/bin/python\n'.format(new_dpath)
+        with open(os.path.join(new_dpath, 'bin', 'binary'), 'rb') as fp:
+            assert fp.read() == (b'\x7fELF\0' + new_dpath.encode('utf-8') +
+                                 b'/lib\0\0\0end')
+        assert (os.readlink(os.path.join(new_dpath, 'bin', 'link')) ==
+                os.path.join(new_dpath, 'bin', 'script'))
+        assert os.path.isfile(os.path.join(new_dpath, 'conda-meta',
+                                           'history'))
+
+        # Binary files can't take a longer prefix
+        long_dpath = os.path.join(tmp_dir.name, 'envs', 'shell_cccccccc')
+        with pytest.raises(ValueError):
+            snapshots.restore_env(snapshot_fpath, long_dpath)
+        assert not os.path.exists(long_dpath)
+
+    def test_fetch_snapshot(self, tmp_dir, monkeypatch):
+        """Test that snapshots are found locally, then on the mirror."""
+        snapshot_dpath = os.path.join(tmp_dir.name, 'snapshots')
+        mirror_dpath = os.path.join(tmp_dir.name, 'mirror')
+        for dpath in (snapshot_dpath, mirror_dpath):
+            os.makedirs(dpath)
+        name = snapshots.snapshot_name('key', 'linux-64')
+        with open(os.path.join(mirror_dpath, name), 'w') as fp:
+            fp.write('mirrored')
+        monkeypatch.setenv('CONDA_SHELL_SNAPSHOT_DIR', snapshot_dpath)
+        monkeypatch.setenv('CONDA_SHELL_SNAPSHOT_MIRROR',
+                           'file://' + mirror_dpath)
+
+        with snapshots.fetch_snapshot('key', 'linux-64') as snapshot_fpath:
+            with open(snapshot_fpath) as fp:
+                assert fp.read() == 'mirrored'
+        assert not os.path.exists(snapshot_fpath)
+        with snapshots.fetch_snapshot('other', 'linux-64') as snapshot_fpath:
+            assert snapshot_fpath is None
+
+        with open(os.path.join(snapshot_dpath, name), 'w') as fp:
+            fp.write('local')
+        with snapshots.fetch_snapshot('key', 'linux-64') as snapshot_fpath:
+            assert snapshot_fpath == os.path.join(snapshot_dpath, name)
+
+    def test_fetch_snapshot_timeout(self, tmp_dir, monkeypatch):
+        """Test that a mirror which doesn't respond is given up on."""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        monkeypatch.delenv('CONDA_SHELL_SNAPSHOT_DIR', raising=False)
+        monkeypatch.setenv('CONDA_SHELL_SNAPSHOT_MIRROR',
+                           'http://127.0.0.1:{}'.format(
+                               listener.getsockname()[1]
+                           ))
+        monkeypatch.setenv('CONDA_SHELL_SNAPSHOT_TIMEOUT', '0.5')
+        start = time.time()
+        try:
+            with snapshots.fetch_snapshot('key', 'linux-64') as snapshot_fpath:
+                assert snapshot_fpath is None
+        finally:
+            listener.close()
+        assert time.time() - start < 5
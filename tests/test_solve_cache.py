@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import time
+import types
+import argparse
+
+import pytest
+import six
+from conda_shell import conda_cli, explicit, solve_cache
+from .fixtures import *
+
+if six.PY2:
+    import mock
+else:
+    from unittest import mock
+
+
+class TestSolveCache(object):
+    def test_explicit_specs(self, tmp_dir):
+        """Test that explicit specs are derived from conda-meta records and
+        survive a round-trip through an explicit file.
+        """
+        conda_meta_dpath = os.path.join(tmp_dir.name, 'env', 'conda-meta')
+        os.makedirs(conda_meta_dpath)
+        for name, md5 in (('zlib', 'aaa'), ('python', 'bbb')):
+            with open(os.path.join(conda_meta_dpath, name+'.json'), 'w') as fp:
+                json.dump({'name': name, 'md5': md5,
+                           'url': 'https://repo/linux-64/'+name+'.tar.bz2'},
+                          fp)
+        specs = explicit.get_explicit_specs(os.path.dirname(conda_meta_dpath))
+        assert specs == ['https://repo/linux-64/python.tar.bz2#bbb',
+                         'https://repo/linux-64/zlib.tar.bz2#aaa']
+
+        explicit_fpath = os.path.join(tmp_dir.name, 'explicit.txt')
+        explicit.write_explicit_file(explicit_fpath, specs,
+                                     platform='linux-64')
+        assert explicit.read_explicit_file(explicit_fpath) == specs
+        with pytest.raises(ValueError):
+            explicit.read_explicit_file(
+                os.path.join(conda_meta_dpath, 'zlib.json')
+            )
+
+    def test_lookup_store_evict(self, tmp_dir):
+        """Test that solutions are stored, found, and evicted in LRU order."""
+        cache = solve_cache.SolveCache(tmp_dir.name, max_entries=2)
+        keys = [cache.key(['python=3.6'], None, False, 'linux-64', 'fp'+str(i))
+                for i in range(3)]
+        assert len(set(keys)) == 3
+        assert (cache.key(['numpy', 'python=3.6'], ['c1'], False, 'linux-64',
+                          'fp') ==
+                cache.key(['python=3.6', 'numpy'], ['c1'], False, 'linux-64',
+                          'fp'))
+        assert cache.lookup(keys[0]) is None
+
+        cache.store(keys[0], ['url0'])
+        cache.store(keys[1], ['url1'])
+        past = time.time() - 100
+        os.utime(cache.lookup(keys[1]), (past, past))
+        assert explicit.read_explicit_file(cache.lookup(keys[0])) == ['url0']
+        cache.store(keys[2], ['url2'])
+        assert cache.lookup(keys[1]) is None
+        assert cache.lookup(keys[0]) is not None
+        assert cache.lookup(keys[2]) is not None
+
+    def test_repodata_fingerprint(self, tmp_dir):
+        """Test that the fingerprint changes with conda's repodata cache."""
+        cache_dpath = os.path.join(tmp_dir.name, 'pkgs', 'cache')
+        os.makedirs(cache_dpath)
+        pkgs_dpaths = [os.path.dirname(cache_dpath)]
+        fingerprint = solve_cache.repodata_fingerprint(pkgs_dpaths)
+        with open(os.path.join(cache_dpath, 'abc.json'), 'w') as fp:
+            fp.write('{}')
+        assert solve_cache.repodata_fingerprint(pkgs_dpaths) != fingerprint
+
+    def test_solve_refreshes_repodata(self, tmp_dir, monkeypatch):
+        """Test that solutions are found again when solving refreshed conda's
+        repodata cache.
+        """
+        cache_dpath = os.path.join(tmp_dir.name, 'pkgs', 'cache')
+        os.makedirs(cache_dpath)
+        solves = []
+
+        class Record(object):
+            name = 'python'
+            url = 'https://repo/linux-64/python.tar.bz2'
+            md5 = 'bbb'
+
+        class Solver(object):
+            def __init__(self, prefix, channels, subdirs, specs_to_add):
+                pass
+
+            def solve_final_state(self):
+                solves.append(True)
+                with open(os.path.join(cache_dpath,
+                                       'r{}.json'.format(len(solves))),
+                          'w') as fp:
+                    fp.write('{}')
+                return [Record()]
+        solve_mod = types.ModuleType(str('conda.core.solve'))
+        solve_mod.Solver = Solver
+        monkeypatch.setitem(sys.modules, 'conda.core.solve', solve_mod)
+
+        class Context(object):
+            pkgs_dirs = [os.path.dirname(cache_dpath)]
+            subdir = 'linux-64'
+            channels = ['defaults']
+
+            def __init__(self, **kwargs):
+                pass
+        cli = object.__new__(conda_cli.CondaCLI)
+        cli.prefix_dpath = tmp_dir.name
+        cli._main_mod = object()
+        cli._create_parser = cli._conda_create_parser = object()
+        cli._base_mod = mock.Mock()
+        cli._base_mod.context.context = Context()
+        args = argparse.Namespace(name='shell_abc', packages=['python=3.6'],
+                                  channel=None, override_channels=False)
+        specs = ['https://repo/linux-64/python.tar.bz2#bbb']
+        assert cli.solve(args) == specs
+        assert cli.solve(args) == specs
+        assert len(solves) == 1
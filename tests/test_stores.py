@@ -0,0 +1,59 @@
+import os
+import argparse
+
+from conda_shell import stores, main
+from .fixtures import *
+
+
+class FakeCLI(object):
+    def __init__(self, store_dpaths):
+        self.prefix_dpath = store_dpaths[0]
+        self.store_dpaths = store_dpaths
+        self._parser = argparse.ArgumentParser()
+        self._parser.add_argument('-n', '--name')
+        self._parser.add_argument('-c', '--channel', action='append')
+        self._parser.add_argument('packages', nargs='*')
+
+    def parse_create_args(self, argv):
+        return self._parser.parse_args(argv)
+
+    parse_install_args = parse_create_args
+
+
+class TestStores(object):
+    def test_get_store_dpaths(self, tmp_dir, monkeypatch):
+        """Test the order of environment stores."""
+        local_dpath = os.path.join(tmp_dir.name, 'local')
+        shared_dpath = os.path.join(tmp_dir.name, 'shared')
+        conda_dpath = os.path.join(tmp_dir.name, 'conda')
+        for dpath in (shared_dpath, conda_dpath):
+            os.makedirs(dpath)
+        monkeypatch.setenv('CONDA_SHELL_LOCAL_STORE', local_dpath)
+        monkeypatch.setenv('CONDA_SHELL_SHARED_STORE',
+                           shared_dpath + os.pathsep + '/does/not/exist')
+        monkeypatch.setenv('CONDA_ENVS_PATH', conda_dpath)
+
+        local_dpath = stores.get_local_store_dpath('/default/envs')
+        assert local_dpath == os.path.join(tmp_dir.name, 'local')
+        assert (stores.get_store_dpaths(local_dpath) ==
+                [local_dpath, conda_dpath, shared_dpath])
+
+    def test_find_env_in_shared_store(self, tmp_dir):
+        """Test that an environment in a shared store is reused when the
+        local store has none.
+        """
+        main.DEFAULT_ENV_PREFIX = '__testme_shell_'
+        local_dpath = os.path.join(tmp_dir.name, 'local')
+        shared_dpath = os.path.join(tmp_dir.name, 'shared')
+        env_dpath = os.path.join(shared_dpath, '__testme_shell_a')
+        os.makedirs(local_dpath)
+        os.makedirs(os.path.join(env_dpath, 'conda-meta'))
+        with open(os.path.join(env_dpath, 'conda-meta', 'history'),
+                  'w') as fp:
+            fp.write('# cmd: conda create -n __testme_shell_a python=3.6\n')
+
+        cli = FakeCLI([local_dpath, shared_dpath])
+        cmd = argparse.Namespace(packages=['python=3.6'], channel=None)
+        assert main.find_env([cmd], cli) == env_dpath
+        cmd.packages = ['python=2.7']
+        assert main.find_env([cmd], cli) is None
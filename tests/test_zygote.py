@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import socket
+import subprocess
+
+import pytest
+from conda_shell import zygote
+from .fixtures import *
+
+
+SCRIPT = '''import os, sys
+print('{} {} {}'.format(' '.join(sys.argv[1:]), os.getcwd(),
+                        os.environ['ZYGOTE_VAR']))
+print('json' in sys.modules, file=sys.stderr)
+sys.exit(3)
+'''
+
+
+def make_env(env_dpath):
+    os.makedirs(os.path.join(env_dpath, 'bin'))
+    os.makedirs(os.path.join(env_dpath, 'conda-meta'))
+    os.symlink(sys.executable, os.path.join(env_dpath, 'bin', 'python'))
+    with open(os.path.join(env_dpath, 'conda-meta', 'history'), 'w') as fp:
+        fp.write('# cmd: conda create -n env python\n')
+
+
+def wait_for(socket_fpath):
+    for _ in range(100):
+        if os.path.exists(socket_fpath):
+            return
+        time.sleep(0.1)
+    raise AssertionError('The zygote did not start')
+
+
+@pytest.mark.skipif(not hasattr(socket.socket, 'sendmsg'),
+                    reason='Passing file descriptors needs Python 3.3+')
+class TestZygote(object):
+    def test_run_script(self, tmp_dir, monkeypatch, capfd):
+        """Test that scripts are run by a zygote once it has started, and
+        that the zygote is replaced when the environment changes.
+        """
+        monkeypatch.setenv('XDG_RUNTIME_DIR', tmp_dir.name)
+        monkeypatch.setenv('CONDA_SHELL_ZYGOTE_TIMEOUT', '5')
+        env_dpath = os.path.join(tmp_dir.name, 'envs', 'shell_abc')
+        make_env(env_dpath)
+        script_fpath = os.path.join(tmp_dir.name, 'script.py')
+        with open(script_fpath, 'w') as fp:
+            fp.write(SCRIPT)
+        run_cmd = ['python', script_fpath, 'a', 'b']
+        env_vars = dict(os.environ, ZYGOTE_VAR='zygote')
+
+        python_fpath = os.path.join(env_dpath, 'bin', 'python')
+        socket_fpath = zygote.get_socket_fpath(env_dpath, python_fpath,
+                                               ['json'])
+        assert zygote.run_script(env_dpath, env_vars, run_cmd,
+                                 ['json']) is None
+        wait_for(socket_fpath)
+
+        monkeypatch.chdir(tmp_dir.name)
+        assert zygote.run_script(env_dpath, env_vars, run_cmd,
+                                 ['json']) == 3
+        out, err = capfd.readouterr()
+        assert out == 'a b {} zygote\n'.format(os.getcwd())
+        assert err == 'True\n'
+
+        # The environment changed
+        history_fpath = os.path.join(env_dpath, 'conda-meta', 'history')
+        mtime = os.path.getmtime(history_fpath) + 10
+        os.utime(history_fpath, (mtime, mtime))
+        assert zygote.run_in_zygote(socket_fpath, run_cmd[1:],
+                                    env_vars) is None
+        assert (zygote.get_socket_fpath(env_dpath, python_fpath, ['json']) !=
+                socket_fpath)
+        for _ in range(50):
+            if not os.path.exists(socket_fpath):
+                break
+            time.sleep(0.1)
+        assert not os.path.exists(socket_fpath)
+        # The lock file is left in place, unlocked
+        for _ in range(50):
+            if not zygote.is_zygote_running(socket_fpath):
+                break
+            time.sleep(0.1)
+        assert not zygote.is_zygote_running(socket_fpath)
+        assert os.path.exists(socket_fpath + zygote.LOCK_SUFFIX)
+
+    def test_single_zygote(self, tmp_dir, monkeypatch, capfd):
+        """Test that runs which come while a zygote imports its modules don't
+        start more zygotes.
+        """
+        monkeypatch.setenv('XDG_RUNTIME_DIR', tmp_dir.name)
+        monkeypatch.setenv('CONDA_SHELL_ZYGOTE_TIMEOUT', '5')
+        env_dpath = os.path.join(tmp_dir.name, 'envs', 'shell_abc')
+        make_env(env_dpath)
+        with open(os.path.join(tmp_dir.name, 'slowmod.py'), 'w') as fp:
+            fp.write('import time\ntime.sleep(1.5)\n')
+        script_fpath = os.path.join(tmp_dir.name, 'script.py')
+        with open(script_fpath, 'w') as fp:
+            fp.write(SCRIPT)
+        run_cmd = ['python', script_fpath]
+        env_vars = dict(os.environ, ZYGOTE_VAR='zygote',
+                        PYTHONPATH=tmp_dir.name)
+        python_fpath = os.path.join(env_dpath, 'bin', 'python')
+        socket_fpath = zygote.get_socket_fpath(env_dpath, python_fpath,
+                                               ['slowmod'])
+
+        assert zygote.run_script(env_dpath, env_vars, run_cmd,
+                                 ['slowmod']) is None
+        for _ in range(50):
+            if zygote.is_zygote_running(socket_fpath):
+                break
+            time.sleep(0.02)
+        assert zygote.is_zygote_running(socket_fpath)
+        assert not os.path.exists(socket_fpath)
+
+        def start_zygote(*args, **kwargs):
+            raise AssertionError('Started another zygote')
+        monkeypatch.setattr(zygote, 'start_zygote', start_zygote)
+        assert zygote.run_script(env_dpath, env_vars, run_cmd,
+                                 ['slowmod']) is None
+        # A server started anyway exits right away
+        assert subprocess.call(
+            [sys.executable, zygote.SERVER_FPATH, socket_fpath, 'slowmod',
+             '5', ''], env=env_vars, timeout=1
+        ) == 0
+
+        wait_for(socket_fpath)
+        assert zygote.run_script(env_dpath, env_vars, run_cmd,
+                                 ['slowmod']) == 3
+
+    def test_get_env_python(self, tmp_dir):
+        """Test that only the environment's Python interpreters are served by
+        zygotes.
+        """
+        env_dpath = os.path.join(tmp_dir.name, 'shell_abc')
+        make_env(env_dpath)
+        assert (zygote.get_env_python(env_dpath, 'python') ==
+                os.path.join(env_dpath, 'bin', 'python'))
+        assert zygote.get_env_python(env_dpath, 'python3.6') is None
+        assert zygote.get_env_python(env_dpath, 'bash') is None